@@ -2,11 +2,22 @@
 Application Flask principale pour la gestion des DUERP
 """
 import os
-from flask import Flask, jsonify
+from flask import Flask, jsonify, Response
 from flask_cors import CORS
 
 from app.models import db
-from app.routes import duerp_bp, unite_bp, risque_bp, mesure_bp
+from app.routes import duerp_bp, unite_bp, risque_bp, mesure_bp, recherche_bp, batch_bp
+from app.services.admission import init_admission
+from app.services.cache import response_cache
+from app.services.coalescing import coalescer
+from app.services.compression import init_compression
+from app.services.metrics import metrics
+from app.services.schema import init_schema
+from app.services.scoring import load_models
+from app.services.serialization import serializer
+from app.services.slow_queries import init_slow_queries
+from app.services.tracing import tracer
+from app.services.warmup import init_warmup
 from config.settings import config
 
 
@@ -31,15 +42,35 @@ def create_app(config_name='default'):
     # Initialiser la base de données
     db.init_app(app)
 
-    # Créer les dossiers nécessaires
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    os.makedirs(app.config['GENERATED_DOCS_FOLDER'], exist_ok=True)
+    # Journal des requêtes SQL lentes et des parcours complets de tables
+    init_slow_queries(app)
+
+    # Traçage échantillonné des requêtes (route, SQL, génération de documents)
+    tracer.init_app(app)
+
+    # Initialiser le cache des réponses
+    response_cache.init_app(app)
+
+    # Encodeur JSON des réponses volumineuses et compression des réponses
+    serializer.init_app(app)
+    init_compression(app)
+
+    # Regroupement des calculs identiques simultanés
+    coalescer.init_app(app)
+
+    # Limiteurs de concurrence des traitements coûteux
+    init_admission(app)
+
+    # Charger les modèles de cotation des risques
+    load_models(app)
 
     # Enregistrer les blueprints
     app.register_blueprint(duerp_bp)
     app.register_blueprint(unite_bp)
     app.register_blueprint(risque_bp)
     app.register_blueprint(mesure_bp)
+    app.register_blueprint(recherche_bp)
+    app.register_blueprint(batch_bp)
 
     # Route racine
     @app.route('/')
@@ -51,7 +82,9 @@ def create_app(config_name='default'):
                 'duerp': '/api/duerp',
                 'unites': '/api/unite',
                 'risques': '/api/risque',
-                'mesures': '/api/mesure'
+                'mesures': '/api/mesure',
+                'recherche': '/api/recherche',
+                'batch': '/api/batch'
             }
         })
 
@@ -63,6 +96,11 @@ def create_app(config_name='default'):
             'database': 'connected'
         })
 
+    # Métriques (format texte Prometheus)
+    @app.route('/metrics')
+    def metrics_endpoint():
+        return Response(metrics.to_prometheus(), mimetype='text/plain; version=0.0.4')
+
     # Gestionnaire d'erreurs
     @app.errorhandler(404)
     def not_found(error):
@@ -78,9 +116,13 @@ def create_app(config_name='default'):
             'error': 'Erreur interne du serveur'
         }), 500
 
-    # Créer les tables si elles n'existent pas
+    # Vérifier la version du schéma (tables et index plein texte créés si
+    # la base n'est pas à jour)
     with app.app_context():
-        db.create_all()
+        app.extensions['recherche_fts'] = init_schema(app)
+
+    # Préchargement optionnel des moteurs de documents
+    init_warmup(app)
 
     return app
 
@@ -89,6 +131,12 @@ if __name__ == '__main__':
     # Obtenir le nom de l'environnement
     env = os.getenv('FLASK_ENV', 'development')
 
+    if env == 'production':
+        # Serveur multi-processus : l'application est créée dans chaque worker
+        from server import serve
+        serve(create_app, env)
+        raise SystemExit(0)
+
     # Créer l'application
     app = create_app(env)
 
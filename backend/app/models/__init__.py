@@ -6,6 +6,8 @@ from flask_sqlalchemy import SQLAlchemy
 db = SQLAlchemy()
 
 # Import models
-from .duerp import DUERP, UniteTrail, Risque, MesurePrevention, EvaluationHistorique
+from .duerp import DUERP, UniteTrail, Risque, MesurePrevention, EvaluationHistorique, SnapshotBloc
+from .idempotence import CleIdempotence
+from .publication import Publication
 
-__all__ = ['db', 'DUERP', 'UniteTrail', 'Risque', 'MesurePrevention', 'EvaluationHistorique']
+__all__ = ['db', 'DUERP', 'UniteTrail', 'Risque', 'MesurePrevention', 'EvaluationHistorique', 'SnapshotBloc', 'CleIdempotence', 'Publication']
@@ -2,7 +2,10 @@
 Modèles de données pour le DUERP (Document Unique d'Évaluation des Risques Professionnels)
 """
 from datetime import datetime
+from sqlalchemy import event, or_, select, update
+from sqlalchemy.orm import Session
 from . import db
+from ..services.scoring import get_active_model, get_models
 
 
 class DUERP(db.Model):
@@ -32,16 +35,28 @@ class DUERP(db.Model):
     # Statut du document
     statut = db.Column(db.String(20), default='brouillon')  # brouillon, validé, archivé
 
+    # Révision des données : incrémentée à chaque modification du DUERP ou de
+    # son arborescence (unités, risques, mesures), sert de clé de cache
+    revision = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    # DUERP dont celui-ci est la nouvelle version (réévaluation)
+    origine_id = db.Column(db.Integer)
+
+    # Version de la ligne, contrôlée à chaque mise à jour (verrouillage optimiste)
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
+
     # Relations
     unites_travail = db.relationship('UniteTrail', backref='duerp', lazy=True, cascade='all, delete-orphan')
     historique = db.relationship('EvaluationHistorique', backref='duerp', lazy=True, cascade='all, delete-orphan')
+    publications = db.relationship('Publication', lazy=True, cascade='all, delete-orphan')
 
     def __repr__(self):
         return f'<DUERP {self.entreprise_nom} - v{self.version}>'
 
-    def to_dict(self):
+    def to_dict(self, include_unites=True):
         """Convertit l'objet en dictionnaire"""
-        return {
+        data = {
             'id': self.id,
             'entreprise_nom': self.entreprise_nom,
             'entreprise_siret': self.entreprise_siret,
@@ -55,8 +70,13 @@ class DUERP(db.Model):
             'responsable_evaluation': self.responsable_evaluation,
             'responsable_validation': self.responsable_validation,
             'statut': self.statut,
-            'unites_travail': [unite.to_dict() for unite in self.unites_travail]
+            'revision': self.revision,
+            'origine_id': self.origine_id,
+            'version_id': self.version_id
         }
+        if include_unites:
+            data['unites_travail'] = [unite.to_dict() for unite in self.unites_travail]
+        return data
 
 
 class UniteTrail(db.Model):
@@ -64,10 +84,21 @@ class UniteTrail(db.Model):
     Unité de travail (service, atelier, poste, etc.)
     """
     __tablename__ = 'unite_travail'
+    __table_args__ = (
+        # Sert aussi la correspondance des unités lors de la copie d'un DUERP
+        db.Index('ix_unite_duerp_origine', 'duerp_id', 'origine_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     duerp_id = db.Column(db.Integer, db.ForeignKey('duerp.id'), nullable=False)
 
+    # Identifiant de l'unité d'origine, commun à toutes les versions successives
+    origine_id = db.Column(db.Integer)
+
+    # Version de la ligne, contrôlée à chaque mise à jour (verrouillage optimiste)
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
+
     nom = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     localisation = db.Column(db.String(200))
@@ -79,16 +110,19 @@ class UniteTrail(db.Model):
     def __repr__(self):
         return f'<UniteTrail {self.nom}>'
 
-    def to_dict(self):
+    def to_dict(self, include_risques=True):
         """Convertit l'objet en dictionnaire"""
-        return {
+        data = {
             'id': self.id,
             'nom': self.nom,
             'description': self.description,
             'localisation': self.localisation,
             'nombre_employes': self.nombre_employes,
-            'risques': [risque.to_dict() for risque in self.risques]
+            'version_id': self.version_id
         }
+        if include_risques:
+            data['risques'] = [risque.to_dict() for risque in self.risques]
+        return data
 
 
 class Risque(db.Model):
@@ -96,10 +130,26 @@ class Risque(db.Model):
     Risque professionnel identifié dans une unité de travail
     """
     __tablename__ = 'risque'
+    __table_args__ = (
+        # Index de recherche : chaque filtre est suivi de (criticite, id) pour
+        # servir le tri et la pagination par curseur sans table temporaire
+        db.Index('ix_risque_criticite', 'criticite', 'id'),
+        db.Index('ix_risque_unite_criticite', 'unite_travail_id', 'criticite', 'id'),
+        db.Index('ix_risque_categorie_criticite', 'categorie', 'criticite', 'id'),
+        db.Index('ix_risque_niveau_criticite', 'niveau_risque', 'criticite', 'id'),
+        db.Index('ix_risque_frequence_criticite', 'frequence_exposition', 'criticite', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     unite_travail_id = db.Column(db.Integer, db.ForeignKey('unite_travail.id'), nullable=False)
 
+    # Identifiant du risque d'origine, commun à toutes les versions successives
+    origine_id = db.Column(db.Integer, index=True)
+
+    # Version de la ligne, contrôlée à chaque mise à jour (verrouillage optimiste)
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
+
     # Classification du risque
     categorie = db.Column(db.String(100), nullable=False)  # Mécanique, Chimique, Biologique, Psychosocial, etc.
     sous_categorie = db.Column(db.String(100))
@@ -116,6 +166,7 @@ class Risque(db.Model):
     # Criticité calculée
     criticite = db.Column(db.Integer)  # gravité × probabilité
     niveau_risque = db.Column(db.String(20))  # Acceptable, Modéré, Important, Critique
+    version_cotation = db.Column(db.String(20))  # Version du modèle de cotation appliqué
 
     # Population exposée
     personnes_exposees = db.Column(db.Integer)
@@ -129,26 +180,30 @@ class Risque(db.Model):
         self.calculer_criticite()
 
     def calculer_criticite(self):
-        """Calcule la criticité et le niveau de risque"""
+        """
+        Calcule la criticité et le niveau de risque
+
+        Un risque déjà coté reste coté par son modèle (version_cotation) : seule
+        la recotation change de modèle. Un nouveau risque, ou un risque dont le
+        modèle n'est plus déclaré, est coté par le modèle actif.
+        """
         if self.gravite and self.probabilite:
-            self.criticite = self.gravite * self.probabilite
-
-            # Détermination du niveau de risque
-            if self.criticite <= 2:
-                self.niveau_risque = 'Acceptable'
-            elif self.criticite <= 6:
-                self.niveau_risque = 'Modéré'
-            elif self.criticite <= 12:
-                self.niveau_risque = 'Important'
-            else:
-                self.niveau_risque = 'Critique'
+            modele = get_models().get(self.version_cotation) or get_active_model()
+            self.criticite = modele.criticite(self.gravite, self.probabilite, self.frequence_exposition)
+            self.niveau_risque = modele.niveau(self.criticite)
+            self.version_cotation = modele.version
+
+    @staticmethod
+    def niveau_pour_criticite(criticite):
+        """Détermine le niveau de risque correspondant à une criticité"""
+        return get_active_model().niveau(criticite)
 
     def __repr__(self):
         return f'<Risque {self.categorie} - Criticité: {self.criticite}>'
 
-    def to_dict(self):
+    def to_dict(self, include_mesures=True):
         """Convertit l'objet en dictionnaire"""
-        return {
+        data = {
             'id': self.id,
             'categorie': self.categorie,
             'sous_categorie': self.sous_categorie,
@@ -159,10 +214,14 @@ class Risque(db.Model):
             'frequence_exposition': self.frequence_exposition,
             'criticite': self.criticite,
             'niveau_risque': self.niveau_risque,
+            'version_cotation': self.version_cotation,
             'personnes_exposees': self.personnes_exposees,
             'personnes_concernees': self.personnes_concernees,
-            'mesures_prevention': [mesure.to_dict() for mesure in self.mesures_prevention]
+            'version_id': self.version_id
         }
+        if include_mesures:
+            data['mesures_prevention'] = [mesure.to_dict() for mesure in self.mesures_prevention]
+        return data
 
 
 class MesurePrevention(db.Model):
@@ -170,10 +229,21 @@ class MesurePrevention(db.Model):
     Mesure de prévention associée à un risque
     """
     __tablename__ = 'mesure_prevention'
+    __table_args__ = (
+        # Plan d'action : mesures arrivant à échéance, statut lu dans l'index
+        db.Index('ix_mesure_echeance_statut', 'date_echeance', 'statut'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     risque_id = db.Column(db.Integer, db.ForeignKey('risque.id'), nullable=False)
 
+    # Identifiant de la mesure d'origine, commun à toutes les versions successives
+    origine_id = db.Column(db.Integer)
+
+    # Version de la ligne, contrôlée à chaque mise à jour (verrouillage optimiste)
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
+
     # Type de mesure selon la hiérarchie de prévention
     type_mesure = db.Column(db.String(50), nullable=False)  # Suppression, Substitution, Collective, Individuelle, etc.
     niveau_hierarchie = db.Column(db.Integer)  # 1 (meilleure) à 5 (moins efficace)
@@ -207,7 +277,8 @@ class MesurePrevention(db.Model):
             'date_echeance': self.date_echeance.isoformat() if self.date_echeance else None,
             'responsable': self.responsable,
             'cout_estime': self.cout_estime,
-            'efficacite': self.efficacite
+            'efficacite': self.efficacite,
+            'version_id': self.version_id
         }
 
 
@@ -233,6 +304,10 @@ class EvaluationHistorique(db.Model):
     nombre_risques_critiques = db.Column(db.Integer)
     nombre_mesures_prevention = db.Column(db.Integer)
 
+    # Instantané compressé de l'arborescence (manifeste référençant les blocs d'unités)
+    snapshot = db.deferred(db.Column(db.LargeBinary))
+    snapshot_hash = db.Column(db.String(64))
+
     def __repr__(self):
         return f'<EvaluationHistorique v{self.version} - {self.date_evaluation}>'
 
@@ -247,5 +322,78 @@ class EvaluationHistorique(db.Model):
             'evaluateur': self.evaluateur,
             'nombre_risques_total': self.nombre_risques_total,
             'nombre_risques_critiques': self.nombre_risques_critiques,
-            'nombre_mesures_prevention': self.nombre_mesures_prevention
+            'nombre_mesures_prevention': self.nombre_mesures_prevention,
+            'snapshot_hash': self.snapshot_hash
         }
+
+
+class SnapshotBloc(db.Model):
+    """
+    Bloc d'instantané : sous-arborescence d'une unité de travail (risques et
+    mesures) sérialisée de façon canonique et compressée. Les blocs sont
+    adressés par leur empreinte, une unité inchangée entre deux versions
+    n'est donc stockée qu'une fois.
+    """
+    __tablename__ = 'snapshot_bloc'
+
+    hash = db.Column(db.String(64), primary_key=True)
+    contenu = db.Column(db.LargeBinary, nullable=False)
+    date_creation = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SnapshotBloc {self.hash[:12]}>'
+
+
+@event.listens_for(Session, 'before_flush')
+def _incrementer_revisions(session, flush_context, instances):
+    """
+    Incrémente la révision des DUERP dont l'arborescence est modifiée
+
+    Les objets créés, modifiés ou supprimés sont remontés jusqu'à leur DUERP
+    (mesure -> risque -> unité -> DUERP) et une seule requête UPDATE est émise.
+    """
+    duerp_ids, unite_ids, risque_ids = set(), set(), set()
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        if isinstance(obj, DUERP):
+            if obj.id is not None and obj not in session.deleted:
+                duerp_ids.add(obj.id)
+        elif isinstance(obj, UniteTrail):
+            duerp_ids.add(obj.duerp_id)
+        elif isinstance(obj, Risque):
+            unite_ids.add(obj.unite_travail_id)
+        elif isinstance(obj, MesurePrevention):
+            risque_ids.add(obj.risque_id)
+
+    duerp_ids.discard(None)
+    unite_ids.discard(None)
+    risque_ids.discard(None)
+    if not (duerp_ids or unite_ids or risque_ids):
+        return
+
+    conditions = []
+    if duerp_ids:
+        conditions.append(DUERP.id.in_(duerp_ids))
+    if unite_ids:
+        conditions.append(DUERP.id.in_(
+            select(UniteTrail.duerp_id).where(UniteTrail.id.in_(unite_ids))
+        ))
+    if risque_ids:
+        conditions.append(DUERP.id.in_(
+            select(UniteTrail.duerp_id)
+            .join(Risque, Risque.unite_travail_id == UniteTrail.id)
+            .where(Risque.id.in_(risque_ids))
+        ))
+
+    session.execute(
+        update(DUERP.__table__)
+        .where(or_(*conditions))
+        .values(revision=DUERP.__table__.c.revision + 1)
+    )
+
+    # Les révisions en mémoire sont périmées : elles seront relues à l'accès
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, DUERP) and obj not in session.deleted:
+            session.expire(obj, ['revision'])
@@ -0,0 +1,32 @@
+"""
+Modèle de stockage des clés d'idempotence des requêtes de création
+"""
+from datetime import datetime
+from . import db
+
+
+class CleIdempotence(db.Model):
+    """
+    Clé d'idempotence (en-tête Idempotency-Key) et réponse associée
+
+    Une clé est réservée avant l'exécution de la requête (statut_http vide),
+    puis complétée par la réponse, rejouée à l'identique jusqu'à expiration.
+    """
+    __tablename__ = 'cle_idempotence'
+    __table_args__ = (
+        db.UniqueConstraint('cle', 'route', name='uq_cle_idempotence_route'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    cle = db.Column(db.String(255), nullable=False)
+    route = db.Column(db.String(100), nullable=False)
+    empreinte = db.Column(db.String(64), nullable=False)  # Empreinte du corps de la requête
+
+    statut_http = db.Column(db.Integer)  # Vide tant que la requête est en cours
+    reponse = db.Column(db.Text)
+
+    date_creation = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    date_expiration = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<CleIdempotence {self.route} {self.cle}>'
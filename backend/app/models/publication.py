@@ -0,0 +1,45 @@
+"""
+Modèle des publications de DUERP validés (artefacts figés)
+"""
+from datetime import datetime
+from . import db
+
+
+class Publication(db.Model):
+    """
+    Publication d'un DUERP à sa validation
+
+    Le contenu validé (JSON de l'arborescence et document PDF) est figé dans
+    des fichiers adressés par leur empreinte SHA-256 (voir
+    services/publication.py) ; la publication associe ces empreintes à la
+    révision du DUERP validée.
+    """
+    __tablename__ = 'publication'
+    __table_args__ = (
+        db.UniqueConstraint('duerp_id', 'revision', name='uq_publication_duerp_revision'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    duerp_id = db.Column(db.Integer, db.ForeignKey('duerp.id'), nullable=False)
+    historique_id = db.Column(db.Integer, db.ForeignKey('evaluation_historique.id'))
+    revision = db.Column(db.Integer, nullable=False)
+
+    json_hash = db.Column(db.String(64), nullable=False)
+    pdf_hash = db.Column(db.String(64), nullable=False)
+
+    date_publication = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Publication DUERP {self.duerp_id} r{self.revision}>'
+
+    def to_dict(self):
+        """Convertit l'objet en dictionnaire"""
+        return {
+            'id': self.id,
+            'duerp_id': self.duerp_id,
+            'historique_id': self.historique_id,
+            'revision': self.revision,
+            'json_hash': self.json_hash,
+            'pdf_hash': self.pdf_hash,
+            'date_publication': self.date_publication.isoformat() if self.date_publication else None
+        }
@@ -8,8 +8,10 @@ duerp_bp = Blueprint('duerp', __name__, url_prefix='/api/duerp')
 unite_bp = Blueprint('unite', __name__, url_prefix='/api/unite')
 risque_bp = Blueprint('risque', __name__, url_prefix='/api/risque')
 mesure_bp = Blueprint('mesure', __name__, url_prefix='/api/mesure')
+recherche_bp = Blueprint('recherche', __name__, url_prefix='/api/recherche')
+batch_bp = Blueprint('batch', __name__, url_prefix='/api/batch')
 
 # Import routes to register them
-from . import duerp_routes, unite_routes, risque_routes, mesure_routes
+from . import duerp_routes, unite_routes, risque_routes, mesure_routes, recherche_routes, batch_routes
 
-__all__ = ['duerp_bp', 'unite_bp', 'risque_bp', 'mesure_bp']
+__all__ = ['duerp_bp', 'unite_bp', 'risque_bp', 'mesure_bp', 'recherche_bp', 'batch_bp']
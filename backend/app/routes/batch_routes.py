@@ -0,0 +1,64 @@
+"""
+Routes API pour l'exécution d'opérations groupées
+"""
+from flask import request, jsonify, current_app
+from . import batch_bp
+from ..models import db
+from ..services.admission import limite
+from ..services.idempotence import idempotent
+from ..services.operations import OperationError, run_batch
+
+
+@batch_bp.route('/', methods=['POST'])
+@limite('import')
+@idempotent
+def execute_batch():
+    """
+    Exécute une liste ordonnée d'opérations dans une seule transaction
+
+    Corps: {"operations": [{"action": "create|update|delete", "ressource":
+    "duerp|unite|risque|mesure", "id": ..., "data": {...}}]}. Une valeur "$N"
+    désigne l'identifiant de l'objet créé par l'opération N. Si une opération
+    échoue, aucune n'est appliquée.
+    """
+    try:
+        data = request.get_json() or {}
+        liste_operations = data.get('operations')
+
+        if not isinstance(liste_operations, list) or not liste_operations:
+            return jsonify({
+                'success': False,
+                'error': 'operations doit être une liste non vide'
+            }), 400
+
+        maximum = current_app.config.get('BATCH_MAX_OPERATIONS', 500)
+        if len(liste_operations) > maximum:
+            return jsonify({
+                'success': False,
+                'error': f'Nombre maximal d\'opérations dépassé ({maximum})'
+            }), 400
+
+        resultats = run_batch(db.session, liste_operations)
+        db.session.commit()
+
+        return jsonify({
+            'success': True,
+            'data': resultats
+        }), 200
+
+    except OperationError as e:
+        db.session.rollback()
+        reponse = {
+            'success': False,
+            'error': str(e),
+            'operation': e.operation
+        }
+        if e.data is not None:
+            reponse['data'] = e.data
+        return jsonify(reponse), e.status
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
@@ -1,22 +1,60 @@
 """
 Routes API pour la gestion des DUERP
 """
-from flask import request, jsonify, send_file
-from datetime import datetime
+import os
+from flask import request, jsonify, send_file, current_app, abort
+from datetime import date, datetime
+from functools import partial
+from io import BytesIO
 from . import duerp_bp
+from .pagination import ParametreInvalide, lire_format, lire_liste
 from ..models import db, DUERP, EvaluationHistorique
-from ..services.document_generator import DUERPDocumentGenerator
+from ..services import operations
+from ..services.admission import AdmissionRefusee, admission, limite, refus_response
+from ..services.cache import response_cache, data_version
+from ..services.clone import clone_duerp
+from ..services.coalescing import coalescer
+from ..services.compression import PrecompressedPayload
+from ..services.idempotence import idempotent
+from ..services.operations import OperationError
+from ..services.portfolio import select_duerps, compute_portfolio
+from ..services.publication import (
+    EMPREINTE, artifact_path, publish, published_state, render_publication_pdf, send_artifact
+)
+from ..services.read_model import load_duerp
+from ..services.render_profile import record_render
+from ..services.scoring import get_active_model
+from ..services.serialization import CHAMPS_DUERP, columns, duerp_trees, serializer
+from ..services.snapshots import save_snapshot, load_snapshot_entry, diff_snapshots
+from ..services.tracing import span
 
 
 @duerp_bp.route('/', methods=['GET'])
 def get_all_duerp():
-    """Récupère tous les DUERP"""
+    """
+    Récupère tous les DUERP avec leur arborescence
+
+    Avec format=colonnes, seules les informations des DUERP (sans les unités
+    de travail) sont renvoyées, en un tableau de valeurs par champ.
+    """
     try:
-        duerps = DUERP.query.all()
-        return jsonify({
+        if lire_format() == 'colonnes':
+            lignes = db.session.execute(
+                db.select(*[getattr(DUERP, c) for c in CHAMPS_DUERP]).order_by(DUERP.id)
+            ).all()
+            data = columns(CHAMPS_DUERP, lignes)
+        else:
+            data = duerp_trees(db.session)
+
+        return serializer.response({
             'success': True,
-            'data': [duerp.to_dict() for duerp in duerps]
+            'data': data
         }), 200
+    except ParametreInvalide as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -26,13 +64,43 @@ def get_all_duerp():
 
 @duerp_bp.route('/<int:duerp_id>', methods=['GET'])
 def get_duerp(duerp_id):
-    """Récupère un DUERP spécifique par son ID"""
+    """
+    Récupère un DUERP spécifique par son ID
+
+    Un DUERP validé est servi depuis ses artefacts publiés (voir
+    services/publication.py). Sinon, la réponse sérialisée et compressée est
+    mise en cache pour la révision courante du DUERP.
+
+    L'ETag est la version de ligne du DUERP (version_id), à renvoyer dans
+    l'en-tête If-Match d'une modification.
+    """
     try:
-        duerp = DUERP.query.get_or_404(duerp_id)
-        return jsonify({
-            'success': True,
-            'data': duerp.to_dict()
-        }), 200
+        etat = published_state(db.session, duerp_id)
+        if etat is None:
+            abort(404)
+        revision = etat.revision
+        etag = str(etat.version_id)
+
+        # Révision validée et publiée : servie depuis le fichier figé. La
+        # validation incrémente la version de ligne : une version ne désigne
+        # qu'un contenu publié, la revalidation (304) par l'ETag reste exacte
+        if etat.json_hash:
+            reponse = send_artifact(etat.json_hash, 'json', etag=etag)
+            if reponse is not None:
+                return reponse
+
+        payload = response_cache.get(('duerp', duerp_id, revision))
+        if payload is None:
+            arbres = duerp_trees(db.session, duerp_id)
+            if not arbres:
+                abort(404)
+            payload = PrecompressedPayload(serializer.dumps({
+                'success': True,
+                'data': arbres[0]
+            }))
+            response_cache.set(('duerp', duerp_id, revision), payload)
+
+        return payload.response(etag=etag), 200
     except Exception as e:
         return jsonify({
             'success': False,
@@ -41,46 +109,13 @@ def get_duerp(duerp_id):
 
 
 @duerp_bp.route('/', methods=['POST'])
+@idempotent
 def create_duerp():
     """Crée un nouveau DUERP"""
     try:
         data = request.get_json()
 
-        # Validation des données obligatoires
-        if not data.get('entreprise_nom'):
-            return jsonify({
-                'success': False,
-                'error': 'Le nom de l\'entreprise est obligatoire'
-            }), 400
-
-        # Création du DUERP
-        duerp = DUERP(
-            entreprise_nom=data.get('entreprise_nom'),
-            entreprise_siret=data.get('entreprise_siret'),
-            entreprise_adresse=data.get('entreprise_adresse'),
-            entreprise_activite=data.get('entreprise_activite'),
-            effectif=data.get('effectif'),
-            version=data.get('version', '1.0'),
-            responsable_evaluation=data.get('responsable_evaluation'),
-            responsable_validation=data.get('responsable_validation'),
-            statut='brouillon'
-        )
-
-        db.session.add(duerp)
-        db.session.commit()
-
-        # Créer une entrée dans l'historique
-        historique = EvaluationHistorique(
-            duerp_id=duerp.id,
-            version=duerp.version,
-            type_modification='Création',
-            description_modifications='Création initiale du DUERP',
-            evaluateur=data.get('responsable_evaluation', 'Non spécifié'),
-            nombre_risques_total=0,
-            nombre_risques_critiques=0,
-            nombre_mesures_prevention=0
-        )
-        db.session.add(historique)
+        duerp = operations.create_duerp(db.session, data)
         db.session.commit()
 
         return jsonify({
@@ -89,6 +124,12 @@ def create_duerp():
             'message': 'DUERP créé avec succès'
         }), 201
 
+    except OperationError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), e.status
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -101,48 +142,30 @@ def create_duerp():
 def update_duerp(duerp_id):
     """Met à jour un DUERP existant"""
     try:
-        duerp = DUERP.query.get_or_404(duerp_id)
         data = request.get_json()
+        version = operations.version_from_etag(request.headers.get('If-Match'))
 
-        # Mise à jour des champs
-        if 'entreprise_nom' in data:
-            duerp.entreprise_nom = data['entreprise_nom']
-        if 'entreprise_siret' in data:
-            duerp.entreprise_siret = data['entreprise_siret']
-        if 'entreprise_adresse' in data:
-            duerp.entreprise_adresse = data['entreprise_adresse']
-        if 'entreprise_activite' in data:
-            duerp.entreprise_activite = data['entreprise_activite']
-        if 'effectif' in data:
-            duerp.effectif = data['effectif']
-        if 'responsable_evaluation' in data:
-            duerp.responsable_evaluation = data['responsable_evaluation']
-        if 'responsable_validation' in data:
-            duerp.responsable_validation = data['responsable_validation']
-        if 'statut' in data:
-            duerp.statut = data['statut']
-
-        duerp.date_derniere_maj = datetime.utcnow()
-
-        # Créer une entrée dans l'historique
-        if data.get('create_history', True):
-            historique = EvaluationHistorique(
-                duerp_id=duerp.id,
-                version=duerp.version,
-                type_modification='Mise à jour',
-                description_modifications=data.get('description_modifications', 'Mise à jour des informations'),
-                evaluateur=data.get('evaluateur', duerp.responsable_evaluation)
-            )
-            db.session.add(historique)
-
+        duerp = operations.update_object(db.session, 'duerp', duerp_id, data, version)
         db.session.commit()
 
-        return jsonify({
+        reponse = jsonify({
             'success': True,
             'data': duerp.to_dict(),
             'message': 'DUERP mis à jour avec succès'
-        }), 200
+        })
+        reponse.set_etag(str(duerp.version_id))
+        return reponse, 200
 
+    except OperationError as e:
+        db.session.rollback()
+        reponse = {
+            'success': False,
+            'error': str(e)
+        }
+        if e.data is not None:
+            # Conflit de version : état courant de l'objet
+            reponse['data'] = e.data
+        return jsonify(reponse), e.status
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -174,13 +197,33 @@ def delete_duerp(duerp_id):
 
 @duerp_bp.route('/<int:duerp_id>/validate', methods=['POST'])
 def validate_duerp(duerp_id):
-    """Valide un DUERP (passage du statut brouillon à validé)"""
+    """
+    Valide un DUERP (passage du statut brouillon à validé)
+
+    Le contenu validé est publié : son JSON et son document PDF sont figés
+    dans des fichiers immuables, servis ensuite pour les lectures de cette
+    révision.
+    """
     try:
         duerp = DUERP.query.get_or_404(duerp_id)
         data = request.get_json()
+        maintenant = datetime.utcnow()
+
+        # PDF de la révision validée, rendu avant la transaction d'écriture
+        with admission('render'):
+            pdf, revision = render_publication_pdf(
+                db.session, duerp_id, statut='validé', date_derniere_maj=maintenant
+            )
+
+        duerp = db.session.get(DUERP, duerp_id)
+        if duerp is None or duerp.revision != revision:
+            return jsonify({
+                'success': False,
+                'error': 'Le DUERP a été modifié pendant sa validation, veuillez réessayer'
+            }), 409
 
         duerp.statut = 'validé'
-        duerp.date_derniere_maj = datetime.utcnow()
+        duerp.date_derniere_maj = maintenant
 
         # Créer une entrée dans l'historique
         historique = EvaluationHistorique(
@@ -191,14 +234,67 @@ def validate_duerp(duerp_id):
             evaluateur=data.get('validateur', duerp.responsable_validation)
         )
         db.session.add(historique)
+        save_snapshot(db.session, historique)
+
+        # Contenu validé figé (JSON et PDF) dans la même transaction
+        publication = publish(db.session, duerp.id, pdf, historique)
         db.session.commit()
 
         return jsonify({
             'success': True,
             'data': duerp.to_dict(),
+            'publication': publication.to_dict(),
             'message': 'DUERP validé avec succès'
         }), 200
 
+    except AdmissionRefusee as e:
+        db.session.rollback()
+        return refus_response(e)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@duerp_bp.route('/<int:duerp_id>/nouvelle-version', methods=['POST'])
+@limite('import')
+def create_nouvelle_version(duerp_id):
+    """
+    Crée une nouvelle version d'un DUERP (réévaluation) en copiant toute son
+    arborescence : unités de travail, risques et mesures de prévention
+    """
+    try:
+        duerp = DUERP.query.get_or_404(duerp_id)
+        data = request.get_json() or {}
+
+        date_prochaine_evaluation = None
+        if data.get('date_prochaine_evaluation'):
+            date_prochaine_evaluation = date.fromisoformat(data['date_prochaine_evaluation'])
+
+        copie = clone_duerp(
+            db.session,
+            duerp,
+            version=data.get('version'),
+            evaluateur=data.get('evaluateur'),
+            date_prochaine_evaluation=date_prochaine_evaluation
+        )
+        db.session.commit()
+
+        # L'arborescence copiée peut être volumineuse : seul l'en-tête est renvoyé
+        return jsonify({
+            'success': True,
+            'data': copie.to_dict(include_unites=False),
+            'message': f'Version {copie.version} créée avec succès'
+        }), 201
+
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -209,30 +305,83 @@ def validate_duerp(duerp_id):
 
 @duerp_bp.route('/<int:duerp_id>/generate', methods=['POST'])
 def generate_document(duerp_id):
-    """Génère le document DUERP au format PDF"""
+    """
+    Génère le document DUERP au format PDF ou DOCX
+
+    Le document est produit en mémoire et renvoyé directement ; une copie
+    n'est archivée sur disque que si la requête le demande ("archive": true).
+    Les demandes simultanées d'un même document (même DUERP, même révision,
+    même format) dans un processus partagent une seule génération ; seule
+    celle-ci est soumise au contrôle d'admission. Le PDF d'un DUERP validé n'est pas régénéré :
+    c'est le document figé à la validation qui est renvoyé.
+    """
     try:
-        duerp = DUERP.query.get_or_404(duerp_id)
         data = request.get_json() or {}
         format_type = data.get('format', 'pdf')  # pdf ou docx
 
-        generator = DUERPDocumentGenerator()
+        # Révision validée et publiée : PDF figé, servi depuis son fichier
+        if format_type == 'pdf':
+            reponse = _send_published_pdf(duerp_id, data.get('archive'))
+            if reponse is not None:
+                return reponse
+
+        # ReportLab n'est chargé qu'à la première génération
+        from ..services.document_generator import DUERPDocumentGenerator
+
+        duerp = DUERP.query.get_or_404(duerp_id)
+
+        generator = DUERPDocumentGenerator(profile_memory=current_app.config['DOCUMENT_PROFILE_MEMORY'])
+        streaming = False
 
         if format_type == 'pdf':
-            file_path = generator.generate_pdf(duerp)
+            # Mode flux demandé explicitement ou imposé par la taille du DUERP
+            streaming = data.get('streaming')
+            if streaming is None:
+                streaming = generator.count_risks(duerp) >= current_app.config['PDF_STREAMING_THRESHOLD']
+            streaming = bool(streaming)
+            generer = partial(generator.render_pdf, streaming=streaming)
+            mimetype = 'application/pdf'
         elif format_type == 'docx':
-            file_path = generator.generate_docx(duerp)
+            generer = generator.render_docx
+            mimetype = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
         else:
             return jsonify({
                 'success': False,
                 'error': 'Format non supporté. Utilisez "pdf" ou "docx"'
             }), 400
 
-        return send_file(
-            file_path,
+        def produire():
+            if streaming:
+                return generer(duerp)
+            # Chargement en une requête puis rendu hors session : la
+            # connexion est libérée pendant la mise en page
+            with span('duerp.chargement', duerp_id=duerp.id):
+                document = load_duerp(db.session, duerp.id)
+            db.session.close()
+            return generer(document)
+
+        # Document partagé entre les threads du processus seulement
+        cle = ('generate', duerp.id, duerp.revision, format_type, get_active_model().version)
+        contenu = coalescer.run(cle, produire, classe='render', partage_processus=False)
+
+        reponse = send_file(
+            BytesIO(contenu),
+            mimetype=mimetype,
             as_attachment=True,
             download_name=f'DUERP_{duerp.entreprise_nom}_{duerp.version}.{format_type}'
         )
-
+        # Profil du rendu, si cette requête l'a réalisé (et non reçu d'une
+        # génération simultanée)
+        if generator.last_profile is not None:
+            record_render(generator.last_profile)
+            reponse.headers.update(generator.last_profile.headers())
+        if data.get('archive'):
+            chemin = generator.archive(contenu, duerp, format_type)
+            reponse.headers['X-Document-Archive'] = os.path.basename(chemin)
+        return reponse
+
+    except AdmissionRefusee as e:
+        return refus_response(e)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -240,51 +389,69 @@ def generate_document(duerp_id):
         }), 500
 
 
+def _send_published_pdf(duerp_id, archiver=False):
+    """Réponse servant le PDF publié du DUERP, ou None s'il n'est pas publié"""
+    etat = published_state(db.session, duerp_id)
+    if etat is None or not etat.pdf_hash:
+        return None
+    reponse = send_artifact(
+        etat.pdf_hash, 'pdf',
+        as_attachment=True,
+        download_name=f'DUERP_{etat.entreprise_nom}_{etat.version}.pdf'
+    )
+    if reponse is None:
+        return None
+    reponse.headers['X-Document-Published'] = etat.pdf_hash
+    if archiver:
+        from ..services.document_generator import DUERPDocumentGenerator
+
+        with open(artifact_path(etat.pdf_hash, 'pdf'), 'rb') as f:
+            chemin = DUERPDocumentGenerator().archive(f.read(), etat, 'pdf')
+        reponse.headers['X-Document-Archive'] = os.path.basename(chemin)
+    return reponse
+
+
+@duerp_bp.route('/publications/<empreinte>.<any(json, pdf):extension>', methods=['GET'])
+def get_publication(empreinte, extension):
+    """
+    Artefact publié (JSON ou PDF d'un DUERP validé), désigné par son empreinte
+
+    Le contenu d'une adresse ne change jamais : la réponse peut être gardée
+    en cache sans revalidation. Aucun accès à la base.
+    """
+    reponse = send_artifact(empreinte, extension, immutable=True) if EMPREINTE.match(empreinte) else None
+    if reponse is None:
+        return jsonify({
+            'success': False,
+            'error': 'Publication non trouvée'
+        }), 404
+    return reponse
+
+
 @duerp_bp.route('/<int:duerp_id>/stats', methods=['GET'])
 def get_duerp_stats(duerp_id):
-    """Récupère les statistiques d'un DUERP"""
+    """
+    Récupère les statistiques d'un DUERP
+
+    Les demandes simultanées pour une même révision partagent un seul calcul.
+    """
     try:
         duerp = DUERP.query.get_or_404(duerp_id)
 
-        # Calcul des statistiques
-        stats = {
-            'nombre_unites': len(duerp.unites_travail),
-            'nombre_risques_total': 0,
-            'nombre_risques_par_niveau': {
-                'Acceptable': 0,
-                'Modéré': 0,
-                'Important': 0,
-                'Critique': 0
-            },
-            'nombre_mesures_prevention': 0,
-            'mesures_par_statut': {
-                'planifié': 0,
-                'en_cours': 0,
-                'réalisé': 0
-            },
-            'risques_par_categorie': {}
-        }
-
-        for unite in duerp.unites_travail:
-            for risque in unite.risques:
-                stats['nombre_risques_total'] += 1
-                stats['nombre_risques_par_niveau'][risque.niveau_risque] += 1
-
-                # Comptage par catégorie
-                if risque.categorie not in stats['risques_par_categorie']:
-                    stats['risques_par_categorie'][risque.categorie] = 0
-                stats['risques_par_categorie'][risque.categorie] += 1
+        def calculer():
+            return _compute_stats(load_duerp(db.session, duerp.id))
 
-                # Comptage des mesures
-                for mesure in risque.mesures_prevention:
-                    stats['nombre_mesures_prevention'] += 1
-                    stats['mesures_par_statut'][mesure.statut] += 1
+        stats = coalescer.run(
+            ('stats', duerp.id, duerp.revision, get_active_model().version), calculer, classe='stats'
+        )
 
         return jsonify({
             'success': True,
             'data': stats
         }), 200
 
+    except AdmissionRefusee as e:
+        return refus_response(e)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -292,6 +459,42 @@ def get_duerp_stats(duerp_id):
         }), 500
 
 
+def _compute_stats(duerp):
+    """Calcule les statistiques d'un DUERP (instance du modèle ou DUERPRecord)"""
+    stats = {
+        'nombre_unites': len(duerp.unites_travail),
+        'nombre_risques_total': 0,
+        # Niveaux du modèle de cotation actif, complétés par ceux des risques
+        # cotés par un autre modèle
+        'nombre_risques_par_niveau': dict.fromkeys(get_active_model().niveaux, 0),
+        'nombre_mesures_prevention': 0,
+        'mesures_par_statut': {
+            'planifié': 0,
+            'en_cours': 0,
+            'réalisé': 0
+        },
+        'risques_par_categorie': {}
+    }
+
+    for unite in duerp.unites_travail:
+        for risque in unite.risques:
+            stats['nombre_risques_total'] += 1
+            par_niveau = stats['nombre_risques_par_niveau']
+            par_niveau[risque.niveau_risque] = par_niveau.get(risque.niveau_risque, 0) + 1
+
+            # Comptage par catégorie
+            if risque.categorie not in stats['risques_par_categorie']:
+                stats['risques_par_categorie'][risque.categorie] = 0
+            stats['risques_par_categorie'][risque.categorie] += 1
+
+            # Comptage des mesures
+            for mesure in risque.mesures_prevention:
+                stats['nombre_mesures_prevention'] += 1
+                stats['mesures_par_statut'][mesure.statut] += 1
+
+    return stats
+
+
 @duerp_bp.route('/<int:duerp_id>/history', methods=['GET'])
 def get_duerp_history(duerp_id):
     """Récupère l'historique des modifications d'un DUERP"""
@@ -308,3 +511,113 @@ def get_duerp_history(duerp_id):
             'success': False,
             'error': str(e)
         }), 500
+
+
+@duerp_bp.route('/<int:duerp_id>/history/diff', methods=['GET'])
+@limite('stats')
+def get_duerp_history_diff(duerp_id):
+    """
+    Compare deux versions enregistrées dans l'historique
+
+    Paramètres (query string): de et a, identifiants d'entrées d'historique
+    (éventuellement d'un autre DUERP, par exemple la version de l'année
+    précédente). Par défaut, compare les deux dernières entrées du DUERP.
+    """
+    try:
+        de_id = request.args.get('de', type=int)
+        a_id = request.args.get('a', type=int)
+
+        if de_id is None or a_id is None:
+            derniers = db.session.execute(
+                db.select(EvaluationHistorique.id)
+                .where(EvaluationHistorique.duerp_id == duerp_id, EvaluationHistorique.snapshot_hash.isnot(None))
+                .order_by(EvaluationHistorique.id.desc())
+                .limit(2)
+            ).scalars().all()
+            if a_id is None:
+                a_id = derniers[0] if derniers else None
+            if de_id is None:
+                de_id = derniers[1] if len(derniers) > 1 else None
+
+        if de_id is None or a_id is None:
+            return jsonify({
+                'success': False,
+                'error': 'Au moins deux versions avec instantané sont nécessaires'
+            }), 404
+
+        entree_de = load_snapshot_entry(db.session, de_id)
+        entree_a = load_snapshot_entry(db.session, a_id)
+        for identifiant, entree in ((de_id, entree_de), (a_id, entree_a)):
+            if entree is None or entree['manifeste'] is None:
+                return jsonify({
+                    'success': False,
+                    'error': f'Aucun instantané pour l\'entrée d\'historique {identifiant}'
+                }), 404
+
+        diff = diff_snapshots(db.session, entree_de.pop('manifeste'), entree_a.pop('manifeste'))
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'de': entree_de,
+                'a': entree_a,
+                'differences': diff
+            }
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@duerp_bp.route('/portfolio', methods=['GET'])
+@limite('stats')
+def get_portfolio():
+    """
+    Tableau de bord consolidé de plusieurs DUERP
+
+    Filtres (query string): duerp_id (répétable ou séparé par des virgules)
+    et statut. La réponse porte un ETag dépendant des révisions des DUERP
+    du périmètre et de la date du jour : elle est servie depuis le cache
+    tant que les données ne changent pas.
+    """
+    try:
+        try:
+            duerp_ids = [int(v) for v in lire_liste('duerp_id')]
+        except ValueError:
+            raise ParametreInvalide('Le paramètre duerp_id doit être une liste d\'entiers')
+        statut = request.args.get('statut')
+
+        duerps = db.session.execute(select_duerps(duerp_ids, statut)).all()
+        aujourd_hui = date.today()
+        version = data_version(
+            'portfolio', aujourd_hui, statut,
+            [(d.id, d.revision) for d in duerps]
+        )
+
+        # Comparaison faible : l'ETag d'une réponse compressée est faible
+        if request.if_none_match.contains_weak(version):
+            return '', 304
+
+        payload = response_cache.get(('portfolio', version))
+        if payload is None:
+            payload = PrecompressedPayload(serializer.dumps({
+                'success': True,
+                'data': compute_portfolio(db.session, duerps, aujourd_hui)
+            }))
+            response_cache.set(('portfolio', version), payload)
+
+        return payload.response(etag=version), 200
+
+    except ParametreInvalide as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
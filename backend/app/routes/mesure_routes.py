@@ -2,58 +2,24 @@
 Routes API pour la gestion des mesures de prévention
 """
 from flask import request, jsonify
-from datetime import datetime
+from datetime import date, timedelta
+from sqlalchemy import func, or_, tuple_
 from . import mesure_bp
-from ..models import db, MesurePrevention, Risque
+from .pagination import ParametreInvalide, encoder_curseur, decoder_curseur, lire_limite, lire_entier
+from ..models import db, MesurePrevention, Risque, UniteTrail
+from ..services import operations
+from ..services.idempotence import idempotent
+from ..services.operations import OperationError
 
 
 @mesure_bp.route('/', methods=['POST'])
+@idempotent
 def create_mesure():
     """Crée une nouvelle mesure de prévention"""
     try:
         data = request.get_json()
 
-        # Validation
-        if not data.get('risque_id'):
-            return jsonify({
-                'success': False,
-                'error': 'risque_id est obligatoire'
-            }), 400
-
-        if not data.get('type_mesure'):
-            return jsonify({
-                'success': False,
-                'error': 'Le type de mesure est obligatoire'
-            }), 400
-
-        if not data.get('description'):
-            return jsonify({
-                'success': False,
-                'error': 'La description de la mesure est obligatoire'
-            }), 400
-
-        # Vérifier que le risque existe
-        risque = Risque.query.get_or_404(data['risque_id'])
-
-        # Création de la mesure
-        mesure = MesurePrevention(
-            risque_id=data['risque_id'],
-            type_mesure=data['type_mesure'],
-            niveau_hierarchie=data.get('niveau_hierarchie'),
-            description=data['description'],
-            statut=data.get('statut', 'planifié'),
-            responsable=data.get('responsable'),
-            cout_estime=data.get('cout_estime'),
-            efficacite=data.get('efficacite')
-        )
-
-        # Dates
-        if data.get('date_mise_en_oeuvre'):
-            mesure.date_mise_en_oeuvre = datetime.fromisoformat(data['date_mise_en_oeuvre'])
-        if data.get('date_echeance'):
-            mesure.date_echeance = datetime.fromisoformat(data['date_echeance'])
-
-        db.session.add(mesure)
+        mesure = operations.create_mesure(db.session, data)
         db.session.commit()
 
         return jsonify({
@@ -62,6 +28,12 @@ def create_mesure():
             'message': 'Mesure de prévention créée avec succès'
         }), 201
 
+    except OperationError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), e.status
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -75,10 +47,12 @@ def get_mesure(mesure_id):
     """Récupère une mesure de prévention par son ID"""
     try:
         mesure = MesurePrevention.query.get_or_404(mesure_id)
-        return jsonify({
+        reponse = jsonify({
             'success': True,
             'data': mesure.to_dict()
-        }), 200
+        })
+        reponse.set_etag(str(mesure.version_id))
+        return reponse, 200
     except Exception as e:
         return jsonify({
             'success': False,
@@ -90,38 +64,30 @@ def get_mesure(mesure_id):
 def update_mesure(mesure_id):
     """Met à jour une mesure de prévention"""
     try:
-        mesure = MesurePrevention.query.get_or_404(mesure_id)
         data = request.get_json()
+        version = operations.version_from_etag(request.headers.get('If-Match'))
 
-        if 'type_mesure' in data:
-            mesure.type_mesure = data['type_mesure']
-        if 'niveau_hierarchie' in data:
-            mesure.niveau_hierarchie = data['niveau_hierarchie']
-        if 'description' in data:
-            mesure.description = data['description']
-        if 'statut' in data:
-            mesure.statut = data['statut']
-        if 'responsable' in data:
-            mesure.responsable = data['responsable']
-        if 'cout_estime' in data:
-            mesure.cout_estime = data['cout_estime']
-        if 'efficacite' in data:
-            mesure.efficacite = data['efficacite']
-
-        # Dates
-        if 'date_mise_en_oeuvre' in data:
-            mesure.date_mise_en_oeuvre = datetime.fromisoformat(data['date_mise_en_oeuvre']) if data['date_mise_en_oeuvre'] else None
-        if 'date_echeance' in data:
-            mesure.date_echeance = datetime.fromisoformat(data['date_echeance']) if data['date_echeance'] else None
-
+        mesure = operations.update_object(db.session, 'mesure', mesure_id, data, version)
         db.session.commit()
 
-        return jsonify({
+        reponse = jsonify({
             'success': True,
             'data': mesure.to_dict(),
             'message': 'Mesure de prévention mise à jour avec succès'
-        }), 200
+        })
+        reponse.set_etag(str(mesure.version_id))
+        return reponse, 200
 
+    except OperationError as e:
+        db.session.rollback()
+        reponse = {
+            'success': False,
+            'error': str(e)
+        }
+        if e.data is not None:
+            # Conflit de version : état courant de l'objet
+            reponse['data'] = e.data
+        return jsonify(reponse), e.status
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -151,6 +117,115 @@ def delete_mesure(mesure_id):
         }), 500
 
 
+@mesure_bp.route('/plan-action', methods=['GET'])
+def get_plan_action():
+    """
+    Plan d'action : mesures non réalisées en retard ou arrivant à échéance
+
+    Paramètres (query string): duerp_id (optionnel), jours (horizon en jours,
+    30 par défaut), limit et cursor. Les mesures sont regroupées par
+    responsable puis triées par criticité décroissante du risque associé.
+    """
+    try:
+        limite = lire_limite()
+        jours = lire_entier('jours')
+        if jours is None:
+            jours = 30
+        if jours < 0:
+            raise ParametreInvalide('Le paramètre jours doit être positif')
+
+        aujourd_hui = date.today()
+        date_limite = aujourd_hui + timedelta(days=jours)
+
+        # Clé de tri : responsable, criticité décroissante, échéance, id
+        cle_responsable = func.coalesce(MesurePrevention.responsable, '')
+        cle_criticite = -func.coalesce(Risque.criticite, 0)
+
+        query = db.session.query(
+            MesurePrevention, Risque.criticite, Risque.niveau_risque,
+            UniteTrail.id, UniteTrail.duerp_id
+        ).join(
+            Risque, MesurePrevention.risque_id == Risque.id
+        ).join(
+            UniteTrail, Risque.unite_travail_id == UniteTrail.id
+        ).filter(
+            # Plage de l'index (date_echeance, statut) ; le tri par responsable
+            # et criticité porte ensuite sur les seules mesures retenues
+            MesurePrevention.date_echeance <= date_limite,
+            or_(MesurePrevention.statut.is_(None), MesurePrevention.statut != 'réalisé')
+        )
+
+        duerp_id = lire_entier('duerp_id')
+        if duerp_id is not None:
+            query = query.filter(UniteTrail.duerp_id == duerp_id)
+
+        cle = tuple_(cle_responsable, cle_criticite, MesurePrevention.date_echeance, MesurePrevention.id)
+        if request.args.get('cursor'):
+            responsable, criticite, echeance, mesure_id = decoder_curseur(request.args['cursor'], 4)
+            try:
+                echeance = date.fromisoformat(echeance)
+            except (TypeError, ValueError):
+                raise ParametreInvalide('Curseur de pagination invalide')
+            query = query.filter(cle > tuple_(responsable, criticite, echeance, mesure_id))
+
+        lignes = query.order_by(
+            cle_responsable, cle_criticite, MesurePrevention.date_echeance, MesurePrevention.id
+        ).limit(limite + 1).all()
+        page = lignes[:limite]
+
+        groupes = []
+        for mesure, criticite, niveau_risque, unite_id, mesure_duerp_id in page:
+            responsable = mesure.responsable or ''
+            if not groupes or groupes[-1]['responsable'] != responsable:
+                groupes.append({'responsable': responsable, 'mesures': []})
+
+            item = mesure.to_dict()
+            item.update({
+                'risque_id': mesure.risque_id,
+                'criticite': criticite,
+                'niveau_risque': niveau_risque,
+                'unite_travail_id': unite_id,
+                'duerp_id': mesure_duerp_id,
+                'en_retard': mesure.date_echeance < aujourd_hui,
+                'jours_restants': (mesure.date_echeance - aujourd_hui).days
+            })
+            groupes[-1]['mesures'].append(item)
+
+        next_cursor = None
+        if len(lignes) > limite:
+            dernier, criticite = page[-1][0], page[-1][1]
+            next_cursor = encoder_curseur([
+                dernier.responsable or '',
+                -(criticite or 0),
+                dernier.date_echeance.isoformat(),
+                dernier.id
+            ])
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'date_reference': aujourd_hui.isoformat(),
+                'date_limite': date_limite.isoformat(),
+                'groupes': groupes
+            },
+            'pagination': {
+                'limit': limite,
+                'next_cursor': next_cursor
+            }
+        }), 200
+
+    except ParametreInvalide as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 @mesure_bp.route('/types', methods=['GET'])
 def get_types_mesures():
     """Récupère la liste des types de mesures selon la hiérarchie de prévention"""
@@ -0,0 +1,92 @@
+"""
+Utilitaires de pagination par curseur (keyset) pour les routes de liste
+"""
+import base64
+import json
+
+from flask import request
+
+LIMITE_PAR_DEFAUT = 50
+LIMITE_MAX = 500
+
+# Formats de sortie des listes : un objet par élément, ou un tableau par champ
+FORMATS_LISTE = ('objets', 'colonnes')
+
+
+class ParametreInvalide(ValueError):
+    """Paramètre de requête invalide (renvoyé en 400 par les routes)"""
+
+
+def encoder_curseur(valeurs):
+    """
+    Encode la clé de tri du dernier élément d'une page en curseur opaque
+
+    Args:
+        valeurs: Liste des valeurs de la clé de tri (ex: [criticite, id])
+
+    Returns:
+        str: Curseur encodé en base64 (compatible URL)
+    """
+    brut = json.dumps(valeurs, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(brut).decode('ascii').rstrip('=')
+
+
+def decoder_curseur(curseur, taille):
+    """
+    Décode un curseur produit par encoder_curseur
+
+    Args:
+        curseur: Curseur reçu du client
+        taille: Nombre de valeurs attendues dans la clé de tri
+
+    Returns:
+        list: Valeurs de la clé de tri
+    """
+    try:
+        brut = base64.urlsafe_b64decode(curseur + '=' * (-len(curseur) % 4))
+        valeurs = json.loads(brut.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        raise ParametreInvalide('Curseur de pagination invalide')
+
+    if not isinstance(valeurs, list) or len(valeurs) != taille:
+        raise ParametreInvalide('Curseur de pagination invalide')
+    return valeurs
+
+
+def lire_limite():
+    """Lit le paramètre 'limit' de la requête en le bornant à LIMITE_MAX"""
+    try:
+        limite = int(request.args.get('limit', LIMITE_PAR_DEFAUT))
+    except ValueError:
+        raise ParametreInvalide('Le paramètre limit doit être un entier')
+
+    if limite < 1:
+        raise ParametreInvalide('Le paramètre limit doit être strictement positif')
+    return min(limite, LIMITE_MAX)
+
+
+def lire_entier(nom):
+    """Lit un paramètre entier optionnel de la requête"""
+    valeur = request.args.get(nom)
+    if valeur is None or valeur == '':
+        return None
+    try:
+        return int(valeur)
+    except ValueError:
+        raise ParametreInvalide(f'Le paramètre {nom} doit être un entier')
+
+
+def lire_format():
+    """Lit le paramètre 'format' des routes de liste (objets par défaut, ou colonnes)"""
+    valeur = request.args.get('format', 'objets')
+    if valeur not in FORMATS_LISTE:
+        raise ParametreInvalide('Le paramètre format doit valoir "objets" ou "colonnes"')
+    return valeur
+
+
+def lire_liste(nom):
+    """Lit un paramètre multi-valué (répété ou séparé par des virgules)"""
+    valeurs = []
+    for valeur in request.args.getlist(nom):
+        valeurs.extend(v.strip() for v in valeur.split(',') if v.strip())
+    return valeurs
@@ -0,0 +1,71 @@
+"""
+Routes API pour la recherche plein texte
+"""
+from flask import request, jsonify, current_app
+from . import recherche_bp
+from .pagination import ParametreInvalide, encoder_curseur, decoder_curseur, lire_limite, lire_entier
+from ..models import db
+from ..services.recherche import rechercher
+
+
+@recherche_bp.route('/', methods=['GET'])
+def search():
+    """
+    Recherche plein texte dans les risques et les mesures de prévention
+
+    Paramètres (query string): q (obligatoire), type (risque ou mesure),
+    duerp_id, limit et cursor. Les résultats sont classés par pertinence.
+    """
+    try:
+        if not current_app.extensions.get('recherche_fts'):
+            return jsonify({
+                'success': False,
+                'error': 'La recherche plein texte n\'est pas disponible sur cette base de données'
+            }), 501
+
+        texte = request.args.get('q', '').strip()
+        if not texte:
+            raise ParametreInvalide('Le paramètre q est obligatoire')
+
+        type_objet = request.args.get('type')
+        if type_objet not in (None, 'risque', 'mesure'):
+            raise ParametreInvalide('Le paramètre type doit valoir "risque" ou "mesure"')
+
+        limite = lire_limite()
+        apres = None
+        if request.args.get('cursor'):
+            # Clé (score, type, id) du dernier résultat de la page précédente
+            apres = decoder_curseur(request.args['cursor'], 3)
+            if (isinstance(apres[0], bool) or not isinstance(apres[0], (int, float))
+                    or apres[1] not in ('risque', 'mesure') or not isinstance(apres[2], int)):
+                raise ParametreInvalide('Curseur de pagination invalide')
+
+        resultats, derniere_cle = rechercher(
+            db.session,
+            texte,
+            type_objet=type_objet,
+            duerp_id=lire_entier('duerp_id'),
+            limite=limite,
+            apres=apres
+        )
+        next_cursor = encoder_curseur(list(derniere_cle)) if derniere_cle is not None else None
+
+        return jsonify({
+            'success': True,
+            'data': resultats,
+            'pagination': {
+                'limit': limite,
+                'next_cursor': next_cursor
+            }
+        }), 200
+
+    except ParametreInvalide as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
@@ -2,53 +2,147 @@
 Routes API pour la gestion des risques
 """
 from flask import request, jsonify
+from sqlalchemy import func, tuple_
 from . import risque_bp
-from ..models import db, Risque, UniteTrail
+from .pagination import (
+    ParametreInvalide, encoder_curseur, decoder_curseur, lire_format, lire_limite, lire_entier, lire_liste
+)
+from ..models import db, DUERP, Risque, UniteTrail
+from ..services import operations
+from ..services.admission import limite
+from ..services.idempotence import idempotent
+from ..services.operations import OperationError
+from ..services.scoring import ScoringModel, get_active_model, get_models, rescore
+from ..services.serialization import CHAMPS_RISQUE, columns, records, serializer
 
+# Champs des éléments de la liste des risques
+CHAMPS_LISTE = CHAMPS_RISQUE + ['unite_travail_id', 'duerp_id']
 
-@risque_bp.route('/', methods=['POST'])
-def create_risque():
-    """Crée un nouveau risque"""
+
+@risque_bp.route('/', methods=['GET'])
+def list_risques():
+    """
+    Recherche paginée des risques
+
+    Filtres (query string): duerp_id, unite_travail_id, categorie, niveau_risque,
+    criticite_min, criticite_max, frequence_exposition.
+    Tri par criticité (ordre=desc par défaut, ou asc) puis par id, pagination
+    par curseur via les paramètres limit et cursor. Avec format=colonnes, la
+    page est renvoyée en un tableau de valeurs par champ.
+    """
     try:
-        data = request.get_json()
+        limite = lire_limite()
+        format_liste = lire_format()
+        ordre = request.args.get('ordre', 'desc')
+        if ordre not in ('asc', 'desc'):
+            raise ParametreInvalide('Le paramètre ordre doit valoir "asc" ou "desc"')
 
-        # Validation
-        if not data.get('unite_travail_id'):
-            return jsonify({
-                'success': False,
-                'error': 'unite_travail_id est obligatoire'
-            }), 400
+        query = db.session.query(
+            *[getattr(Risque, c) for c in CHAMPS_RISQUE], Risque.unite_travail_id, UniteTrail.duerp_id
+        ).join(
+            UniteTrail, Risque.unite_travail_id == UniteTrail.id
+        )
 
-        if not data.get('categorie'):
-            return jsonify({
-                'success': False,
-                'error': 'La catégorie du risque est obligatoire'
-            }), 400
+        duerp_id = lire_entier('duerp_id')
+        if duerp_id is not None:
+            query = query.filter(UniteTrail.duerp_id == duerp_id)
 
-        if not data.get('description'):
-            return jsonify({
-                'success': False,
-                'error': 'La description du risque est obligatoire'
-            }), 400
+        unite_travail_id = lire_entier('unite_travail_id')
+        if unite_travail_id is not None:
+            query = query.filter(Risque.unite_travail_id == unite_travail_id)
 
-        # Vérifier que l'unité existe
-        unite = UniteTrail.query.get_or_404(data['unite_travail_id'])
-
-        # Création du risque
-        risque = Risque(
-            unite_travail_id=data['unite_travail_id'],
-            categorie=data['categorie'],
-            sous_categorie=data.get('sous_categorie'),
-            description=data['description'],
-            situation_danger=data.get('situation_danger'),
-            gravite=data.get('gravite', 1),
-            probabilite=data.get('probabilite', 1),
-            frequence_exposition=data.get('frequence_exposition'),
-            personnes_exposees=data.get('personnes_exposees'),
-            personnes_concernees=data.get('personnes_concernees')
-        )
+        categories = lire_liste('categorie')
+        if categories:
+            query = query.filter(Risque.categorie.in_(categories))
+
+        niveaux = lire_liste('niveau_risque')
+        if niveaux:
+            query = query.filter(Risque.niveau_risque.in_(niveaux))
+
+        frequences = lire_liste('frequence_exposition')
+        if frequences:
+            query = query.filter(Risque.frequence_exposition.in_(frequences))
+
+        criticite_min = lire_entier('criticite_min')
+        if criticite_min is not None:
+            query = query.filter(Risque.criticite >= criticite_min)
+
+        criticite_max = lire_entier('criticite_max')
+        if criticite_max is not None:
+            query = query.filter(Risque.criticite <= criticite_max)
+
+        # Pagination par curseur sur la clé (criticite, id)
+        if request.args.get('cursor'):
+            criticite, dernier_id = decoder_curseur(request.args['cursor'], 2)
+            query = query.filter(_apres_curseur(criticite, dernier_id, ordre))
+
+        if ordre == 'desc':
+            query = query.order_by(Risque.criticite.desc(), Risque.id.desc())
+        else:
+            query = query.order_by(Risque.criticite.asc(), Risque.id.asc())
 
-        db.session.add(risque)
+        lignes = query.limit(limite + 1).all()
+        page = lignes[:limite]
+
+        if format_liste == 'colonnes':
+            data = columns(CHAMPS_LISTE, page)
+        else:
+            data = records(CHAMPS_LISTE, page)
+
+        next_cursor = None
+        if len(lignes) > limite:
+            dernier = page[-1]
+            next_cursor = encoder_curseur([dernier.criticite, dernier.id])
+
+        return serializer.response({
+            'success': True,
+            'data': data,
+            'pagination': {
+                'limit': limite,
+                'next_cursor': next_cursor
+            }
+        }), 200
+
+    except ParametreInvalide as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+def _apres_curseur(criticite, dernier_id, ordre):
+    """
+    Condition sélectionnant les risques situés après le curseur (criticite, id)
+
+    Une criticité absente (NULL) est classée avant toutes les autres, comme
+    le fait SQLite dans le tri : en ordre décroissant, ces risques viennent
+    en fin de liste. La condition reste exprimée sur les colonnes (sans
+    coalesce) pour que les index (..., criticite, id) servent le tri.
+    """
+    if criticite is None:
+        if ordre == 'desc':
+            return (Risque.criticite.is_(None)) & (Risque.id < dernier_id)
+        return Risque.criticite.isnot(None) | (Risque.criticite.is_(None) & (Risque.id > dernier_id))
+
+    cle = tuple_(Risque.criticite, Risque.id)
+    if ordre == 'desc':
+        return (cle < (criticite, dernier_id)) | Risque.criticite.is_(None)
+    return cle > (criticite, dernier_id)
+
+
+@risque_bp.route('/', methods=['POST'])
+@idempotent
+def create_risque():
+    """Crée un nouveau risque"""
+    try:
+        data = request.get_json()
+
+        risque = operations.create_risque(db.session, data)
         db.session.commit()
 
         return jsonify({
@@ -57,6 +151,12 @@ def create_risque():
             'message': 'Risque créé avec succès'
         }), 201
 
+    except OperationError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), e.status
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -70,10 +170,12 @@ def get_risque(risque_id):
     """Récupère un risque par son ID"""
     try:
         risque = Risque.query.get_or_404(risque_id)
-        return jsonify({
+        reponse = jsonify({
             'success': True,
             'data': risque.to_dict()
-        }), 200
+        })
+        reponse.set_etag(str(risque.version_id))
+        return reponse, 200
     except Exception as e:
         return jsonify({
             'success': False,
@@ -85,39 +187,30 @@ def get_risque(risque_id):
 def update_risque(risque_id):
     """Met à jour un risque"""
     try:
-        risque = Risque.query.get_or_404(risque_id)
         data = request.get_json()
+        version = operations.version_from_etag(request.headers.get('If-Match'))
 
-        if 'categorie' in data:
-            risque.categorie = data['categorie']
-        if 'sous_categorie' in data:
-            risque.sous_categorie = data['sous_categorie']
-        if 'description' in data:
-            risque.description = data['description']
-        if 'situation_danger' in data:
-            risque.situation_danger = data['situation_danger']
-        if 'gravite' in data:
-            risque.gravite = data['gravite']
-        if 'probabilite' in data:
-            risque.probabilite = data['probabilite']
-        if 'frequence_exposition' in data:
-            risque.frequence_exposition = data['frequence_exposition']
-        if 'personnes_exposees' in data:
-            risque.personnes_exposees = data['personnes_exposees']
-        if 'personnes_concernees' in data:
-            risque.personnes_concernees = data['personnes_concernees']
-
-        # Recalculer la criticité
-        risque.calculer_criticite()
-
+        risque = operations.update_object(db.session, 'risque', risque_id, data, version)
         db.session.commit()
 
-        return jsonify({
+        reponse = jsonify({
             'success': True,
             'data': risque.to_dict(),
             'message': 'Risque mis à jour avec succès'
-        }), 200
+        })
+        reponse.set_etag(str(risque.version_id))
+        return reponse, 200
 
+    except OperationError as e:
+        db.session.rollback()
+        reponse = {
+            'success': False,
+            'error': str(e)
+        }
+        if e.data is not None:
+            # Conflit de version : état courant de l'objet
+            reponse['data'] = e.data
+        return jsonify(reponse), e.status
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -147,6 +240,156 @@ def delete_risque(risque_id):
         }), 500
 
 
+@risque_bp.route('/matrice', methods=['GET'])
+@limite('stats')
+def get_matrice():
+    """
+    Matrice des risques (gravité × probabilité)
+
+    Paramètres (query string): duerp_id ou unite_travail_id pour restreindre
+    le périmètre (sinon tous les DUERP), avec_ids=1 pour obtenir les
+    identifiants des risques de chaque cellule.
+    """
+    try:
+        avec_ids = request.args.get('avec_ids', '').lower() in ('1', 'true', 'oui')
+
+        colonnes = [Risque.gravite, Risque.probabilite, func.count(Risque.id)]
+        if avec_ids:
+            colonnes.append(func.group_concat(Risque.id))
+
+        query = db.session.query(*colonnes)
+
+        duerp_id = lire_entier('duerp_id')
+        if duerp_id is not None:
+            query = query.join(UniteTrail, Risque.unite_travail_id == UniteTrail.id).filter(
+                UniteTrail.duerp_id == duerp_id
+            )
+
+        unite_travail_id = lire_entier('unite_travail_id')
+        if unite_travail_id is not None:
+            query = query.filter(Risque.unite_travail_id == unite_travail_id)
+
+        comptages = {}
+        for ligne in query.group_by(Risque.gravite, Risque.probabilite):
+            comptages[(ligne[0], ligne[1])] = ligne[2:]
+
+        modele = get_active_model()
+        cellules = []
+        for gravite in range(1, 5):
+            for probabilite in range(1, 5):
+                comptage = comptages.get((gravite, probabilite))
+                criticite = modele.criticite(gravite, probabilite)
+                cellule = {
+                    'gravite': gravite,
+                    'probabilite': probabilite,
+                    'criticite': criticite,
+                    'niveau_risque': modele.niveau(criticite),
+                    'nombre': comptage[0] if comptage else 0
+                }
+                if avec_ids:
+                    cellule['risque_ids'] = sorted(
+                        int(i) for i in comptage[1].split(',')
+                    ) if comptage else []
+                cellules.append(cellule)
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'nombre_risques_total': sum(c[0] for c in comptages.values()),
+                'cellules': cellules
+            }
+        }), 200
+
+    except ParametreInvalide as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@risque_bp.route('/modeles-cotation', methods=['GET'])
+def get_modeles_cotation():
+    """Liste les modèles de cotation disponibles et le modèle actif"""
+    return jsonify({
+        'success': True,
+        'data': {
+            'modele_actif': get_active_model().version,
+            'modeles': [modele.to_dict() for modele in get_models().values()]
+        }
+    }), 200
+
+
+@risque_bp.route('/recotation', methods=['POST'])
+@limite('import')
+def recoter_risques():
+    """
+    Recote tous les risques avec un modèle de cotation
+
+    Corps JSON: version (modèle enregistré, modèle actif par défaut) ou
+    modele (définition complète, simulation uniquement), dry_run (True par
+    défaut) et taille_lot. La simulation renvoie le nombre de risques dont
+    la cotation ou le niveau change, sans rien modifier.
+    """
+    try:
+        data = request.get_json() or {}
+        dry_run = data.get('dry_run', True)
+
+        if data.get('modele'):
+            if not dry_run:
+                return jsonify({
+                    'success': False,
+                    'error': 'Un modèle non enregistré ne peut être appliqué qu\'en simulation (dry_run)'
+                }), 400
+            modele = ScoringModel.from_dict(data['modele'])
+        else:
+            version = data.get('version', get_active_model().version)
+            modele = get_models().get(version)
+            if modele is None:
+                return jsonify({
+                    'success': False,
+                    'error': f'Modèle de cotation inconnu: {version}'
+                }), 400
+
+        taille_lot = int(data.get('taille_lot', 5000))
+        if taille_lot < 1:
+            return jsonify({
+                'success': False,
+                'error': 'taille_lot doit être strictement positif'
+            }), 400
+
+        resultat = rescore(
+            db.session,
+            Risque.__table__, DUERP.__table__, UniteTrail.__table__,
+            modele,
+            dry_run=dry_run,
+            taille_lot=taille_lot
+        )
+
+        return jsonify({
+            'success': True,
+            'data': resultat,
+            'message': 'Simulation de recotation' if dry_run else 'Recotation effectuée avec succès'
+        }), 200
+
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 @risque_bp.route('/categories', methods=['GET'])
 def get_categories():
     """Récupère la liste des catégories de risques recommandées"""
@@ -3,41 +3,20 @@ Routes API pour la gestion des unités de travail
 """
 from flask import request, jsonify
 from . import unite_bp
-from ..models import db, UniteTrail, DUERP
+from ..models import db, UniteTrail
+from ..services import operations
+from ..services.idempotence import idempotent
+from ..services.operations import OperationError
 
 
 @unite_bp.route('/', methods=['POST'])
+@idempotent
 def create_unite():
     """Crée une nouvelle unité de travail"""
     try:
         data = request.get_json()
 
-        # Validation
-        if not data.get('duerp_id'):
-            return jsonify({
-                'success': False,
-                'error': 'duerp_id est obligatoire'
-            }), 400
-
-        if not data.get('nom'):
-            return jsonify({
-                'success': False,
-                'error': 'Le nom de l\'unité est obligatoire'
-            }), 400
-
-        # Vérifier que le DUERP existe
-        duerp = DUERP.query.get_or_404(data['duerp_id'])
-
-        # Création de l'unité
-        unite = UniteTrail(
-            duerp_id=data['duerp_id'],
-            nom=data['nom'],
-            description=data.get('description'),
-            localisation=data.get('localisation'),
-            nombre_employes=data.get('nombre_employes')
-        )
-
-        db.session.add(unite)
+        unite = operations.create_unite(db.session, data)
         db.session.commit()
 
         return jsonify({
@@ -46,6 +25,12 @@ def create_unite():
             'message': 'Unité de travail créée avec succès'
         }), 201
 
+    except OperationError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), e.status
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -59,10 +44,12 @@ def get_unite(unite_id):
     """Récupère une unité de travail par son ID"""
     try:
         unite = UniteTrail.query.get_or_404(unite_id)
-        return jsonify({
+        reponse = jsonify({
             'success': True,
             'data': unite.to_dict()
-        }), 200
+        })
+        reponse.set_etag(str(unite.version_id))
+        return reponse, 200
     except Exception as e:
         return jsonify({
             'success': False,
@@ -74,26 +61,30 @@ def get_unite(unite_id):
 def update_unite(unite_id):
     """Met à jour une unité de travail"""
     try:
-        unite = UniteTrail.query.get_or_404(unite_id)
         data = request.get_json()
+        version = operations.version_from_etag(request.headers.get('If-Match'))
 
-        if 'nom' in data:
-            unite.nom = data['nom']
-        if 'description' in data:
-            unite.description = data['description']
-        if 'localisation' in data:
-            unite.localisation = data['localisation']
-        if 'nombre_employes' in data:
-            unite.nombre_employes = data['nombre_employes']
-
+        unite = operations.update_object(db.session, 'unite', unite_id, data, version)
         db.session.commit()
 
-        return jsonify({
+        reponse = jsonify({
             'success': True,
             'data': unite.to_dict(),
             'message': 'Unité de travail mise à jour avec succès'
-        }), 200
+        })
+        reponse.set_etag(str(unite.version_id))
+        return reponse, 200
 
+    except OperationError as e:
+        db.session.rollback()
+        reponse = {
+            'success': False,
+            'error': str(e)
+        }
+        if e.data is not None:
+            # Conflit de version : état courant de l'objet
+            reponse['data'] = e.data
+        return jsonify(reponse), e.status
     except Exception as e:
         db.session.rollback()
         return jsonify({
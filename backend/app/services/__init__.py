@@ -1,6 +1,13 @@
 """
 Services for QHSE application
 """
-from .document_generator import DUERPDocumentGenerator
 
 __all__ = ['DUERPDocumentGenerator']
+
+
+def __getattr__(name):
+    # Le générateur de documents (ReportLab) n'est importé qu'à la première utilisation
+    if name == 'DUERPDocumentGenerator':
+        from .document_generator import DUERPDocumentGenerator
+        return DUERPDocumentGenerator
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,210 @@
+"""
+Contrôle d'admission des traitements coûteux
+
+Chaque classe de routes (rendu de documents, import, statistiques)
+dispose d'un nombre limité d'exécutions simultanées et d'une file d'attente
+bornée. Une requête qui ne trouve ni place libre ni place dans la file, ou
+dont l'attente dépasse le délai configuré, est refusée immédiatement (429
+avec Retry-After) : les traitements lourds ne peuvent ainsi pas occuper tous
+les workers au détriment des requêtes interactives.
+
+Les limites s'appliquent par processus.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, jsonify
+
+from .metrics import metrics
+
+metrics.describe('admission_requetes_total', 'Requêtes soumises au contrôle d\'admission, par classe et résultat')
+metrics.describe('admission_en_cours', 'Traitements en cours d\'exécution, par classe')
+metrics.describe('admission_file_attente', 'Requêtes en file d\'attente, par classe')
+metrics.describe('admission_attente_secondes', 'Temps passé en file d\'attente avant admission')
+metrics.describe('admission_duree_secondes', 'Durée d\'exécution des traitements admis')
+
+
+class AdmissionRefusee(Exception):
+    """Requête refusée par le contrôle d'admission"""
+
+    def __init__(self, classe, raison, retry_after):
+        super().__init__(f'Capacité de traitement « {classe} » saturée ({raison})')
+        self.classe = classe
+        self.raison = raison
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """Limiteur de concurrence à file d'attente bornée pour une classe de routes"""
+
+    def __init__(self, classe, concurrence, file, attente):
+        """
+        Args:
+            classe: Nom de la classe de routes
+            concurrence: Nombre maximal d'exécutions simultanées
+            file: Nombre maximal de requêtes en attente
+            attente: Délai d'attente maximal en secondes
+        """
+        self.classe = classe
+        self.concurrence = concurrence
+        self.file = file
+        self.attente = attente
+        self.en_cours = 0
+        self.en_attente = 0
+        # Durée moyenne d'exécution (moyenne glissante), pour estimer Retry-After
+        self.duree_moyenne = 1.0
+        self._condition = threading.Condition()
+
+    def _publier(self):
+        metrics.set('admission_en_cours', self.en_cours, classe=self.classe)
+        metrics.set('admission_file_attente', self.en_attente, classe=self.classe)
+
+    def retry_after(self):
+        """Délai estimé (secondes) avant qu'une place se libère"""
+        rangs = (self.en_attente + 1) / max(self.concurrence, 1)
+        return max(1, math.ceil(self.duree_moyenne * rangs))
+
+    def _refuser(self, raison):
+        metrics.inc('admission_requetes_total', classe=self.classe, resultat=raison)
+        return AdmissionRefusee(self.classe, raison, self.retry_after())
+
+    def acquire(self):
+        """
+        Attend une place d'exécution
+
+        Returns:
+            float: Temps d'attente en secondes
+
+        Raises:
+            AdmissionRefusee: File pleine ou délai d'attente dépassé
+        """
+        debut = time.perf_counter()
+        with self._condition:
+            # Les nouvelles requêtes ne doublent pas celles déjà en attente
+            if self.en_cours < self.concurrence and self.en_attente == 0:
+                self.en_cours += 1
+                self._publier()
+                metrics.inc('admission_requetes_total', classe=self.classe, resultat='admise')
+                metrics.observe('admission_attente_secondes', 0.0, classe=self.classe)
+                return 0.0
+
+            if self.en_attente >= self.file:
+                raise self._refuser('file_pleine')
+
+            self.en_attente += 1
+            self._publier()
+            try:
+                admise = self._condition.wait_for(
+                    lambda: self.en_cours < self.concurrence, timeout=self.attente
+                )
+            finally:
+                self.en_attente -= 1
+
+            if not admise:
+                self._publier()
+                raise self._refuser('delai_depasse')
+
+            self.en_cours += 1
+            self._publier()
+
+        attente = time.perf_counter() - debut
+        metrics.inc('admission_requetes_total', classe=self.classe, resultat='admise')
+        metrics.observe('admission_attente_secondes', attente, classe=self.classe)
+        return attente
+
+    def release(self, duree=None):
+        """Libère une place d'exécution"""
+        with self._condition:
+            self.en_cours -= 1
+            if duree is not None:
+                self.duree_moyenne = 0.8 * self.duree_moyenne + 0.2 * duree
+            self._publier()
+            self._condition.notify()
+        if duree is not None:
+            metrics.observe('admission_duree_secondes', duree, classe=self.classe)
+
+    def to_dict(self):
+        """État courant du limiteur"""
+        return {
+            'classe': self.classe,
+            'concurrence': self.concurrence,
+            'file': self.file,
+            'attente': self.attente,
+            'en_cours': self.en_cours,
+            'en_attente': self.en_attente
+        }
+
+
+def init_admission(app):
+    """Crée les limiteurs des classes de routes définies dans ADMISSION_LIMITS"""
+    app.extensions['admission'] = {
+        classe: AdmissionLimiter(
+            classe,
+            concurrence=limites.get('concurrence', 1),
+            file=limites.get('file', 0),
+            attente=limites.get('attente', 10)
+        )
+        for classe, limites in app.config.get('ADMISSION_LIMITS', {}).items()
+    }
+
+
+def delai_attente(classe):
+    """Délai d'attente maximal (secondes) de la classe, None si elle n'est pas configurée"""
+    limiteur = current_app.extensions.get('admission', {}).get(classe)
+    return limiteur.attente if limiteur is not None else None
+
+
+@contextmanager
+def admission(classe):
+    """
+    Exécute le bloc sous le contrôle d'admission de la classe donnée
+
+    Permet de ne soumettre au limiteur que la partie coûteuse d'une route.
+
+    Raises:
+        AdmissionRefusee: Si la requête n'est pas admise
+    """
+    limiteur = current_app.extensions.get('admission', {}).get(classe)
+    if limiteur is None:
+        yield
+        return
+
+    limiteur.acquire()
+    debut = time.perf_counter()
+    try:
+        yield
+    finally:
+        limiteur.release(time.perf_counter() - debut)
+
+
+def refus_response(erreur):
+    """Réponse 429 (avec Retry-After) pour une requête refusée"""
+    reponse = jsonify({
+        'success': False,
+        'error': str(erreur)
+    })
+    reponse.status_code = 429
+    reponse.headers['Retry-After'] = str(erreur.retry_after)
+    return reponse
+
+
+def limite(classe):
+    """
+    Décorateur de route soumettant la requête au limiteur de la classe donnée
+
+    La route s'exécute sans limite si la classe n'est pas configurée.
+    """
+    def decorateur(vue):
+        @wraps(vue)
+        def wrapper(*args, **kwargs):
+            try:
+                with admission(classe):
+                    return vue(*args, **kwargs)
+            except AdmissionRefusee as e:
+                return refus_response(e)
+
+        return wrapper
+    return decorateur
@@ -0,0 +1,62 @@
+"""
+Cache en mémoire des réponses calculées
+Les entrées sont indexées par une clé incluant la version des données
+(révisions des DUERP concernés) : elles n'ont donc jamais besoin d'être
+invalidées, les anciennes versions sortent simplement du cache (LRU).
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """Cache LRU borné et thread-safe"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Configure la taille du cache à partir de la configuration Flask"""
+        self.max_entries = app.config.get('RESPONSE_CACHE_SIZE', self.max_entries)
+        self.clear()
+
+    def get(self, key):
+        """Retourne la valeur associée à la clé, ou None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Enregistre une valeur en évinçant les entrées les plus anciennes"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Vide le cache"""
+        with self._lock:
+            self._entries.clear()
+
+
+def data_version(*parts):
+    """
+    Calcule une empreinte courte identifiant une version des données
+
+    Args:
+        parts: Éléments sérialisables en JSON (révisions, filtres, date...)
+
+    Returns:
+        str: Empreinte hexadécimale utilisable comme ETag
+    """
+    raw = json.dumps(parts, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,169 @@
+"""
+Création d'une nouvelle version d'un DUERP par copie ensembliste
+
+L'arborescence (unités, risques, mesures) est dupliquée dans la base par des
+INSERT ... SELECT. La correspondance entre anciens et nouveaux identifiants
+est établie par la clé d'origine (origine_id) que portent les copies.
+"""
+from datetime import datetime
+
+from sqlalchemy import and_, case, func, insert, literal, select
+
+from ..models import DUERP, UniteTrail, Risque, MesurePrevention, EvaluationHistorique
+from .scoring import get_active_model
+from .snapshots import save_snapshot
+
+COLONNES_UNITE = ['nom', 'description', 'localisation', 'nombre_employes']
+COLONNES_RISQUE = [
+    'categorie', 'sous_categorie', 'description', 'situation_danger', 'gravite', 'probabilite',
+    'frequence_exposition', 'criticite', 'niveau_risque', 'version_cotation',
+    'personnes_exposees', 'personnes_concernees'
+]
+COLONNES_MESURE = [
+    'type_mesure', 'niveau_hierarchie', 'description', 'statut', 'date_mise_en_oeuvre',
+    'date_echeance', 'responsable', 'cout_estime', 'efficacite'
+]
+
+
+def next_version(version):
+    """
+    Calcule le numéro de la version suivante (réévaluation : '1.0' -> '2.0')
+
+    Raises:
+        ValueError: Si la version n'est pas de la forme majeur[.mineur]
+    """
+    try:
+        majeure = int(str(version).split('.')[0])
+    except ValueError:
+        raise ValueError(f'Impossible de déduire la version suivante de "{version}", précisez-la')
+    return f'{majeure + 1}.0'
+
+
+def clone_duerp(session, source, version=None, evaluateur=None, date_prochaine_evaluation=None):
+    """
+    Crée une nouvelle version d'un DUERP en copiant toute son arborescence
+
+    Toutes les opérations ont lieu dans la transaction courante, que
+    l'appelant valide.
+
+    Args:
+        session: Session SQLAlchemy
+        source: Instance DUERP à copier
+        version: Numéro de la nouvelle version (version suivante par défaut)
+        evaluateur: Évaluateur inscrit dans l'historique
+        date_prochaine_evaluation: Date de la prochaine évaluation
+
+    Returns:
+        DUERP: La nouvelle version
+    """
+    version = version or next_version(source.version)
+
+    copie = DUERP(
+        entreprise_nom=source.entreprise_nom,
+        entreprise_siret=source.entreprise_siret,
+        entreprise_adresse=source.entreprise_adresse,
+        entreprise_activite=source.entreprise_activite,
+        effectif=source.effectif,
+        version=version,
+        date_prochaine_evaluation=date_prochaine_evaluation,
+        responsable_evaluation=source.responsable_evaluation,
+        responsable_validation=source.responsable_validation,
+        statut='brouillon',
+        origine_id=source.id
+    )
+    session.add(copie)
+    session.flush()
+
+    u = UniteTrail.__table__
+    r = Risque.__table__
+    m = MesurePrevention.__table__
+
+    # Unités : la copie mémorise la clé d'origine de l'unité source
+    session.execute(
+        insert(u).from_select(
+            ['duerp_id', 'origine_id'] + COLONNES_UNITE,
+            select(
+                literal(copie.id), func.coalesce(u.c.origine_id, u.c.id),
+                *[u.c[c] for c in COLONNES_UNITE]
+            ).where(u.c.duerp_id == source.id).order_by(u.c.id)
+        )
+    )
+
+    # Risques : rattachés à l'unité copiée portant la même clé d'origine
+    u_source = u.alias('u_source')
+    u_copie = u.alias('u_copie')
+    correspondance_unites = and_(
+        u_copie.c.duerp_id == copie.id,
+        u_copie.c.origine_id == func.coalesce(u_source.c.origine_id, u_source.c.id)
+    )
+    session.execute(
+        insert(r).from_select(
+            ['unite_travail_id', 'origine_id'] + COLONNES_RISQUE,
+            select(
+                u_copie.c.id, func.coalesce(r.c.origine_id, r.c.id),
+                *[r.c[c] for c in COLONNES_RISQUE]
+            )
+            .select_from(r)
+            .join(u_source, r.c.unite_travail_id == u_source.c.id)
+            .join(u_copie, correspondance_unites)
+            .where(u_source.c.duerp_id == source.id)
+            .order_by(r.c.id)
+        )
+    )
+
+    # Mesures : rattachées au risque copié portant la même clé d'origine
+    r_source = r.alias('r_source')
+    r_copie = r.alias('r_copie')
+    session.execute(
+        insert(m).from_select(
+            ['risque_id', 'origine_id'] + COLONNES_MESURE,
+            select(
+                r_copie.c.id, func.coalesce(m.c.origine_id, m.c.id),
+                *[m.c[c] for c in COLONNES_MESURE]
+            )
+            .select_from(m)
+            .join(r_source, m.c.risque_id == r_source.c.id)
+            .join(u_source, r_source.c.unite_travail_id == u_source.c.id)
+            .join(u_copie, correspondance_unites)
+            .join(r_copie, and_(
+                r_copie.c.unite_travail_id == u_copie.c.id,
+                r_copie.c.origine_id == func.coalesce(r_source.c.origine_id, r_source.c.id)
+            ))
+            .where(u_source.c.duerp_id == source.id)
+            .order_by(m.c.id)
+        )
+    )
+
+    # Indicateurs de la nouvelle version (risques critiques : niveau le plus
+    # élevé du modèle de cotation actif)
+    niveau_critique = get_active_model().niveaux[-1]
+    nombre_risques, nombre_critiques = session.execute(
+        select(
+            func.count(r.c.id),
+            func.coalesce(func.sum(case((r.c.niveau_risque == niveau_critique, 1), else_=0)), 0)
+        )
+        .join(u, r.c.unite_travail_id == u.c.id)
+        .where(u.c.duerp_id == copie.id)
+    ).one()
+    nombre_mesures = session.execute(
+        select(func.count(m.c.id))
+        .join(r, m.c.risque_id == r.c.id)
+        .join(u, r.c.unite_travail_id == u.c.id)
+        .where(u.c.duerp_id == copie.id)
+    ).scalar()
+
+    historique = EvaluationHistorique(
+        duerp_id=copie.id,
+        date_evaluation=datetime.utcnow(),
+        version=version,
+        type_modification='Réévaluation complète',
+        description_modifications=f'Nouvelle version créée à partir de la version {source.version} (DUERP {source.id})',
+        evaluateur=evaluateur or source.responsable_evaluation,
+        nombre_risques_total=nombre_risques,
+        nombre_risques_critiques=nombre_critiques,
+        nombre_mesures_prevention=nombre_mesures
+    )
+    session.add(historique)
+    save_snapshot(session, historique)
+
+    return copie
@@ -0,0 +1,229 @@
+"""
+Regroupement des calculs identiques simultanés (single-flight)
+
+Des requêtes concurrentes portant sur le même calcul (même DUERP, même
+révision des données, même format) partagent une seule exécution : la
+première le réalise, les suivantes attendent et reçoivent son résultat.
+
+- entre threads d'un même processus : un événement par calcul en cours
+- entre processus locaux, pour les résultats sérialisables en JSON
+  (statistiques...) : un verrou de fichier (fcntl) par calcul empêche deux
+  processus de le réaliser en même temps, et le résultat est déposé dans un
+  fichier lu par les processus qui attendaient le verrou. Sans fcntl
+  (Windows), seul le regroupement entre threads est assuré.
+
+Les documents générés (bytes) ne sont jamais écrits sur disque ni regroupés
+entre processus (partage_processus=False) : attendre la génération d'un
+autre processus sans pouvoir en reprendre le résultat ne ferait que
+sérialiser les générations.
+
+Le calcul est réalisé sous le contrôle d'admission de sa classe, attente du
+verrou de fichier comprise : une requête qui attend un autre processus
+occupe une place de la classe, et cette attente est bornée par le délai
+d'attente de la classe.
+
+La clé d'un calcul est complétée par la base de données de l'application
+(SQLALCHEMY_DATABASE_URI) : deux instances servant des bases différentes ne
+partagent jamais un résultat, même avec un dossier de regroupement commun.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - plateformes sans fcntl
+    fcntl = None
+
+from flask import current_app, has_app_context
+
+from .admission import admission, delai_attente
+from .metrics import metrics
+
+metrics.describe('coalescing_requetes_total', 'Calculs coûteux demandés, par origine du résultat')
+
+_ABSENT = object()
+
+# Fréquence de purge des fichiers de résultats et de verrous périmés (secondes)
+INTERVALLE_PURGE = 300
+
+
+class _Appel:
+    """Calcul en cours dans le processus"""
+
+    def __init__(self):
+        self.evenement = threading.Event()
+        self.valeur = None
+        self.erreur = None
+
+
+class Coalescer:
+    """Regroupe les exécutions concurrentes d'un même calcul"""
+
+    def __init__(self, dossier=None, duree_resultat=30, delai=120):
+        """
+        Args:
+            dossier: Dossier des verrous et résultats partagés entre processus
+            duree_resultat: Durée (secondes) pendant laquelle un résultat
+                déposé peut être repris par un autre processus
+            delai: Attente maximale (secondes) d'un calcul en cours, au-delà
+                de laquelle la requête calcule elle-même
+        """
+        self.dossier = dossier
+        self.duree_resultat = duree_resultat
+        self.delai = delai
+        self._appels = {}
+        self._lock = threading.Lock()
+        self._derniere_purge = 0.0
+
+    def init_app(self, app):
+        """
+        Configure le regroupement à partir de la configuration Flask
+
+        Sans COALESCING_FOLDER, les verrous et résultats sont placés dans le
+        dossier d'instance de l'application (instance/coalescing).
+        """
+        self.dossier = app.config.get('COALESCING_FOLDER') or os.path.join(app.instance_path, 'coalescing')
+        self.duree_resultat = app.config.get('COALESCING_RESULT_TTL', self.duree_resultat)
+        self.delai = app.config.get('COALESCING_TIMEOUT', self.delai)
+        if self.dossier:
+            os.makedirs(self.dossier, exist_ok=True)
+
+    def run(self, cle, fonction, classe=None, partage_processus=True):
+        """
+        Exécute fonction() ou partage le résultat d'une exécution en cours
+
+        Args:
+            cle: Identifiant du calcul (sérialisable en JSON), incluant la
+                version des données
+            fonction: Calcul à réaliser, sans argument
+            classe: Classe d'admission sous laquelle le calcul est réalisé
+                (aucun contrôle si None)
+            partage_processus: False pour un résultat non sérialisable en
+                JSON (document généré) : regroupement entre threads seulement,
+                sans verrou de fichier
+
+        Returns:
+            Le résultat du calcul
+        """
+        base = current_app.config.get('SQLALCHEMY_DATABASE_URI') if has_app_context() else None
+        nom = hashlib.sha1(
+            json.dumps([base, cle], sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+        ).hexdigest()
+
+        with self._lock:
+            appel = self._appels.get(nom)
+            meneur = appel is None
+            if meneur:
+                appel = self._appels[nom] = _Appel()
+
+        if not meneur:
+            if appel.evenement.wait(self.delai):
+                metrics.inc('coalescing_requetes_total', origine='thread')
+                if appel.erreur is not None:
+                    raise appel.erreur
+                return appel.valeur
+            metrics.inc('coalescing_requetes_total', origine='delai_depasse')
+            with admission(classe):
+                return fonction()
+
+        try:
+            appel.valeur = self._executer(nom, fonction, classe, partage_processus)
+            return appel.valeur
+        except Exception as e:
+            appel.erreur = e
+            raise
+        finally:
+            appel.evenement.set()
+            with self._lock:
+                del self._appels[nom]
+
+    def _executer(self, nom, fonction, classe, partage_processus):
+        """
+        Exécute le calcul une fois admis, sous verrou de fichier, ou reprend
+        le résultat d'un autre processus
+        """
+        with admission(classe):
+            if fcntl is None or not self.dossier or not partage_processus:
+                metrics.inc('coalescing_requetes_total', origine='calcul')
+                return fonction()
+
+            self._purger()
+
+            with open(os.path.join(self.dossier, nom + '.lock'), 'a') as verrou:
+                attente = delai_attente(classe) if classe is not None else None
+                if not self._verrouiller(verrou, self.delai if attente is None else attente):
+                    metrics.inc('coalescing_requetes_total', origine='delai_depasse')
+                    return fonction()
+                try:
+                    valeur = self._lire(nom)
+                    if valeur is not _ABSENT:
+                        metrics.inc('coalescing_requetes_total', origine='processus')
+                        return valeur
+
+                    metrics.inc('coalescing_requetes_total', origine='calcul')
+                    valeur = fonction()
+                    self._ecrire(nom, valeur)
+                    return valeur
+                finally:
+                    fcntl.flock(verrou, fcntl.LOCK_UN)
+
+    def _verrouiller(self, verrou, delai):
+        """Prend le verrou exclusif, en attendant au plus delai secondes"""
+        limite = time.monotonic() + delai
+        attente = 0.01
+        while True:
+            try:
+                fcntl.flock(verrou, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= limite:
+                    return False
+                time.sleep(attente)
+                attente = min(attente * 2, 0.25)
+
+    def _lire(self, nom):
+        """Résultat déposé par un autre processus, s'il est encore valide"""
+        chemin = os.path.join(self.dossier, nom + '.json')
+        try:
+            if time.time() - os.path.getmtime(chemin) > self.duree_resultat:
+                return _ABSENT
+            with open(chemin, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return _ABSENT
+
+    def _ecrire(self, nom, valeur):
+        """Dépose un résultat JSON de façon atomique (fichier temporaire renommé)"""
+        descripteur, temporaire = tempfile.mkstemp(dir=self.dossier, suffix='.tmp')
+        try:
+            with os.fdopen(descripteur, 'w', encoding='utf-8') as f:
+                json.dump(valeur, f, ensure_ascii=False)
+            os.replace(temporaire, os.path.join(self.dossier, nom + '.json'))
+        except (TypeError, ValueError):
+            # Résultat non sérialisable : il n'est simplement pas partagé
+            os.unlink(temporaire)
+
+    def _purger(self):
+        """Supprime les résultats expirés et les verrous inutilisés depuis longtemps"""
+        maintenant = time.time()
+        if maintenant - self._derniere_purge < INTERVALLE_PURGE:
+            return
+        self._derniere_purge = maintenant
+
+        for entree in os.scandir(self.dossier):
+            try:
+                age = maintenant - entree.stat().st_mtime
+                if entree.name.endswith('.json') and age > self.duree_resultat:
+                    os.unlink(entree.path)
+                elif entree.name.endswith(('.lock', '.tmp')) and age > 86400:
+                    os.unlink(entree.path)
+            except OSError:
+                pass
+
+
+# Instance partagée par l'application
+coalescer = Coalescer()
@@ -0,0 +1,175 @@
+"""
+Compression des réponses HTTP (gzip, brotli)
+
+L'encodage est négocié avec l'en-tête Accept-Encoding du client : brotli
+s'il est installé et accepté, sinon gzip. Seules les réponses textuelles
+(JSON, texte) dépassant COMPRESSION_MIN_SIZE octets sont compressées ; les
+réponses produites en flux sont compressées au fil de l'envoi, sans être
+chargées en mémoire.
+
+Les réponses mises en cache sont conservées sous forme de PrecompressedPayload :
+le corps est compressé une seule fois, et les lectures suivantes servent
+directement la version compressée.
+"""
+import threading
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli est optionnel
+    brotli = None
+
+# Types de contenu compressés (PDF et DOCX le sont déjà)
+TYPES_COMPRESSIBLES = ('application/json', 'application/javascript', 'text/')
+
+# Niveaux utilisés pour les réponses en cache, compressées une seule fois
+NIVEAUX_CACHE = {'gzip': 9, 'br': 9}
+
+
+class _Compresseur:
+    """Compresseur incrémental gzip ou brotli"""
+
+    def __init__(self, encodage, niveau):
+        if encodage == 'br':
+            objet = brotli.Compressor(quality=niveau)
+            self.compress, self.finish = objet.process, objet.finish
+        else:
+            # wbits=31 : format gzip, sans date dans l'en-tête (sortie reproductible)
+            objet = zlib.compressobj(niveau, zlib.DEFLATED, 31)
+            self.compress, self.finish = objet.compress, objet.flush
+
+
+def compress(contenu, encodage, niveau):
+    """Compresse un contenu (bytes) avec l'encodage donné"""
+    compresseur = _Compresseur(encodage, niveau)
+    return compresseur.compress(contenu) + compresseur.finish()
+
+
+def _flux_compresse(morceaux, encodage, niveau):
+    """Compresse une réponse en flux, morceau par morceau"""
+    compresseur = _Compresseur(encodage, niveau)
+    for morceau in morceaux:
+        donnees = compresseur.compress(morceau)
+        if donnees:
+            yield donnees
+    yield compresseur.finish()
+
+
+def choose_encoding():
+    """
+    Encodage de compression préféré par le client de la requête courante
+
+    Returns:
+        str | None: 'br', 'gzip' ou None (pas de compression)
+    """
+    if not current_app.config.get('COMPRESSION_ENABLED', True):
+        return None
+    candidats = (['br'] if brotli is not None else []) + ['gzip']
+    # À qualité égale, brotli (plus compact) est préféré
+    qualites = [(request.accept_encodings.quality(encodage), -i, encodage) for i, encodage in enumerate(candidats)]
+    qualite, _, encodage = max(qualites)
+    return encodage if qualite > 0 else None
+
+
+def _niveau(encodage):
+    return current_app.config.get('COMPRESSION_LEVELS', {}).get(encodage, 6 if encodage == 'gzip' else 5)
+
+
+def compressible(response):
+    """Indique si le type de contenu de la réponse gagne à être compressé"""
+    return (response.mimetype or '').startswith(TYPES_COMPRESSIBLES)
+
+
+def compress_response(response):
+    """
+    Compresse une réponse selon l'encodage accepté par le client
+
+    Utilisée en after_request : les réponses déjà encodées (dont les
+    PrecompressedPayload), trop petites ou non textuelles sont laissées
+    telles quelles.
+    """
+    if not compressible(response) or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    if 'no-transform' in (response.headers.get('Cache-Control') or ''):
+        return response
+
+    encodage = choose_encoding()
+    if encodage is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _flux_compresse(response.iter_encoded(), encodage, _niveau(encodage))
+        response.direct_passthrough = False
+        response.headers.pop('Content-Length', None)
+    else:
+        contenu = response.get_data()
+        if len(contenu) < current_app.config.get('COMPRESSION_MIN_SIZE', 1024):
+            return response
+        response.set_data(compress(contenu, encodage, _niveau(encodage)))
+
+    response.headers['Content-Encoding'] = encodage
+    _affaiblir_etag(response)
+    return response
+
+
+def _affaiblir_etag(response):
+    """L'ETag d'une représentation compressée devient faible (même contenu, autre encodage)"""
+    etag, faible = response.get_etag()
+    if etag and not faible:
+        response.set_etag(etag, weak=True)
+
+
+class PrecompressedPayload:
+    """
+    Corps de réponse sérialisé et compressé une seule fois, pour le cache
+
+    Au-delà du seuil de compression, seule la version gzip est conservée :
+    la version brotli est produite à la première demande, et le contenu non
+    compressé (clients sans compression) est restitué par décompression.
+    """
+
+    __slots__ = ('mimetype', 'taille', '_variantes', '_lock')
+
+    def __init__(self, contenu, mimetype='application/json'):
+        self.mimetype = mimetype
+        self.taille = len(contenu)
+        self._lock = threading.Lock()
+        if self.taille >= current_app.config.get('COMPRESSION_MIN_SIZE', 1024):
+            self._variantes = {'gzip': compress(contenu, 'gzip', NIVEAUX_CACHE['gzip'])}
+        else:
+            self._variantes = {None: contenu}
+
+    def variant(self, encodage):
+        """Corps de la réponse pour l'encodage donné (None : non compressé)"""
+        if None in self._variantes:
+            return self._variantes[None]
+        with self._lock:
+            if encodage not in self._variantes:
+                brut = zlib.decompress(self._variantes['gzip'], 31)
+                if encodage is None:
+                    # Rare (client sans compression) : non conservé
+                    return brut
+                self._variantes[encodage] = compress(brut, encodage, NIVEAUX_CACHE[encodage])
+            return self._variantes[encodage]
+
+    def response(self, etag=None):
+        """Réponse servant la version adaptée au client de la requête courante"""
+        encodage = None if None in self._variantes else choose_encoding()
+        reponse = current_app.response_class(self.variant(encodage), mimetype=self.mimetype)
+        reponse.vary.add('Accept-Encoding')
+        if encodage is not None:
+            reponse.headers['Content-Encoding'] = encodage
+        if etag is not None:
+            reponse.set_etag(etag, weak=encodage is not None)
+        return reponse
+
+
+def init_compression(app):
+    """Active la compression des réponses de l'application"""
+    app.after_request(compress_response)
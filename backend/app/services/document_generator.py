@@ -1,97 +1,310 @@
 """
 Service de génération de documents DUERP
 Génère des documents PDF et DOCX conformes à la réglementation française
+
+Ce module importe ReportLab : il n'est chargé qu'à la première génération
+(ou par le préchargement, voir services/warmup.py), pas au démarrage.
 """
 import os
+import re
+import tempfile
+import uuid
 from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
 from pathlib import Path
+from types import SimpleNamespace
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
 from reportlab.platypus.flowables import HRFlowable
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_JUSTIFY
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import object_session
+
+from .read_model import as_record
+from .scoring import get_active_model
+from .render_profile import RenderProfile
+from .tracing import annotate, traced
+
+DESCRIPTIONS_NIVEAUX = {
+    'Acceptable': 'Risque faible, surveillance normale',
+    'Modéré': 'Risque modéré, actions de prévention à planifier',
+    'Important': 'Risque important, actions de prévention prioritaires',
+    'Critique': 'Risque critique, actions immédiates requises'
+}
+
+# Couleurs des niveaux de risque, du plus faible au plus élevé : les niveaux
+# d'un modèle de cotation y sont répartis selon leur rang
+PALETTE_NIVEAUX = ('#90EE90', '#FFD700', '#FFA500', '#FF6B6B')
+
+
+def couleur_niveau(modele, niveau):
+    """Couleur d'un niveau de risque du modèle (blanc pour un niveau inconnu)"""
+    if niveau not in modele.niveaux:
+        return colors.white
+    if len(modele.niveaux) == 1:
+        return colors.HexColor(PALETTE_NIVEAUX[-1])
+    rang = modele.niveaux.index(niveau)
+    return colors.HexColor(PALETTE_NIVEAUX[round(rang * (len(PALETTE_NIVEAUX) - 1) / (len(modele.niveaux) - 1))])
+
+
+# Nombre de lignes (unité, risque) lues par lot en mode flux
+TAILLE_LOT_FLUX = 500
+
+# Polices utilisées par les documents PDF
+POLICES = ('Helvetica', 'Helvetica-Bold')
+
+
+@lru_cache(maxsize=None)
+def pdf_styles():
+    """Feuille de styles des documents PDF, construite une fois par processus"""
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle(
+        name='CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=16,
+        textColor=colors.HexColor('#003366'),
+        spaceAfter=30,
+        alignment=TA_CENTER
+    ))
+    styles.add(ParagraphStyle(
+        name='CustomHeading2',
+        parent=styles['Heading2'],
+        fontSize=14,
+        textColor=colors.HexColor('#003366'),
+        spaceAfter=12,
+        spaceBefore=12
+    ))
+    styles.add(ParagraphStyle(
+        name='CustomNormal',
+        parent=styles['Normal'],
+        fontSize=10,
+        alignment=TA_JUSTIFY
+    ))
+    return styles
+
+
+def preload():
+    """
+    Précharge les polices et les styles et exerce une première mise en page,
+    pour que la première génération de document n'en paie pas le coût
+    """
+    for police in POLICES:
+        pdfmetrics.getFont(police)
+    styles = pdf_styles()
+    SimpleDocTemplate(BytesIO(), pagesize=A4).build([
+        Paragraph("DOCUMENT UNIQUE", styles['CustomTitle']),
+        Table([['Version:', '1.0']], colWidths=[6*cm, 8*cm])
+    ])
+
+
+class FlowableStream(list):
+    """
+    Story ReportLab alimentée à la demande par un générateur de flowables
+
+    La construction du document consomme la story par la tête
+    (flowables[0], del flowables[0]) en testant len(flowables) à chaque
+    tour : la liste est réalimentée à ce moment et ne contient donc jamais
+    que quelques dizaines de flowables.
+    """
+
+    def __init__(self, source, reserve=50):
+        super().__init__()
+        self._source = iter(source)
+        self._reserve = reserve
+
+    def __len__(self):
+        taille = super().__len__()
+        if self._source is not None and taille < self._reserve:
+            for flowable in self._source:
+                self.append(flowable)
+                taille += 1
+                if taille >= 2 * self._reserve:
+                    break
+            else:
+                self._source = None
+        return super().__len__()
 
 
 class DUERPDocumentGenerator:
     """Générateur de documents DUERP"""
 
-    def __init__(self):
+    def __init__(self, profile_memory=False):
+        """
+        Args:
+            profile_memory: Mesure le pic mémoire de chaque rendu (tracemalloc,
+                voir render_profile) ; le rendu est alors plus lent
+        """
+        # Dossier des copies archivées, créé seulement au premier archivage
         self.output_dir = Path(__file__).resolve().parent.parent.parent.parent / 'generated_documents'
-        self.output_dir.mkdir(exist_ok=True)
+        self.profile_memory = profile_memory
+        # Profil du dernier rendu (RenderProfile)
+        self.last_profile = None
 
-    def generate_pdf(self, duerp):
+    def archive(self, contenu, duerp, extension):
         """
-        Génère un document PDF pour le DUERP
+        Enregistre un document généré dans le dossier des documents
+
+        Le fichier est écrit sous un nom temporaire puis renommé : il n'est
+        jamais visible partiellement écrit. Son nom est unique (horodatage et
+        suffixe aléatoire), deux générations ne s'écrasent donc pas.
 
         Args:
+            contenu: Contenu du document (bytes)
             duerp: Instance du modèle DUERP
+            extension: Extension du fichier (pdf, docx)
 
         Returns:
-            str: Chemin du fichier PDF généré
+            str: Chemin du fichier enregistré
         """
-        # Nom du fichier
-        filename = f"DUERP_{duerp.entreprise_nom.replace(' ', '_')}_{duerp.version}_{datetime.now().strftime('%Y%m%d')}.pdf"
+        entreprise = re.sub(r'[^\w.-]+', '_', duerp.entreprise_nom).strip('_')
+        filename = (
+            f"DUERP_{entreprise}_{duerp.version}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            f"_{uuid.uuid4().hex[:8]}.{extension}"
+        )
         filepath = self.output_dir / filename
+        self.output_dir.mkdir(exist_ok=True)
+
+        descripteur, temporaire = tempfile.mkstemp(dir=self.output_dir, suffix='.tmp')
+        try:
+            with os.fdopen(descripteur, 'wb') as f:
+                f.write(contenu)
+            os.replace(temporaire, filepath)
+        except BaseException:
+            os.unlink(temporaire)
+            raise
+
+        return str(filepath)
+
+    def generate_pdf(self, duerp, streaming=False):
+        """
+        Génère un document PDF pour le DUERP et l'enregistre (voir archive)
+
+        Returns:
+            str: Chemin du fichier PDF généré
+        """
+        return self.archive(self.render_pdf(duerp, streaming=streaming), duerp, 'pdf')
+
+    @traced('pdf.rendu')
+    def render_pdf(self, duerp, output=None, streaming=False):
+        """
+        Génère le document PDF du DUERP en mémoire
+
+        Hors mode flux, le document est construit à partir du modèle de
+        lecture détaché (voir read_model) : une instance du modèle est
+        d'abord chargée en une requête, un DUERPRecord est utilisé tel quel
+        et le rendu ne fait alors aucun accès à la base.
+
+        Args:
+            duerp: Instance du modèle DUERP ou DUERPRecord (instance du
+                modèle obligatoire en mode flux)
+            output: Fichier (objet binaire) recevant le PDF ; s'il est omis,
+                le contenu est retourné
+            streaming: Si True, les unités, risques et mesures sont lus par
+                lots et transmis à ReportLab au fil de la mise en page, sans
+                charger l'arborescence du DUERP en mémoire
+
+        Returns:
+            bytes: Contenu du PDF (si output n'est pas fourni)
+        """
+        buffer = output if output is not None else BytesIO()
+        profil = self.last_profile = RenderProfile('pdf', streaming, self.profile_memory)
+        annotate(streaming=streaming)
+        profil.start()
+        try:
+            # Création du document
+            doc = SimpleDocTemplate(
+                buffer,
+                pagesize=A4,
+                rightMargin=2*cm,
+                leftMargin=2*cm,
+                topMargin=2*cm,
+                bottomMargin=2*cm
+            )
+
+            # Styles
+            styles = pdf_styles()
+
+            # Contenu du document
+            if streaming:
+                # Sections produites au fil de la mise en page : le temps de
+                # production de chacune est retiré de celui de la mise en page
+                profil.start_tree()
+                with profil.section('mise_en_page'):
+                    doc.build(FlowableStream(profil.count(self._stream_story(duerp, styles, profil))))
+                profil.sections['mise_en_page'] -= sum(
+                    duree for nom, duree in profil.sections.items() if nom != 'mise_en_page'
+                )
+            else:
+                with profil.section('chargement'):
+                    duerp = as_record(duerp)
+                profil.measure_tree(duerp)
+                story = []
+
+                # Page de garde
+                with profil.section('page_garde'):
+                    story.extend(self._generate_cover_page(duerp, styles))
+                story.append(PageBreak())
+
+                # Sommaire et informations
+                with profil.section('informations'):
+                    story.extend(self._generate_info_section(duerp, styles))
+                story.append(PageBreak())
+
+                # Tableau récapitulatif des risques
+                with profil.section('synthese_risques'):
+                    story.extend(self._generate_risk_summary(duerp, styles))
+                story.append(PageBreak())
 
-        # Création du document
-        doc = SimpleDocTemplate(
-            str(filepath),
-            pagesize=A4,
-            rightMargin=2*cm,
-            leftMargin=2*cm,
-            topMargin=2*cm,
-            bottomMargin=2*cm
+                # Détail par unité de travail
+                with profil.section('risques_detailles'):
+                    story.extend(self._generate_detailed_risks(duerp, styles))
+
+                # Génération du PDF
+                story = list(profil.count(story))
+                with profil.section('mise_en_page'):
+                    doc.build(story)
+
+            profil.pages = doc.page
+        finally:
+            profil.stop(buffer.tell())
+
+        return buffer.getvalue() if output is None else None
+
+    def _stream_story(self, duerp, styles, profil):
+        """Produit les flowables du document à partir de requêtes sur les lignes"""
+        session = object_session(duerp)
+
+        yield from profil.timed('page_garde', lambda: self._generate_cover_page(duerp, styles))
+        yield PageBreak()
+
+        yield from profil.timed('informations', lambda: self._generate_info_section(duerp, styles))
+        yield PageBreak()
+
+        def synthese():
+            compteurs, repartition = self._query_risk_summary(session, duerp.id)
+            return self._risk_summary_flowables(compteurs, repartition, styles)
+
+        yield from profil.timed('synthese_risques', synthese)
+        yield PageBreak()
+
+        yield from profil.timed(
+            'risques_detailles', lambda: self._stream_detailed_risks(session, duerp.id, styles, profil)
         )
 
-        # Styles
-        styles = getSampleStyleSheet()
-        styles.add(ParagraphStyle(
-            name='CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=16,
-            textColor=colors.HexColor('#003366'),
-            spaceAfter=30,
-            alignment=TA_CENTER
-        ))
-        styles.add(ParagraphStyle(
-            name='CustomHeading2',
-            parent=styles['Heading2'],
-            fontSize=14,
-            textColor=colors.HexColor('#003366'),
-            spaceAfter=12,
-            spaceBefore=12
-        ))
-        styles.add(ParagraphStyle(
-            name='CustomNormal',
-            parent=styles['Normal'],
-            fontSize=10,
-            alignment=TA_JUSTIFY
-        ))
-
-        # Contenu du document
-        story = []
-
-        # Page de garde
-        story.extend(self._generate_cover_page(duerp, styles))
-        story.append(PageBreak())
-
-        # Sommaire et informations
-        story.extend(self._generate_info_section(duerp, styles))
-        story.append(PageBreak())
-
-        # Tableau récapitulatif des risques
-        story.extend(self._generate_risk_summary(duerp, styles))
-        story.append(PageBreak())
-
-        # Détail par unité de travail
-        story.extend(self._generate_detailed_risks(duerp, styles))
-
-        # Génération du PDF
-        doc.build(story)
+    def count_risks(self, duerp):
+        """Nombre de risques du DUERP (choix du mode de génération)"""
+        from ..models import UniteTrail, Risque
 
-        return str(filepath)
+        return object_session(duerp).execute(
+            select(func.count(Risque.id))
+            .join(UniteTrail, Risque.unite_travail_id == UniteTrail.id)
+            .where(UniteTrail.duerp_id == duerp.id)
+        ).scalar()
 
     def _generate_cover_page(self, duerp, styles):
         """Génère la page de garde"""
@@ -159,58 +372,131 @@ class DUERPDocumentGenerator:
         elements.append(Paragraph("2. MÉTHODOLOGIE D'ÉVALUATION", styles['CustomHeading2']))
         elements.append(Spacer(1, 0.3*cm))
 
-        methodology_text = """
+        methodology_text = self._methodology_text(get_active_model())
+        elements.append(Paragraph(methodology_text, styles['CustomNormal']))
+
+        return elements
+
+    def _methodology_text(self, modele):
+        """Décrit la méthode de cotation du modèle actif"""
+        formule = 'Criticité = Gravité × Probabilité'
+        if modele.facteurs_frequence:
+            formule += ' × Facteur de fréquence d\'exposition'
+
+        text = f"""
         L'évaluation des risques a été réalisée selon la méthode de cotation suivante :<br/>
-        <b>Criticité = Gravité × Probabilité</b><br/><br/>
+        <b>{formule}</b><br/><br/>
 
         <b>Gravité (G):</b> 1 = Mineure, 2 = Moyenne, 3 = Grave, 4 = Très grave<br/>
         <b>Probabilité (P):</b> 1 = Très improbable, 2 = Improbable, 3 = Probable, 4 = Très probable<br/><br/>
-
-        <b>Niveaux de risque:</b><br/>
-        - Acceptable (1-2): Risque faible, surveillance normale<br/>
-        - Modéré (3-6): Risque modéré, actions de prévention à planifier<br/>
-        - Important (8-12): Risque important, actions de prévention prioritaires<br/>
-        - Critique (16): Risque critique, actions immédiates requises
         """
-        elements.append(Paragraph(methodology_text, styles['CustomNormal']))
-
-        return elements
+        if modele.facteurs_frequence:
+            facteurs = ', '.join(f"{frequence} = {facteur}" for frequence, facteur in modele.facteurs_frequence.items())
+            text += f"<b>Facteurs de fréquence:</b> {facteurs} (1 par défaut)<br/><br/>"
+
+        # Plages de criticité effectivement atteignables pour chaque niveau
+        frequences = [None] + list(modele.facteurs_frequence)
+        valeurs = {
+            modele.criticite(g, p, f)
+            for g in range(1, 5) for p in range(1, 5) for f in frequences
+        }
+        text += "<b>Niveaux de risque:</b><br/>"
+        for niveau in modele.niveaux:
+            valeurs_niveau = sorted(v for v in valeurs if modele.niveau(v) == niveau)
+            if not valeurs_niveau:
+                continue
+            plage = str(valeurs_niveau[0]) if len(valeurs_niveau) == 1 else f"{valeurs_niveau[0]}-{valeurs_niveau[-1]}"
+            description = DESCRIPTIONS_NIVEAUX.get(niveau)
+            text += f"- {niveau} ({plage}){': ' + description if description else ''}<br/>"
+
+        return text
 
     def _generate_risk_summary(self, duerp, styles):
         """Génère le tableau récapitulatif des risques"""
+        prioritaires = get_active_model().niveaux_prioritaires
+
+        # Calculer les statistiques
+        compteurs = {'total': 0}
+        for unite in duerp.unites_travail:
+            for risque in unite.risques:
+                compteurs['total'] += 1
+                compteurs[risque.niveau_risque] = compteurs.get(risque.niveau_risque, 0) + 1
+
+        repartition = [
+            (
+                unite.nom,
+                len(unite.risques),
+                len([r for r in unite.risques if r.niveau_risque in prioritaires])
+            )
+            for unite in duerp.unites_travail
+        ]
+
+        return self._risk_summary_flowables(compteurs, repartition, styles)
+
+    def _query_risk_summary(self, session, duerp_id):
+        """Calcule les données du tableau récapitulatif par requêtes agrégées"""
+        from ..models import UniteTrail, Risque
+
+        prioritaires = get_active_model().niveaux_prioritaires
+
+        compteurs = {'total': 0}
+        for niveau, nombre in session.execute(
+            select(Risque.niveau_risque, func.count(Risque.id))
+            .join(UniteTrail, Risque.unite_travail_id == UniteTrail.id)
+            .where(UniteTrail.duerp_id == duerp_id)
+            .group_by(Risque.niveau_risque)
+        ):
+            compteurs['total'] += nombre
+            compteurs[niveau] = compteurs.get(niveau, 0) + nombre
+
+        repartition = session.execute(
+            select(
+                UniteTrail.nom,
+                func.count(Risque.id),
+                func.coalesce(func.sum(case((Risque.niveau_risque.in_(prioritaires), 1), else_=0)), 0)
+            )
+            .outerjoin(Risque, Risque.unite_travail_id == UniteTrail.id)
+            .where(UniteTrail.duerp_id == duerp_id)
+            .group_by(UniteTrail.id, UniteTrail.nom)
+            .order_by(UniteTrail.id)
+        ).all()
+
+        return compteurs, repartition
+
+    def _risk_summary_flowables(self, compteurs, repartition, styles):
+        """
+        Tableau récapitulatif des risques
+
+        Args:
+            compteurs: Nombre de risques au total et par niveau
+            repartition: Liste de (nom de l'unité, nombre de risques, nombre de
+                risques critiques ou importants)
+        """
         elements = []
 
         elements.append(Paragraph("3. TABLEAU RÉCAPITULATIF DES RISQUES", styles['CustomHeading2']))
         elements.append(Spacer(1, 0.5*cm))
 
-        # Calculer les statistiques
-        total_risques = 0
-        risques_critiques = 0
-        risques_importants = 0
-        risques_moderes = 0
-        risques_acceptables = 0
+        modele = get_active_model()
+        total_risques = compteurs['total']
 
-        for unite in duerp.unites_travail:
-            for risque in unite.risques:
-                total_risques += 1
-                if risque.niveau_risque == 'Critique':
-                    risques_critiques += 1
-                elif risque.niveau_risque == 'Important':
-                    risques_importants += 1
-                elif risque.niveau_risque == 'Modéré':
-                    risques_moderes += 1
-                else:
-                    risques_acceptables += 1
+        def pourcentage(nombre):
+            return f"{(nombre/total_risques*100 if total_risques > 0 else 0):.1f}%"
+
+        # Niveaux du modèle actif, du plus élevé au plus faible, puis niveaux
+        # hors modèle (risques cotés par un autre modèle)
+        niveaux = list(reversed(modele.niveaux))
+        niveaux += sorted(
+            (n for n in compteurs if n != 'total' and n not in modele.niveaux),
+            key=lambda n: (n is None, n or '')
+        )
 
         # Tableau de statistiques
-        stats_data = [
-            ['<b>Niveau de risque</b>', '<b>Nombre</b>', '<b>%</b>'],
-            ['Risques critiques', str(risques_critiques), f"{(risques_critiques/total_risques*100 if total_risques > 0 else 0):.1f}%"],
-            ['Risques importants', str(risques_importants), f"{(risques_importants/total_risques*100 if total_risques > 0 else 0):.1f}%"],
-            ['Risques modérés', str(risques_moderes), f"{(risques_moderes/total_risques*100 if total_risques > 0 else 0):.1f}%"],
-            ['Risques acceptables', str(risques_acceptables), f"{(risques_acceptables/total_risques*100 if total_risques > 0 else 0):.1f}%"],
-            ['<b>Total</b>', f'<b>{total_risques}</b>', '<b>100%</b>']
-        ]
+        stats_data = [['<b>Niveau de risque</b>', '<b>Nombre</b>', '<b>%</b>']]
+        for niveau in niveaux:
+            nombre = compteurs.get(niveau, 0)
+            stats_data.append([niveau if niveau is not None else 'Non coté', str(nombre), pourcentage(nombre)])
+        stats_data.append(['<b>Total</b>', f'<b>{total_risques}</b>', '<b>100%</b>'])
 
         stats_table = Table(stats_data, colWidths=[8*cm, 3*cm, 3*cm])
         stats_table.setStyle(TableStyle([
@@ -223,10 +509,10 @@ class DUERPDocumentGenerator:
             ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
             ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#003366')),
             ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('BACKGROUND', (0, 1), (-1, 1), colors.HexColor('#FF6B6B')),
-            ('BACKGROUND', (0, 2), (-1, 2), colors.HexColor('#FFA500')),
-            ('BACKGROUND', (0, 3), (-1, 3), colors.HexColor('#FFD700')),
-            ('BACKGROUND', (0, 4), (-1, 4), colors.HexColor('#90EE90')),
+            *[
+                ('BACKGROUND', (0, ligne), (-1, ligne), couleur_niveau(modele, niveau))
+                for ligne, niveau in enumerate(niveaux, start=1)
+            ],
             ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#E6E6E6'))
         ]))
 
@@ -234,16 +520,15 @@ class DUERPDocumentGenerator:
         elements.append(Spacer(1, 1*cm))
 
         # Tableau par unité de travail
-        if duerp.unites_travail:
+        if repartition:
             elements.append(Paragraph("Répartition par unité de travail:", styles['CustomNormal']))
             elements.append(Spacer(1, 0.3*cm))
 
-            unite_data = [['<b>Unité de travail</b>', '<b>Nombre de risques</b>', '<b>Risques critiques/importants</b>']]
+            libelle_prioritaires = ' / '.join(reversed(modele.niveaux_prioritaires))
+            unite_data = [['<b>Unité de travail</b>', '<b>Nombre de risques</b>', f'<b>Risques {libelle_prioritaires}</b>']]
 
-            for unite in duerp.unites_travail:
-                nb_risques = len(unite.risques)
-                nb_critiques = len([r for r in unite.risques if r.niveau_risque in ['Critique', 'Important']])
-                unite_data.append([unite.nom, str(nb_risques), str(nb_critiques)])
+            for nom, nb_risques, nb_critiques in repartition:
+                unite_data.append([nom, str(nb_risques), str(nb_critiques)])
 
             unite_table = Table(unite_data, colWidths=[8*cm, 4*cm, 5*cm])
             unite_table.setStyle(TableStyle([
@@ -270,125 +555,251 @@ class DUERPDocumentGenerator:
         elements.append(Spacer(1, 0.5*cm))
 
         for unite in duerp.unites_travail:
-            # Titre de l'unité
-            elements.append(Paragraph(f"<b>Unité de travail: {unite.nom}</b>", styles['CustomHeading2']))
-
-            if unite.description:
-                elements.append(Paragraph(f"Description: {unite.description}", styles['CustomNormal']))
-            if unite.localisation:
-                elements.append(Paragraph(f"Localisation: {unite.localisation}", styles['CustomNormal']))
-            if unite.nombre_employes:
-                elements.append(Paragraph(f"Nombre d'employés: {unite.nombre_employes}", styles['CustomNormal']))
-
-            elements.append(Spacer(1, 0.3*cm))
+            elements.extend(self._unit_header(unite, styles))
 
             # Tableau des risques
             if unite.risques:
                 for idx, risque in enumerate(unite.risques, 1):
-                    # Couleur selon le niveau de risque
-                    color_map = {
-                        'Critique': colors.HexColor('#FF6B6B'),
-                        'Important': colors.HexColor('#FFA500'),
-                        'Modéré': colors.HexColor('#FFD700'),
-                        'Acceptable': colors.HexColor('#90EE90')
-                    }
-                    risk_color = color_map.get(risque.niveau_risque, colors.white)
-
-                    # En-tête du risque
-                    risk_header = [
-                        [f'<b>Risque #{idx}</b>', f'<b>{risque.categorie}</b>', f'<b>Criticité: {risque.criticite} - {risque.niveau_risque}</b>']
-                    ]
+                    elements.extend(self._risk_flowables(idx, risque, risque.mesures_prevention, styles))
+            else:
+                elements.append(Paragraph("Aucun risque identifié pour cette unité.", styles['CustomNormal']))
 
-                    risk_header_table = Table(risk_header, colWidths=[3*cm, 7*cm, 7*cm])
-                    risk_header_table.setStyle(TableStyle([
-                        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-                        ('FONTSIZE', (0, 0), (-1, -1), 9),
-                        ('BACKGROUND', (0, 0), (-1, -1), risk_color),
-                        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
-                    ]))
-
-                    elements.append(risk_header_table)
-
-                    # Détails du risque
-                    risk_details = [
-                        ['Description:', risque.description or 'N/A'],
-                        ['Situation de danger:', risque.situation_danger or 'N/A'],
-                        ['Gravité:', f"{risque.gravite}/4"],
-                        ['Probabilité:', f"{risque.probabilite}/4"],
-                        ['Fréquence exposition:', risque.frequence_exposition or 'N/A'],
-                        ['Personnes exposées:', f"{risque.personnes_exposees or 0} - {risque.personnes_concernees or 'N/A'}"]
-                    ]
+            elements.extend(self._unit_footer())
 
-                    risk_table = Table(risk_details, colWidths=[5*cm, 12*cm])
-                    risk_table.setStyle(TableStyle([
-                        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-                        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-                        ('FONTSIZE', (0, 0), (-1, -1), 8),
-                        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F5F5F5'))
-                    ]))
+        return elements
 
-                    elements.append(risk_table)
+    def _stream_detailed_risks(self, session, duerp_id, styles, profil=None):
+        """
+        Produit le détail des risques à partir d'un curseur lu par lots
 
-                    # Mesures de prévention
-                    if risque.mesures_prevention:
-                        mesures_data = [['<b>Type</b>', '<b>Description</b>', '<b>Statut</b>', '<b>Responsable</b>']]
-
-                        for mesure in risque.mesures_prevention:
-                            mesures_data.append([
-                                mesure.type_mesure or 'N/A',
-                                mesure.description or 'N/A',
-                                mesure.statut or 'N/A',
-                                mesure.responsable or 'N/A'
-                            ])
-
-                        mesures_table = Table(mesures_data, colWidths=[4*cm, 7*cm, 3*cm, 3*cm])
-                        mesures_table.setStyle(TableStyle([
-                            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-                            ('FONTSIZE', (0, 0), (-1, -1), 8),
-                            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#003366')),
-                            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke)
-                        ]))
-
-                        elements.append(Paragraph("<b>Mesures de prévention:</b>", styles['CustomNormal']))
-                        elements.append(mesures_table)
-
-                    elements.append(Spacer(1, 0.5*cm))
-            else:
-                elements.append(Paragraph("Aucun risque identifié pour cette unité.", styles['CustomNormal']))
+        Les lignes (unité, risque) sont lues par lots de TAILLE_LOT_FLUX ; les
+        mesures de chaque lot sont chargées par une seule requête. Le volume
+        du DUERP (unités, risques, mesures) est compté dans profil au fil des
+        lignes.
+        """
+        from ..models import UniteTrail, Risque
+
+        yield Paragraph("4. ÉVALUATION DÉTAILLÉE DES RISQUES", styles['CustomHeading2'])
+        yield Spacer(1, 0.5*cm)
+
+        requete = (
+            select(
+                UniteTrail.id.label('unite_id'),
+                UniteTrail.nom.label('unite_nom'),
+                UniteTrail.description.label('unite_description'),
+                UniteTrail.localisation.label('unite_localisation'),
+                UniteTrail.nombre_employes.label('unite_nombre_employes'),
+                Risque.id.label('risque_id'),
+                Risque.categorie, Risque.description, Risque.situation_danger,
+                Risque.gravite, Risque.probabilite, Risque.frequence_exposition,
+                Risque.criticite, Risque.niveau_risque,
+                Risque.personnes_exposees, Risque.personnes_concernees
+            )
+            .select_from(UniteTrail)
+            .outerjoin(Risque, Risque.unite_travail_id == UniteTrail.id)
+            .where(UniteTrail.duerp_id == duerp_id)
+            .order_by(UniteTrail.id, Risque.id)
+            .execution_options(yield_per=TAILLE_LOT_FLUX)
+        )
 
-            elements.append(Spacer(1, 0.5*cm))
-            elements.append(HRFlowable(width="100%", thickness=1, color=colors.grey))
-            elements.append(Spacer(1, 0.5*cm))
+        unite_courante = None
+        idx = 0
+        mesures_unite = 0
+        for lot in session.execute(requete).partitions():
+            mesures = self._query_mesures(session, [ligne.risque_id for ligne in lot if ligne.risque_id is not None])
+
+            for ligne in lot:
+                if ligne.unite_id != unite_courante:
+                    if unite_courante is not None:
+                        yield from self._unit_footer()
+                    unite_courante = ligne.unite_id
+                    idx = 0
+                    mesures_unite = 0
+                    if profil is not None:
+                        profil.unites += 1
+                    yield from self._unit_header(SimpleNamespace(
+                        nom=ligne.unite_nom,
+                        description=ligne.unite_description,
+                        localisation=ligne.unite_localisation,
+                        nombre_employes=ligne.unite_nombre_employes
+                    ), styles)
+
+                if ligne.risque_id is None:
+                    yield Paragraph("Aucun risque identifié pour cette unité.", styles['CustomNormal'])
+                    continue
+
+                idx += 1
+                mesures_risque = mesures.get(ligne.risque_id, [])
+                if profil is not None:
+                    mesures_unite += len(mesures_risque)
+                    profil.risques += 1
+                    profil.mesures += len(mesures_risque)
+                    profil.mesures_max_unite = max(profil.mesures_max_unite, mesures_unite)
+                yield from self._risk_flowables(idx, ligne, mesures_risque, styles)
+
+        if unite_courante is not None:
+            yield from self._unit_footer()
+
+    def _query_mesures(self, session, risque_ids):
+        """Mesures de prévention d'un lot de risques, groupées par risque"""
+        from ..models import MesurePrevention
+
+        mesures = {}
+        if not risque_ids:
+            return mesures
+        for mesure in session.execute(
+            select(
+                MesurePrevention.risque_id, MesurePrevention.type_mesure, MesurePrevention.description,
+                MesurePrevention.statut, MesurePrevention.responsable
+            )
+            .where(MesurePrevention.risque_id.in_(risque_ids))
+            .order_by(MesurePrevention.risque_id, MesurePrevention.id)
+        ):
+            mesures.setdefault(mesure.risque_id, []).append(mesure)
+        return mesures
+
+    def _unit_header(self, unite, styles):
+        """Titre et description d'une unité de travail"""
+        elements = []
+
+        # Titre de l'unité
+        elements.append(Paragraph(f"<b>Unité de travail: {unite.nom}</b>", styles['CustomHeading2']))
+
+        if unite.description:
+            elements.append(Paragraph(f"Description: {unite.description}", styles['CustomNormal']))
+        if unite.localisation:
+            elements.append(Paragraph(f"Localisation: {unite.localisation}", styles['CustomNormal']))
+        if unite.nombre_employes:
+            elements.append(Paragraph(f"Nombre d'employés: {unite.nombre_employes}", styles['CustomNormal']))
 
+        elements.append(Spacer(1, 0.3*cm))
         return elements
 
-    def generate_docx(self, duerp):
+    def _unit_footer(self):
+        """Séparateur de fin d'unité de travail"""
+        return [
+            Spacer(1, 0.5*cm),
+            HRFlowable(width="100%", thickness=1, color=colors.grey),
+            Spacer(1, 0.5*cm)
+        ]
+
+    def _risk_flowables(self, idx, risque, mesures, styles):
         """
-        Génère un document DOCX pour le DUERP
+        Fiche d'un risque et de ses mesures de prévention
 
         Args:
-            duerp: Instance du modèle DUERP
+            idx: Numéro du risque dans l'unité
+            risque: Risque (RisqueRecord ou ligne de requête)
+            mesures: Mesures de prévention du risque
+        """
+        elements = []
+
+        # Couleur selon le niveau de risque
+        risk_color = couleur_niveau(get_active_model(), risque.niveau_risque)
+
+        # En-tête du risque
+        risk_header = [
+            [f'<b>Risque #{idx}</b>', f'<b>{risque.categorie}</b>', f'<b>Criticité: {risque.criticite} - {risque.niveau_risque}</b>']
+        ]
+
+        risk_header_table = Table(risk_header, colWidths=[3*cm, 7*cm, 7*cm])
+        risk_header_table.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('BACKGROUND', (0, 0), (-1, -1), risk_color),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
+        ]))
+
+        elements.append(risk_header_table)
+
+        # Détails du risque
+        risk_details = [
+            ['Description:', risque.description or 'N/A'],
+            ['Situation de danger:', risque.situation_danger or 'N/A'],
+            ['Gravité:', f"{risque.gravite}/4"],
+            ['Probabilité:', f"{risque.probabilite}/4"],
+            ['Fréquence exposition:', risque.frequence_exposition or 'N/A'],
+            ['Personnes exposées:', f"{risque.personnes_exposees or 0} - {risque.personnes_concernees or 'N/A'}"]
+        ]
+
+        risk_table = Table(risk_details, colWidths=[5*cm, 12*cm])
+        risk_table.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+            ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+            ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#F5F5F5'))
+        ]))
+
+        elements.append(risk_table)
+
+        # Mesures de prévention
+        if mesures:
+            mesures_data = [['<b>Type</b>', '<b>Description</b>', '<b>Statut</b>', '<b>Responsable</b>']]
+
+            for mesure in mesures:
+                mesures_data.append([
+                    mesure.type_mesure or 'N/A',
+                    mesure.description or 'N/A',
+                    mesure.statut or 'N/A',
+                    mesure.responsable or 'N/A'
+                ])
+
+            mesures_table = Table(mesures_data, colWidths=[4*cm, 7*cm, 3*cm, 3*cm])
+            mesures_table.setStyle(TableStyle([
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+                ('FONTSIZE', (0, 0), (-1, -1), 8),
+                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#003366')),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke)
+            ]))
+
+            elements.append(Paragraph("<b>Mesures de prévention:</b>", styles['CustomNormal']))
+            elements.append(mesures_table)
+
+        elements.append(Spacer(1, 0.5*cm))
+        return elements
+
+    def generate_docx(self, duerp):
+        """
+        Génère un document DOCX pour le DUERP et l'enregistre (voir archive)
 
         Returns:
             str: Chemin du fichier DOCX généré
         """
+        return self.archive(self.render_docx(duerp), duerp, 'docx')
+
+    @traced('docx.rendu')
+    def render_docx(self, duerp, output=None):
+        """
+        Génère le document DOCX du DUERP en mémoire
+
+        Args:
+            duerp: Instance du modèle DUERP ou DUERPRecord (voir render_pdf)
+            output: Fichier (objet binaire) recevant le document ; s'il est
+                omis, le contenu est retourné
+
+        Returns:
+            bytes: Contenu du DOCX (si output n'est pas fourni)
+        """
+        profil = self.last_profile = RenderProfile('docx', memoire=self.profile_memory)
         try:
             from docx import Document
             from docx.shared import Inches, Pt, RGBColor
             from docx.enum.text import WD_ALIGN_PARAGRAPH
 
-            # Nom du fichier
-            filename = f"DUERP_{duerp.entreprise_nom.replace(' ', '_')}_{duerp.version}_{datetime.now().strftime('%Y%m%d')}.docx"
-            filepath = self.output_dir / filename
+            buffer = output if output is not None else BytesIO()
+            profil.start()
+            duerp = as_record(duerp)
+            profil.lap('chargement')
+            profil.measure_tree(duerp)
 
             # Création du document
             document = Document()
@@ -415,6 +826,7 @@ class DUERPDocumentGenerator:
                 p.alignment = WD_ALIGN_PARAGRAPH.CENTER
 
             document.add_page_break()
+            profil.lap('page_garde')
 
             # Informations du document
             document.add_heading('INFORMATIONS GÉNÉRALES', level=1)
@@ -435,6 +847,7 @@ class DUERPDocumentGenerator:
                 table.rows[i].cells[1].text = str(value)
 
             document.add_page_break()
+            profil.lap('informations')
 
             # Risques détaillés
             document.add_heading('ÉVALUATION DÉTAILLÉE DES RISQUES', level=1)
@@ -488,10 +901,19 @@ class DUERPDocumentGenerator:
 
                     document.add_paragraph()
 
+            profil.lap('risques_detailles')
+
             # Sauvegarde
-            document.save(str(filepath))
+            document.save(buffer)
+            profil.lap('enregistrement')
+            profil.tableaux = len(document.tables)
+            profil.stop(buffer.tell())
 
-            return str(filepath)
+            return buffer.getvalue() if output is None else None
 
         except ImportError:
             raise Exception("python-docx n'est pas installé. Installez-le avec: pip install python-docx")
+        finally:
+            # Sans effet si le profil est terminé ; arrête la mesure mémoire
+            # si le rendu a été interrompu
+            profil.stop()
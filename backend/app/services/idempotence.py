@@ -0,0 +1,163 @@
+"""
+Idempotence des requêtes de création (en-tête Idempotency-Key)
+
+Un client qui renvoie une requête avec la même clé reçoit la réponse
+enregistrée lors de la première exécution, sans que la création soit
+rejouée. La clé est réservée avant l'exécution : une seconde requête
+concurrente avec la même clé est refusée (409) au lieu d'être exécutée.
+
+Une réservation n'est reprise par une nouvelle requête qu'une fois la durée
+maximale d'une requête (SERVER_TIMEOUT) écoulée : la requête qui l'a posée
+ne peut alors plus être en cours.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, jsonify, make_response, request
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from ..models import db, CleIdempotence
+
+EN_TETE = 'Idempotency-Key'
+EN_TETE_REJEU = 'Idempotent-Replayed'
+LONGUEUR_MAX_CLE = 255
+
+
+def request_fingerprint():
+    """Empreinte de la requête courante (méthode, chemin et corps JSON canonique)"""
+    corps = request.get_json(silent=True)
+    if corps is None:
+        contenu = request.get_data()
+    else:
+        contenu = json.dumps(corps, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    empreinte = hashlib.sha256(f'{request.method} {request.path}\n'.encode('utf-8'))
+    empreinte.update(contenu)
+    return empreinte.hexdigest()
+
+
+def _erreur(message, statut):
+    return jsonify({
+        'success': False,
+        'error': message
+    }), statut
+
+
+def _reserver(session, cle, route, empreinte):
+    """
+    Réserve la clé pour la requête courante
+
+    Returns:
+        CleIdempotence | None: None si la clé est réservée, sinon l'entrée existante
+    """
+    maintenant = datetime.utcnow()
+    # Les réponses expirées libèrent leur clé ; les réservations (requêtes en
+    # cours) ne sont jamais supprimées ici
+    session.execute(delete(CleIdempotence).where(
+        CleIdempotence.statut_http.isnot(None),
+        CleIdempotence.date_expiration < maintenant
+    ))
+
+    delai = max(
+        current_app.config.get('IDEMPOTENCY_PENDING_SECONDS', 120),
+        current_app.config.get('SERVER_TIMEOUT', 120)
+    )
+    expiration = maintenant + timedelta(seconds=delai)
+    session.add(CleIdempotence(
+        cle=cle,
+        route=route,
+        empreinte=empreinte,
+        date_creation=maintenant,
+        date_expiration=expiration
+    ))
+    try:
+        session.commit()
+        return None
+    except IntegrityError:
+        session.rollback()
+
+    # Réservation abandonnée (requête interrompue sans libérer la clé) :
+    # reprise conditionnelle, une seule requête concurrente l'obtient
+    reprise = session.execute(
+        update(CleIdempotence)
+        .where(
+            CleIdempotence.cle == cle,
+            CleIdempotence.route == route,
+            CleIdempotence.statut_http.is_(None),
+            CleIdempotence.date_expiration < maintenant
+        )
+        .values(empreinte=empreinte, date_creation=maintenant, date_expiration=expiration)
+    )
+    session.commit()
+    if reprise.rowcount == 1:
+        return None
+
+    return session.execute(
+        db.select(CleIdempotence).filter_by(cle=cle, route=route)
+    ).scalar_one()
+
+
+def _enregistrer(session, cle, route, reponse):
+    """Enregistre la réponse d'une requête, ou libère la clé si elle a échoué"""
+    session.rollback()
+    entree = session.execute(
+        db.select(CleIdempotence).filter_by(cle=cle, route=route)
+    ).scalar_one_or_none()
+    if entree is None:
+        return
+
+    if reponse is None or reponse.status_code >= 500:
+        # Erreur serveur : la requête pourra être réessayée avec la même clé
+        session.delete(entree)
+    else:
+        duree = current_app.config.get('IDEMPOTENCY_TTL_HOURS', 24)
+        entree.statut_http = reponse.status_code
+        entree.reponse = reponse.get_data(as_text=True)
+        entree.date_expiration = datetime.utcnow() + timedelta(hours=duree)
+    session.commit()
+
+
+def idempotent(vue):
+    """
+    Décorateur de route rendant la requête idempotente si elle porte
+    l'en-tête Idempotency-Key
+
+    - clé inconnue : la requête est exécutée et sa réponse enregistrée
+    - clé connue, même corps : la réponse enregistrée est rejouée
+    - clé connue, corps différent : 422
+    - clé en cours d'exécution : 409
+    """
+    @wraps(vue)
+    def wrapper(*args, **kwargs):
+        cle = request.headers.get(EN_TETE)
+        if not cle:
+            return vue(*args, **kwargs)
+        if len(cle) > LONGUEUR_MAX_CLE:
+            return _erreur(f'{EN_TETE} ne doit pas dépasser {LONGUEUR_MAX_CLE} caractères', 400)
+
+        route = request.endpoint
+        empreinte = request_fingerprint()
+        existante = _reserver(db.session, cle, route, empreinte)
+
+        if existante is not None:
+            if existante.empreinte != empreinte:
+                return _erreur(f'{EN_TETE} déjà utilisée pour une requête différente', 422)
+            if existante.statut_http is None:
+                return _erreur('Une requête avec cette clé d\'idempotence est en cours de traitement', 409)
+
+            reponse = current_app.response_class(
+                existante.reponse, status=existante.statut_http, mimetype='application/json'
+            )
+            reponse.headers[EN_TETE_REJEU] = 'true'
+            return reponse
+
+        reponse = None
+        try:
+            reponse = make_response(vue(*args, **kwargs))
+            return reponse
+        finally:
+            _enregistrer(db.session, cle, route, reponse)
+
+    return wrapper
@@ -0,0 +1,122 @@
+"""
+Métriques de fonctionnement de l'application (compteurs, jauges, histogrammes)
+Les valeurs sont tenues en mémoire par processus et exposées au format texte
+Prometheus par la route /metrics.
+"""
+import threading
+
+# Bornes des histogrammes de durée (secondes)
+BORNES_DUREE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _cle(nom, labels):
+    return nom, tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(labels, extra=None):
+    paires = list(labels) + list(extra or [])
+    if not paires:
+        return ''
+    contenu = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in paires
+    )
+    return '{' + contenu + '}'
+
+
+class Metrics:
+    """Registre de métriques thread-safe"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._compteurs = {}
+        self._jauges = {}
+        self._histogrammes = {}
+        self._descriptions = {}
+
+    def describe(self, nom, description):
+        """Associe une description (ligne HELP) à une métrique"""
+        self._descriptions[nom] = description
+
+    def inc(self, nom, valeur=1, **labels):
+        """Incrémente un compteur"""
+        cle = _cle(nom, labels)
+        with self._lock:
+            self._compteurs[cle] = self._compteurs.get(cle, 0) + valeur
+
+    def set(self, nom, valeur, **labels):
+        """Fixe la valeur d'une jauge"""
+        with self._lock:
+            self._jauges[_cle(nom, labels)] = valeur
+
+    def observe(self, nom, valeur, bornes=BORNES_DUREE, **labels):
+        """Enregistre une observation dans un histogramme"""
+        cle = _cle(nom, labels)
+        with self._lock:
+            histogramme = self._histogrammes.get(cle)
+            if histogramme is None:
+                histogramme = self._histogrammes[cle] = {
+                    'bornes': bornes, 'seaux': [0] * len(bornes), 'nombre': 0, 'somme': 0.0, 'max': 0.0
+                }
+            for i, borne in enumerate(histogramme['bornes']):
+                if valeur <= borne:
+                    histogramme['seaux'][i] += 1
+            histogramme['nombre'] += 1
+            histogramme['somme'] += valeur
+            histogramme['max'] = max(histogramme['max'], valeur)
+
+    def clear(self):
+        """Remet toutes les métriques à zéro"""
+        with self._lock:
+            self._compteurs.clear()
+            self._jauges.clear()
+            self._histogrammes.clear()
+
+    def to_dict(self):
+        """Instantané des métriques sous forme de dictionnaire"""
+        def nom_complet(cle):
+            nom, labels = cle
+            return nom + _format_labels(labels)
+
+        with self._lock:
+            return {
+                'compteurs': {nom_complet(c): v for c, v in self._compteurs.items()},
+                'jauges': {nom_complet(c): v for c, v in self._jauges.items()},
+                'histogrammes': {
+                    nom_complet(c): {'nombre': h['nombre'], 'somme': h['somme'], 'max': h['max']}
+                    for c, h in self._histogrammes.items()
+                }
+            }
+
+    def to_prometheus(self):
+        """Rendu au format d'exposition texte Prometheus"""
+        lignes = []
+        deja_decrits = set()
+
+        def entete(nom, type_metrique):
+            if nom in deja_decrits:
+                return
+            deja_decrits.add(nom)
+            if nom in self._descriptions:
+                lignes.append(f'# HELP {nom} {self._descriptions[nom]}')
+            lignes.append(f'# TYPE {nom} {type_metrique}')
+
+        with self._lock:
+            for (nom, labels), valeur in sorted(self._compteurs.items()):
+                entete(nom, 'counter')
+                lignes.append(f'{nom}{_format_labels(labels)} {valeur}')
+            for (nom, labels), valeur in sorted(self._jauges.items()):
+                entete(nom, 'gauge')
+                lignes.append(f'{nom}{_format_labels(labels)} {valeur}')
+            for (nom, labels), h in sorted(self._histogrammes.items()):
+                entete(nom, 'histogram')
+                for borne, nombre in zip(h['bornes'], h['seaux']):
+                    lignes.append(f'{nom}_bucket{_format_labels(labels, [("le", borne)])} {nombre}')
+                lignes.append(f'{nom}_bucket{_format_labels(labels, [("le", "+Inf")])} {h["nombre"]}')
+                lignes.append(f'{nom}_sum{_format_labels(labels)} {h["somme"]}')
+                lignes.append(f'{nom}_count{_format_labels(labels)} {h["nombre"]}')
+
+        return '\n'.join(lignes) + '\n'
+
+
+# Registre partagé par l'application
+metrics = Metrics()
@@ -0,0 +1,439 @@
+"""
+Opérations d'écriture sur les DUERP, unités, risques et mesures
+
+Ces fonctions appliquent les modifications dans la session sans la valider :
+les routes unitaires valident après une opération, la route /api/batch après
+l'ensemble des opérations d'une requête.
+"""
+import re
+from datetime import datetime
+
+from sqlalchemy.orm.exc import StaleDataError
+
+from ..models import DUERP, UniteTrail, Risque, MesurePrevention, EvaluationHistorique
+from .snapshots import save_snapshot
+
+
+class OperationError(Exception):
+    """Erreur d'une opération d'écriture, associée à un code HTTP"""
+
+    def __init__(self, message, status=400, operation=None, data=None):
+        super().__init__(message)
+        self.status = status
+        self.operation = operation
+        self.data = data
+
+
+MODELES = {
+    'duerp': DUERP,
+    'unite': UniteTrail,
+    'risque': Risque,
+    'mesure': MesurePrevention
+}
+
+LIBELLES = {
+    'duerp': 'DUERP',
+    'unite': 'Unité de travail',
+    'risque': 'Risque',
+    'mesure': 'Mesure de prévention'
+}
+
+
+def get_object(session, ressource, objet_id):
+    """
+    Récupère un objet par son type de ressource et son identifiant
+
+    Raises:
+        OperationError: 404 si l'objet n'existe pas
+    """
+    objet = session.get(MODELES[ressource], objet_id)
+    if objet is None:
+        raise OperationError(f'{LIBELLES[ressource]} {objet_id} introuvable', 404)
+    return objet
+
+
+def version_from_etag(valeur):
+    """
+    Extrait la version de ligne d'un en-tête If-Match ("3", W/"3" ou 3)
+
+    Returns:
+        int | None: None si l'en-tête est absent ou vaut *
+    """
+    if not valeur or valeur.strip() == '*':
+        return None
+    valeur = valeur.strip()
+    if valeur.startswith('W/'):
+        valeur = valeur[2:]
+    try:
+        return int(valeur.strip('"'))
+    except ValueError:
+        raise OperationError(f'En-tête If-Match invalide: {valeur}')
+
+
+def conflict_error(session, ressource, objet_id):
+    """Erreur 409 portant l'état courant de l'objet modifié par ailleurs"""
+    objet = session.get(MODELES[ressource], objet_id, populate_existing=True)
+    if objet is None:
+        return OperationError(f'Conflit de version : {LIBELLES[ressource]} {objet_id} n\'existe plus', 409)
+    return OperationError(
+        f'Conflit de version : {LIBELLES[ressource]} {objet_id} (version courante : {objet.version_id})',
+        409,
+        data=SERIALISATIONS[ressource](objet)
+    )
+
+
+def check_version(session, ressource, objet, attendue):
+    """
+    Vérifie que la version de ligne attendue par le client est la version courante
+
+    Raises:
+        OperationError: 409 avec l'état courant si l'objet a changé
+    """
+    if attendue is None:
+        return
+    try:
+        attendue = int(attendue)
+    except (TypeError, ValueError):
+        raise OperationError(f'version_id invalide: {attendue}')
+    if objet.version_id != attendue:
+        raise conflict_error(session, ressource, objet.id)
+
+
+def update_object(session, ressource, objet_id, data, version=None):
+    """
+    Met à jour un objet sous contrôle de version optimiste
+
+    La version attendue est celle de l'en-tête If-Match (version) ou, à
+    défaut, le champ version_id des données. Le flush est effectué ici pour
+    qu'une modification concurrente survenue entre la lecture et l'écriture
+    soit aussi signalée par une erreur 409.
+    """
+    objet = get_object(session, ressource, objet_id)
+    check_version(session, ressource, objet, version if version is not None else data.get('version_id'))
+    try:
+        MISES_A_JOUR[ressource](session, objet, data)
+        session.flush()
+    except StaleDataError:
+        session.rollback()
+        raise conflict_error(session, ressource, objet_id)
+    return objet
+
+
+def _champs_obligatoires(data, champs):
+    for champ, message in champs:
+        if not data.get(champ):
+            raise OperationError(message)
+
+
+def _mettre_a_jour(objet, data, champs):
+    for champ in champs:
+        if champ in data:
+            setattr(objet, champ, data[champ])
+
+
+def _date(valeur, champ):
+    """
+    Convertit une date ISO 8601 reçue du client
+
+    Raises:
+        OperationError: 400 si la date est invalide
+    """
+    if not valeur:
+        return None
+    try:
+        return datetime.fromisoformat(valeur)
+    except (TypeError, ValueError):
+        raise OperationError(f'{champ} invalide (date ISO 8601 attendue): {valeur}')
+
+
+def create_duerp(session, data):
+    """Crée un DUERP et son entrée d'historique de création"""
+    _champs_obligatoires(data, [
+        ('entreprise_nom', 'Le nom de l\'entreprise est obligatoire')
+    ])
+
+    duerp = DUERP(
+        entreprise_nom=data.get('entreprise_nom'),
+        entreprise_siret=data.get('entreprise_siret'),
+        entreprise_adresse=data.get('entreprise_adresse'),
+        entreprise_activite=data.get('entreprise_activite'),
+        effectif=data.get('effectif'),
+        version=data.get('version', '1.0'),
+        responsable_evaluation=data.get('responsable_evaluation'),
+        responsable_validation=data.get('responsable_validation'),
+        statut='brouillon'
+    )
+    session.add(duerp)
+
+    # Créer une entrée dans l'historique
+    historique = EvaluationHistorique(
+        duerp=duerp,
+        version=duerp.version,
+        type_modification='Création',
+        description_modifications='Création initiale du DUERP',
+        evaluateur=data.get('responsable_evaluation', 'Non spécifié'),
+        nombre_risques_total=0,
+        nombre_risques_critiques=0,
+        nombre_mesures_prevention=0
+    )
+    session.add(historique)
+    session.flush()
+    save_snapshot(session, historique)
+
+    return duerp
+
+
+def update_duerp(session, duerp, data):
+    """Met à jour un DUERP et trace la modification dans l'historique"""
+    _mettre_a_jour(duerp, data, [
+        'entreprise_nom', 'entreprise_siret', 'entreprise_adresse', 'entreprise_activite',
+        'effectif', 'responsable_evaluation', 'responsable_validation', 'statut'
+    ])
+    duerp.date_derniere_maj = datetime.utcnow()
+
+    # Créer une entrée dans l'historique
+    if data.get('create_history', True):
+        historique = EvaluationHistorique(
+            duerp_id=duerp.id,
+            version=duerp.version,
+            type_modification='Mise à jour',
+            description_modifications=data.get('description_modifications', 'Mise à jour des informations'),
+            evaluateur=data.get('evaluateur', duerp.responsable_evaluation)
+        )
+        session.add(historique)
+        save_snapshot(session, historique)
+
+    return duerp
+
+
+def create_unite(session, data):
+    """Crée une unité de travail"""
+    _champs_obligatoires(data, [
+        ('duerp_id', 'duerp_id est obligatoire'),
+        ('nom', 'Le nom de l\'unité est obligatoire')
+    ])
+
+    # Vérifier que le DUERP existe
+    get_object(session, 'duerp', data['duerp_id'])
+
+    unite = UniteTrail(
+        duerp_id=data['duerp_id'],
+        nom=data['nom'],
+        description=data.get('description'),
+        localisation=data.get('localisation'),
+        nombre_employes=data.get('nombre_employes')
+    )
+    session.add(unite)
+    return unite
+
+
+def update_unite(session, unite, data):
+    """Met à jour une unité de travail"""
+    _mettre_a_jour(unite, data, ['nom', 'description', 'localisation', 'nombre_employes'])
+    return unite
+
+
+def create_risque(session, data):
+    """Crée un risque (la criticité est calculée à la création)"""
+    _champs_obligatoires(data, [
+        ('unite_travail_id', 'unite_travail_id est obligatoire'),
+        ('categorie', 'La catégorie du risque est obligatoire'),
+        ('description', 'La description du risque est obligatoire')
+    ])
+
+    # Vérifier que l'unité existe
+    get_object(session, 'unite', data['unite_travail_id'])
+
+    risque = Risque(
+        unite_travail_id=data['unite_travail_id'],
+        categorie=data['categorie'],
+        sous_categorie=data.get('sous_categorie'),
+        description=data['description'],
+        situation_danger=data.get('situation_danger'),
+        gravite=data.get('gravite', 1),
+        probabilite=data.get('probabilite', 1),
+        frequence_exposition=data.get('frequence_exposition'),
+        personnes_exposees=data.get('personnes_exposees'),
+        personnes_concernees=data.get('personnes_concernees')
+    )
+    session.add(risque)
+    return risque
+
+
+def update_risque(session, risque, data):
+    """Met à jour un risque et recalcule sa criticité"""
+    _mettre_a_jour(risque, data, [
+        'categorie', 'sous_categorie', 'description', 'situation_danger', 'gravite',
+        'probabilite', 'frequence_exposition', 'personnes_exposees', 'personnes_concernees'
+    ])
+
+    # Recalculer la criticité
+    risque.calculer_criticite()
+    return risque
+
+
+def create_mesure(session, data):
+    """Crée une mesure de prévention"""
+    _champs_obligatoires(data, [
+        ('risque_id', 'risque_id est obligatoire'),
+        ('type_mesure', 'Le type de mesure est obligatoire'),
+        ('description', 'La description de la mesure est obligatoire')
+    ])
+
+    # Vérifier que le risque existe
+    get_object(session, 'risque', data['risque_id'])
+
+    mesure = MesurePrevention(
+        risque_id=data['risque_id'],
+        type_mesure=data['type_mesure'],
+        niveau_hierarchie=data.get('niveau_hierarchie'),
+        description=data['description'],
+        statut=data.get('statut', 'planifié'),
+        responsable=data.get('responsable'),
+        cout_estime=data.get('cout_estime'),
+        efficacite=data.get('efficacite')
+    )
+
+    # Dates
+    if data.get('date_mise_en_oeuvre'):
+        mesure.date_mise_en_oeuvre = _date(data['date_mise_en_oeuvre'], 'date_mise_en_oeuvre')
+    if data.get('date_echeance'):
+        mesure.date_echeance = _date(data['date_echeance'], 'date_echeance')
+
+    session.add(mesure)
+    return mesure
+
+
+def update_mesure(session, mesure, data):
+    """Met à jour une mesure de prévention"""
+    _mettre_a_jour(mesure, data, [
+        'type_mesure', 'niveau_hierarchie', 'description', 'statut', 'responsable',
+        'cout_estime', 'efficacite'
+    ])
+
+    # Dates
+    if 'date_mise_en_oeuvre' in data:
+        mesure.date_mise_en_oeuvre = _date(data['date_mise_en_oeuvre'], 'date_mise_en_oeuvre')
+    if 'date_echeance' in data:
+        mesure.date_echeance = _date(data['date_echeance'], 'date_echeance')
+    return mesure
+
+
+def delete_object(session, objet):
+    """Supprime un objet (et sa descendance par cascade)"""
+    session.delete(objet)
+
+
+CREATIONS = {
+    'duerp': create_duerp,
+    'unite': create_unite,
+    'risque': create_risque,
+    'mesure': create_mesure
+}
+
+MISES_A_JOUR = {
+    'duerp': update_duerp,
+    'unite': update_unite,
+    'risque': update_risque,
+    'mesure': update_mesure
+}
+
+SERIALISATIONS = {
+    'duerp': lambda objet: objet.to_dict(include_unites=False),
+    'unite': lambda objet: objet.to_dict(include_risques=False),
+    'risque': lambda objet: objet.to_dict(include_mesures=False),
+    'mesure': lambda objet: objet.to_dict()
+}
+
+# Référence à l'objet créé par une opération précédente du lot : "$<index>"
+REFERENCE = re.compile(r'^\$(\d+)$')
+
+
+def _resoudre(session, valeur, crees, index):
+    """Remplace une référence "$N" par l'identifiant de l'objet créé par l'opération N"""
+    if not isinstance(valeur, str):
+        return valeur
+    correspondance = REFERENCE.match(valeur)
+    if not correspondance:
+        return valeur
+
+    cible = int(correspondance.group(1))
+    if cible >= index or cible not in crees:
+        raise OperationError(f'Référence {valeur} invalide : l\'opération {cible} ne crée pas d\'objet antérieur')
+    objet = crees[cible]
+    if objet.id is None:
+        # L'identifiant n'est attribué qu'au flush, effectué seulement si nécessaire
+        session.flush()
+    return objet.id
+
+
+def run_batch(session, liste_operations):
+    """
+    Applique une liste ordonnée d'opérations dans la transaction courante
+
+    Chaque opération est un dictionnaire {"action": create|update|delete,
+    "ressource": duerp|unite|risque|mesure, "id": ..., "data": {...}}. Les
+    valeurs "$N" de id et data désignent l'objet créé par l'opération N.
+    Un champ version_id dans data active le contrôle de version optimiste.
+    Les écritures sont envoyées à la base au fil du lot lorsqu'une opération
+    en a besoin (identifiant d'un objet créé référencé par "$N", instantané
+    d'historique d'un DUERP, requête de vérification), le reste par un flush
+    final ; l'appelant valide la transaction.
+
+    Returns:
+        list: Résultat de chaque opération
+
+    Raises:
+        OperationError: À la première opération en erreur (avec son index)
+    """
+    crees = {}
+    appliquees = []
+
+    for index, operation in enumerate(liste_operations):
+        try:
+            if not isinstance(operation, dict):
+                raise OperationError('Une opération doit être un objet JSON')
+            action = operation.get('action')
+            ressource = operation.get('ressource')
+            data = operation.get('data') or {}
+            if action not in ('create', 'update', 'delete'):
+                raise OperationError(f'Action inconnue: {action}')
+            if ressource not in MODELES:
+                raise OperationError(f'Ressource inconnue: {ressource}')
+            if not isinstance(data, dict):
+                raise OperationError('data doit être un objet JSON')
+
+            data = {champ: _resoudre(session, valeur, crees, index) for champ, valeur in data.items()}
+
+            if action == 'create':
+                objet = CREATIONS[ressource](session, data)
+                crees[index] = objet
+            else:
+                objet_id = _resoudre(session, operation.get('id'), crees, index)
+                if objet_id is None:
+                    raise OperationError('id est obligatoire pour une mise à jour ou une suppression')
+                objet = get_object(session, ressource, objet_id)
+                check_version(session, ressource, objet, data.get('version_id'))
+                if action == 'update':
+                    MISES_A_JOUR[ressource](session, objet, data)
+                else:
+                    delete_object(session, objet)
+
+            appliquees.append((index, action, ressource, objet))
+
+        except OperationError as e:
+            e.operation = index
+            raise
+
+    try:
+        session.flush()
+    except StaleDataError:
+        raise OperationError('Un objet du lot a été modifié entre-temps, relisez-le avant de réessayer', 409)
+
+    resultats = []
+    for index, action, ressource, objet in appliquees:
+        resultat = {'operation': index, 'action': action, 'ressource': ressource, 'id': objet.id}
+        if action != 'delete':
+            resultat['data'] = SERIALISATIONS[ressource](objet)
+        resultats.append(resultat)
+    return resultats
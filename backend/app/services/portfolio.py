@@ -0,0 +1,140 @@
+"""
+Indicateurs consolidés sur un ensemble de DUERP (tableau de bord de groupe)
+Tous les indicateurs sont calculés par des requêtes agrégées, sans charger
+l'arborescence des DUERP en mémoire.
+"""
+from datetime import date
+
+from sqlalchemy import case, func, select
+
+from ..models import DUERP, UniteTrail, Risque, MesurePrevention
+from .scoring import get_active_model
+
+
+def select_duerps(duerp_ids=None, statut=None):
+    """
+    Construit la sélection des DUERP du périmètre
+
+    Args:
+        duerp_ids: Liste d'identifiants de DUERP (None pour tous)
+        statut: Statut des DUERP à retenir (None pour tous)
+
+    Returns:
+        Select: Requête sur (id, entreprise_nom, version, statut, revision)
+    """
+    query = select(
+        DUERP.id, DUERP.entreprise_nom, DUERP.version, DUERP.statut, DUERP.revision
+    ).order_by(DUERP.id)
+    if duerp_ids:
+        query = query.where(DUERP.id.in_(duerp_ids))
+    if statut:
+        query = query.where(DUERP.statut == statut)
+    return query
+
+
+def compute_portfolio(session, duerps, aujourd_hui=None):
+    """
+    Calcule les indicateurs du tableau de bord pour les DUERP donnés
+
+    Args:
+        session: Session SQLAlchemy
+        duerps: Lignes retournées par select_duerps
+        aujourd_hui: Date de référence pour les mesures en retard
+
+    Returns:
+        dict: Indicateurs par DUERP et totaux du périmètre
+    """
+    aujourd_hui = aujourd_hui or date.today()
+    ids = [d.id for d in duerps]
+    # Niveaux du modèle de cotation actif ; les niveaux des risques cotés par
+    # un autre modèle s'y ajoutent
+    niveaux = get_active_model().niveaux
+
+    resultats = {
+        d.id: {
+            'duerp_id': d.id,
+            'entreprise_nom': d.entreprise_nom,
+            'version': d.version,
+            'statut': d.statut,
+            'revision': d.revision,
+            'nombre_risques_total': 0,
+            'nombre_risques_par_niveau': dict.fromkeys(niveaux, 0),
+            'nombre_mesures_prevention': 0,
+            'mesures_ouvertes': 0,
+            'mesures_en_retard': 0,
+            'unites': []
+        }
+        for d in duerps
+    }
+
+    if ids:
+        # Risques par niveau
+        for duerp_id, niveau, nombre in session.execute(
+            select(UniteTrail.duerp_id, Risque.niveau_risque, func.count(Risque.id))
+            .join(Risque, Risque.unite_travail_id == UniteTrail.id)
+            .where(UniteTrail.duerp_id.in_(ids))
+            .group_by(UniteTrail.duerp_id, Risque.niveau_risque)
+        ):
+            resultat = resultats[duerp_id]
+            resultat['nombre_risques_total'] += nombre
+            if niveau is not None:
+                par_niveau = resultat['nombre_risques_par_niveau']
+                par_niveau[niveau] = par_niveau.get(niveau, 0) + nombre
+
+        # Mesures ouvertes et en retard
+        ouverte = func.coalesce(MesurePrevention.statut, 'planifié') != 'réalisé'
+        for duerp_id, total, ouvertes, en_retard in session.execute(
+            select(
+                UniteTrail.duerp_id,
+                func.count(MesurePrevention.id),
+                func.sum(case((ouverte, 1), else_=0)),
+                func.sum(case((ouverte & (MesurePrevention.date_echeance < aujourd_hui), 1), else_=0))
+            )
+            .join(Risque, Risque.unite_travail_id == UniteTrail.id)
+            .join(MesurePrevention, MesurePrevention.risque_id == Risque.id)
+            .where(UniteTrail.duerp_id.in_(ids))
+            .group_by(UniteTrail.duerp_id)
+        ):
+            resultat = resultats[duerp_id]
+            resultat['nombre_mesures_prevention'] = total
+            resultat['mesures_ouvertes'] = ouvertes or 0
+            resultat['mesures_en_retard'] = en_retard or 0
+
+        # Criticité maximale par unité de travail
+        for duerp_id, unite_id, nom, criticite_max, nombre in session.execute(
+            select(
+                UniteTrail.duerp_id, UniteTrail.id, UniteTrail.nom,
+                func.max(Risque.criticite), func.count(Risque.id)
+            )
+            .outerjoin(Risque, Risque.unite_travail_id == UniteTrail.id)
+            .where(UniteTrail.duerp_id.in_(ids))
+            .group_by(UniteTrail.duerp_id, UniteTrail.id, UniteTrail.nom)
+            .order_by(UniteTrail.duerp_id, UniteTrail.id)
+        ):
+            resultats[duerp_id]['unites'].append({
+                'id': unite_id,
+                'nom': nom,
+                'nombre_risques': nombre,
+                'criticite_max': criticite_max
+            })
+
+    duerps_data = list(resultats.values())
+    totaux = {
+        'nombre_duerp': len(duerps_data),
+        'nombre_risques_total': sum(d['nombre_risques_total'] for d in duerps_data),
+        'nombre_risques_par_niveau': {
+            niveau: sum(d['nombre_risques_par_niveau'].get(niveau, 0) for d in duerps_data)
+            for niveau in niveaux + sorted({
+                n for d in duerps_data for n in d['nombre_risques_par_niveau'] if n not in niveaux
+            })
+        },
+        'nombre_mesures_prevention': sum(d['nombre_mesures_prevention'] for d in duerps_data),
+        'mesures_ouvertes': sum(d['mesures_ouvertes'] for d in duerps_data),
+        'mesures_en_retard': sum(d['mesures_en_retard'] for d in duerps_data)
+    }
+
+    return {
+        'date_reference': aujourd_hui.isoformat(),
+        'totaux': totaux,
+        'duerps': duerps_data
+    }
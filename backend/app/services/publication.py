@@ -0,0 +1,235 @@
+"""
+Publication des DUERP validés : artefacts figés, adressés par leur contenu
+
+À la validation, le DUERP est figé dans deux fichiers immuables : le JSON
+de son arborescence (même contenu que GET /api/duerp/{id}, accompagné d'une
+version gzip) et son document PDF. Chaque fichier est nommé par l'empreinte
+SHA-256 de son contenu (PUBLISHED_FOLDER/ab/abcd....pdf) : un contenu
+identique n'est écrit qu'une fois et un fichier publié n'est jamais modifié.
+
+Tant que la révision validée est la révision courante du DUERP, les lectures
+sont servies directement depuis ces fichiers (send_file : sendfile ou
+wsgi.file_wrapper selon le serveur), après une seule requête sur les
+colonnes, sans instancier d'objet ORM ni resérialiser l'arborescence. Les
+fichiers sont aussi servis sous leur adresse de contenu, avec une durée de
+cache longue (PUBLISHED_MAX_AGE) puisqu'ils ne changent jamais.
+"""
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+
+from flask import current_app, request, send_file
+from sqlalchemy import and_, select
+
+from .serialization import duerp_trees, serializer
+
+# Types de contenu des artefacts publiés
+TYPES_ARTEFACTS = {'json': 'application/json', 'pdf': 'application/pdf'}
+
+EMPREINTE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def artifact_path(empreinte, extension, dossier=None):
+    """Chemin du fichier publié d'empreinte et d'extension données"""
+    dossier = dossier or current_app.config['PUBLISHED_FOLDER']
+    return os.path.join(dossier, empreinte[:2], f'{empreinte}.{extension}')
+
+
+def _ecrire(chemin, contenu):
+    """Écrit un fichier publié de façon atomique, en lecture seule"""
+    os.makedirs(os.path.dirname(chemin), exist_ok=True)
+    descripteur, temporaire = tempfile.mkstemp(dir=os.path.dirname(chemin), suffix='.tmp')
+    try:
+        with os.fdopen(descripteur, 'wb') as f:
+            f.write(contenu)
+        os.chmod(temporaire, 0o444)
+        os.replace(temporaire, chemin)
+    except BaseException:
+        os.unlink(temporaire)
+        raise
+
+
+def store(contenu, extension, dossier=None):
+    """
+    Enregistre un artefact sous son empreinte (sans effet s'il existe déjà)
+
+    Un artefact JSON est accompagné de sa version gzip (extension .json.gz).
+
+    Returns:
+        str: Empreinte SHA-256 du contenu
+    """
+    empreinte = hashlib.sha256(contenu).hexdigest()
+    chemin = artifact_path(empreinte, extension, dossier)
+    if not os.path.exists(chemin):
+        if extension == 'json':
+            # mtime=0 : version compressée reproductible
+            _ecrire(chemin + '.gz', gzip.compress(contenu, compresslevel=9, mtime=0))
+        _ecrire(chemin, contenu)
+    return empreinte
+
+
+def render_publication_pdf(session, duerp_id, **modifications):
+    """
+    Rend le PDF de la révision à publier, avant la transaction de validation
+
+    Le rendu, long pour un DUERP volumineux, ne se fait pas dans la
+    transaction d'écriture : la base n'est que lue. Les champs que la
+    validation va modifier (statut, date de mise à jour) sont appliqués au
+    contenu lu, sans être enregistrés. Le mode flux est choisi comme pour la
+    génération à la demande (PDF_STREAMING_THRESHOLD).
+
+    La session est réinitialisée (rollback) après le rendu : la transaction
+    de lecture est terminée et les modifications appliquées sont abandonnées.
+
+    Args:
+        session: Session SQLAlchemy
+        duerp_id: Identifiant du DUERP
+        modifications: Champs du DUERP modifiés par la validation
+
+    Returns:
+        tuple: (contenu du PDF, révision du DUERP rendue)
+    """
+    from ..models import DUERP
+    from .document_generator import DUERPDocumentGenerator
+    from .read_model import load_duerp
+
+    generator = DUERPDocumentGenerator()
+    try:
+        duerp = session.get(DUERP, duerp_id)
+        revision = duerp.revision
+        if generator.count_risks(duerp) >= current_app.config['PDF_STREAMING_THRESHOLD']:
+            # Le rendu en flux lit les lignes au fil de la mise en page : les
+            # modifications ne sont portées que par l'instance, sans flush
+            with session.no_autoflush:
+                for champ, valeur in modifications.items():
+                    setattr(duerp, champ, valeur)
+                contenu = generator.render_pdf(duerp, streaming=True)
+        else:
+            contenu = generator.render_pdf(load_duerp(session, duerp_id)._replace(**modifications))
+    finally:
+        session.rollback()
+    return contenu, revision
+
+
+def publish(session, duerp_id, pdf, historique=None, dossier=None):
+    """
+    Fige la révision courante d'un DUERP (JSON et PDF) et enregistre sa publication
+
+    À appeler dans la transaction de validation, après les modifications :
+    la révision publiée est celle qui sera validée. Le PDF, rendu avant la
+    transaction (voir render_publication_pdf), est fourni ; seul le JSON, rapide à
+    produire, est construit ici. Les fichiers sont écrits avant la validation
+    de la transaction ; en cas d'échec, ils restent sur disque sans être
+    référencés.
+
+    Args:
+        session: Session SQLAlchemy
+        duerp_id: Identifiant du DUERP
+        pdf: Contenu du PDF de la révision publiée
+        historique: Entrée EvaluationHistorique de la validation
+        dossier: Dossier des artefacts (PUBLISHED_FOLDER par défaut)
+
+    Returns:
+        Publication: Publication ajoutée à la session
+    """
+    from ..models import DUERP, Publication
+
+    session.flush()
+    revision = session.execute(select(DUERP.revision).where(DUERP.id == duerp_id)).scalar_one()
+
+    arbre = duerp_trees(session, duerp_id)[0]
+    json_hash = store(serializer.dumps({'success': True, 'data': arbre}), 'json', dossier)
+    pdf_hash = store(pdf, 'pdf', dossier)
+
+    # Ajout direct (et non par DUERP.publications) : le DUERP n'est pas
+    # modifié et sa révision reste celle qui est publiée
+    publication = Publication(
+        duerp_id=duerp_id,
+        historique_id=historique.id if historique is not None else None,
+        revision=revision,
+        json_hash=json_hash,
+        pdf_hash=pdf_hash
+    )
+    session.add(publication)
+    return publication
+
+
+def published_state(session, duerp_id):
+    """
+    État d'un DUERP pour les lectures : révision et artefacts publiés
+
+    Une seule requête sur les colonnes. Les empreintes ne sont renseignées
+    que si le DUERP est validé et que sa révision courante est publiée.
+
+    Returns:
+        Row | None: (revision, version_id, entreprise_nom, version, json_hash,
+            pdf_hash), None si le DUERP n'existe pas
+    """
+    from ..models import DUERP, Publication
+
+    return session.execute(
+        select(
+            DUERP.revision, DUERP.version_id, DUERP.entreprise_nom, DUERP.version,
+            Publication.json_hash, Publication.pdf_hash
+        )
+        .outerjoin(Publication, and_(
+            Publication.duerp_id == DUERP.id,
+            Publication.revision == DUERP.revision,
+            DUERP.statut == 'validé'
+        ))
+        .where(DUERP.id == duerp_id)
+    ).first()
+
+
+def send_artifact(empreinte, extension, immutable=False, etag=None, **options):
+    """
+    Réponse servant un artefact publié depuis son fichier
+
+    Le JSON est servi compressé (gzip) si le client l'accepte ; l'ETag d'une
+    réponse compressée est faible, comme pour les réponses compressées à la
+    volée.
+
+    Args:
+        empreinte: Empreinte SHA-256 de l'artefact
+        extension: json ou pdf
+        immutable: Adresse de contenu (URL qui ne change jamais de contenu) :
+            cache long et immuable ; sinon le client revalide à chaque lecture
+        etag: ETag de la réponse (par défaut l'empreinte du contenu)
+        options: Options supplémentaires de send_file (as_attachment...)
+
+    Returns:
+        Response | None: None si le fichier n'existe pas
+    """
+    chemin = artifact_path(empreinte, extension)
+    etag = etag or empreinte
+    encodage = None
+    if (extension == 'json' and request.accept_encodings['gzip']
+            and current_app.config.get('COMPRESSION_ENABLED', True) and os.path.exists(chemin + '.gz')):
+        chemin, encodage = chemin + '.gz', 'gzip'
+    if not os.path.exists(chemin):
+        return None
+
+    reponse = send_file(
+        chemin,
+        mimetype=TYPES_ARTEFACTS[extension],
+        etag=etag,
+        conditional=True,
+        max_age=current_app.config['PUBLISHED_MAX_AGE'] if immutable else 0,
+        **options
+    )
+    if encodage is not None:
+        reponse.headers['Content-Encoding'] = encodage
+        reponse.set_etag(etag, weak=True)
+    if extension == 'json':
+        reponse.vary.add('Accept-Encoding')
+    # Contenu figé : pas de recompression ni de transformation en aval
+    reponse.cache_control.no_transform = True
+    if immutable:
+        reponse.cache_control.public = True
+        reponse.cache_control.immutable = True
+    else:
+        reponse.cache_control.no_cache = True
+        reponse.headers['Content-Location'] = f'/api/duerp/publications/{empreinte}.{extension}'
+    return reponse
@@ -0,0 +1,120 @@
+"""
+Modèle de lecture détaché des DUERP (rendu de documents, statistiques)
+
+Un DUERP et son arborescence (unités, risques, mesures) sont chargés par une
+seule requête en enregistrements immuables (namedtuple, sans __dict__), qui
+portent les mêmes noms d'attributs que les modèles : le générateur de
+documents et les statistiques les parcourent comme les instances ORM, mais
+sans session ouverte ni instrumentation des attributs. Les enregistrements
+peuvent être transmis à un autre processus (pickle).
+"""
+from collections import namedtuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import object_session
+
+CHAMPS_DUERP = [
+    'id', 'entreprise_nom', 'entreprise_siret', 'entreprise_adresse', 'entreprise_activite',
+    'effectif', 'version', 'date_creation', 'date_derniere_maj', 'date_prochaine_evaluation',
+    'responsable_evaluation', 'responsable_validation', 'statut', 'revision'
+]
+CHAMPS_UNITE = ['id', 'nom', 'description', 'localisation', 'nombre_employes']
+CHAMPS_RISQUE = [
+    'id', 'categorie', 'sous_categorie', 'description', 'situation_danger', 'gravite',
+    'probabilite', 'frequence_exposition', 'criticite', 'niveau_risque', 'version_cotation',
+    'personnes_exposees', 'personnes_concernees'
+]
+CHAMPS_MESURE = [
+    'id', 'type_mesure', 'niveau_hierarchie', 'description', 'statut', 'date_mise_en_oeuvre',
+    'date_echeance', 'responsable', 'cout_estime', 'efficacite'
+]
+
+MesureRecord = namedtuple('MesureRecord', CHAMPS_MESURE)
+RisqueRecord = namedtuple('RisqueRecord', CHAMPS_RISQUE + ['mesures_prevention'])
+UniteRecord = namedtuple('UniteRecord', CHAMPS_UNITE + ['risques'])
+DUERPRecord = namedtuple('DUERPRecord', CHAMPS_DUERP + ['unites_travail'])
+
+
+def load_duerp(session, duerp_id):
+    """
+    Charge un DUERP et son arborescence en une seule requête
+
+    Unités, risques et mesures sont ordonnés par identifiant.
+
+    Args:
+        session: Session SQLAlchemy
+        duerp_id: Identifiant du DUERP
+
+    Returns:
+        DUERPRecord: Enregistrement du DUERP, ou None s'il n'existe pas
+    """
+    from ..models import DUERP, UniteTrail, Risque, MesurePrevention
+
+    requete = (
+        select(
+            *[getattr(DUERP, c) for c in CHAMPS_DUERP],
+            *[getattr(UniteTrail, c) for c in CHAMPS_UNITE],
+            *[getattr(Risque, c) for c in CHAMPS_RISQUE],
+            *[getattr(MesurePrevention, c) for c in CHAMPS_MESURE]
+        )
+        .select_from(DUERP)
+        .outerjoin(UniteTrail, UniteTrail.duerp_id == DUERP.id)
+        .outerjoin(Risque, Risque.unite_travail_id == UniteTrail.id)
+        .outerjoin(MesurePrevention, MesurePrevention.risque_id == Risque.id)
+        .where(DUERP.id == duerp_id)
+        .order_by(UniteTrail.id, Risque.id, MesurePrevention.id)
+    )
+
+    # Position des colonnes de chaque table dans les lignes
+    fin_duerp = len(CHAMPS_DUERP)
+    fin_unite = fin_duerp + len(CHAMPS_UNITE)
+    fin_risque = fin_unite + len(CHAMPS_RISQUE)
+
+    duerp = None
+    unites = {}   # id -> (valeurs, identifiants des risques)
+    risques = {}  # id -> (valeurs, mesures)
+    for ligne in session.execute(requete).tuples():
+        if duerp is None:
+            duerp = ligne[:fin_duerp]
+
+        unite_id = ligne[fin_duerp]
+        if unite_id is None:
+            continue
+        if unite_id not in unites:
+            unites[unite_id] = (ligne[fin_duerp:fin_unite], [])
+
+        risque_id = ligne[fin_unite]
+        if risque_id is None:
+            continue
+        if risque_id not in risques:
+            risques[risque_id] = (ligne[fin_unite:fin_risque], [])
+            unites[unite_id][1].append(risque_id)
+
+        if ligne[fin_risque] is not None:
+            risques[risque_id][1].append(MesureRecord._make(ligne[fin_risque:]))
+
+    if duerp is None:
+        return None
+
+    return DUERPRecord(*duerp, tuple(
+        UniteRecord(*valeurs, tuple(
+            RisqueRecord(*risques[risque_id][0], tuple(risques[risque_id][1]))
+            for risque_id in risque_ids
+        ))
+        for valeurs, risque_ids in unites.values()
+    ))
+
+
+def as_record(duerp):
+    """
+    Enregistrement détaché d'un DUERP
+
+    Args:
+        duerp: Instance du modèle DUERP (attachée à une session) ou DUERPRecord
+
+    Returns:
+        DUERPRecord
+    """
+    if isinstance(duerp, DUERPRecord):
+        return duerp
+    return load_duerp(object_session(duerp), duerp.id)
@@ -0,0 +1,220 @@
+"""
+Service de recherche plein texte sur les risques et les mesures de prévention
+Repose sur SQLite FTS5 (index à contenu externe tenus à jour par triggers)
+"""
+import re
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+# Tokenizer unicode61 avec suppression des diacritiques : "échafaudage" et
+# "echafaudage" produisent le même terme, l'apostrophe sépare "l'échelle"
+TOKENIZER = "unicode61 remove_diacritics 2"
+
+FTS_DDL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS risque_fts USING fts5(
+        description, situation_danger, personnes_concernees,
+        content='risque', content_rowid='id',
+        tokenize='{TOKENIZER}', prefix='3'
+    )
+    """,
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS mesure_fts USING fts5(
+        description,
+        content='mesure_prevention', content_rowid='id',
+        tokenize='{TOKENIZER}', prefix='3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS risque_fts_ai AFTER INSERT ON risque BEGIN
+        INSERT INTO risque_fts(rowid, description, situation_danger, personnes_concernees)
+        VALUES (new.id, new.description, new.situation_danger, new.personnes_concernees);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS risque_fts_ad AFTER DELETE ON risque BEGIN
+        INSERT INTO risque_fts(risque_fts, rowid, description, situation_danger, personnes_concernees)
+        VALUES ('delete', old.id, old.description, old.situation_danger, old.personnes_concernees);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS risque_fts_au
+    AFTER UPDATE OF description, situation_danger, personnes_concernees ON risque BEGIN
+        INSERT INTO risque_fts(risque_fts, rowid, description, situation_danger, personnes_concernees)
+        VALUES ('delete', old.id, old.description, old.situation_danger, old.personnes_concernees);
+        INSERT INTO risque_fts(rowid, description, situation_danger, personnes_concernees)
+        VALUES (new.id, new.description, new.situation_danger, new.personnes_concernees);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS mesure_fts_ai AFTER INSERT ON mesure_prevention BEGIN
+        INSERT INTO mesure_fts(rowid, description) VALUES (new.id, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS mesure_fts_ad AFTER DELETE ON mesure_prevention BEGIN
+        INSERT INTO mesure_fts(mesure_fts, rowid, description) VALUES ('delete', old.id, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS mesure_fts_au AFTER UPDATE OF description ON mesure_prevention BEGIN
+        INSERT INTO mesure_fts(mesure_fts, rowid, description) VALUES ('delete', old.id, old.description);
+        INSERT INTO mesure_fts(rowid, description) VALUES (new.id, new.description);
+    END
+    """,
+]
+
+# Mots vides français ignorés dans les requêtes
+MOTS_VIDES = {
+    'a', 'au', 'aux', 'avec', 'ce', 'ces', 'd', 'dans', 'de', 'des', 'du', 'en',
+    'et', 'l', 'la', 'le', 'les', 'leur', 'leurs', 'ou', 'par', 'pour', 'qu',
+    'que', 'qui', 's', 'sa', 'se', 'ses', 'sur', 'un', 'une'
+}
+
+SOUS_REQUETES = {
+    'risque': """
+        SELECT 'risque' AS type, r.id AS id, r.id AS risque_id, u.duerp_id AS duerp_id,
+               bm25(risque_fts, 1.0, 0.75, 0.5) AS score,
+               snippet(risque_fts, -1, '<b>', '</b>', '…', 12) AS extrait
+        FROM risque_fts
+        JOIN risque r ON r.id = risque_fts.rowid
+        JOIN unite_travail u ON u.id = r.unite_travail_id
+        WHERE risque_fts MATCH :requete {filtre_duerp}
+    """,
+    'mesure': """
+        SELECT 'mesure' AS type, m.id AS id, m.risque_id AS risque_id, u.duerp_id AS duerp_id,
+               bm25(mesure_fts) AS score,
+               snippet(mesure_fts, 0, '<b>', '</b>', '…', 12) AS extrait
+        FROM mesure_fts
+        JOIN mesure_prevention m ON m.id = mesure_fts.rowid
+        JOIN risque r ON r.id = m.risque_id
+        JOIN unite_travail u ON u.id = r.unite_travail_id
+        WHERE mesure_fts MATCH :requete {filtre_duerp}
+    """
+}
+
+
+def init_recherche(engine):
+    """
+    Crée les index plein texte et leurs triggers de synchronisation
+
+    Les index nouvellement créés sont reconstruits à partir des tables
+    existantes. Sans effet pour un moteur autre que SQLite.
+
+    Args:
+        engine: Moteur SQLAlchemy de l'application
+
+    Returns:
+        bool: True si la recherche plein texte est disponible
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+
+    try:
+        with engine.begin() as conn:
+            existants = {
+                row[0] for row in conn.execute(text(
+                    "SELECT name FROM sqlite_master WHERE name IN ('risque_fts', 'mesure_fts')"
+                ))
+            }
+            for ddl in FTS_DDL:
+                conn.execute(text(ddl))
+            if 'risque_fts' not in existants:
+                conn.execute(text("INSERT INTO risque_fts(risque_fts) VALUES ('rebuild')"))
+            if 'mesure_fts' not in existants:
+                conn.execute(text("INSERT INTO mesure_fts(mesure_fts) VALUES ('rebuild')"))
+    except OperationalError:
+        # SQLite compilé sans FTS5
+        return False
+
+    return True
+
+
+def construire_requete(texte):
+    """
+    Traduit une saisie libre en expression FTS5
+
+    Chaque mot significatif est ramené à une racine simple (marques du pluriel
+    retirées) puis recherché comme préfixe : "solvants" trouve "solvant" et
+    inversement. Les termes sont combinés par un ET implicite.
+
+    Args:
+        texte: Texte saisi par l'utilisateur
+
+    Returns:
+        str: Expression MATCH, vide si aucun terme exploitable
+    """
+    termes = [
+        _racine(mot) for mot in re.findall(r'\w+', texte.lower())
+        if mot not in MOTS_VIDES
+    ]
+    return ' '.join(f'"{terme}"*' for terme in termes)
+
+
+def _racine(mot):
+    """Retire les marques du pluriel d'un mot (racinisation légère du français)"""
+    if len(mot) > 4 and mot.endswith(('s', 'x')):
+        return mot[:-1]
+    return mot
+
+
+def rechercher(session, texte, type_objet=None, duerp_id=None, limite=50, apres=None):
+    """
+    Recherche classée par pertinence (BM25) dans les risques et les mesures
+
+    La pagination se fait par clé (score, type, id) et non par décalage :
+    une page ne relit pas les résultats des pages précédentes et reste
+    cohérente si des risques ou des mesures sont ajoutés entre deux pages.
+
+    Args:
+        session: Session SQLAlchemy
+        texte: Texte recherché
+        type_objet: 'risque', 'mesure' ou None pour les deux
+        duerp_id: Restreint la recherche à un DUERP
+        limite: Nombre de résultats par page
+        apres: Clé (score, type, id) du dernier résultat de la page précédente
+
+    Returns:
+        tuple: (résultats triés par pertinence décroissante, clé du dernier
+            résultat de la page ou None s'il n'y a pas de page suivante)
+    """
+    requete = construire_requete(texte)
+    if not requete:
+        return [], None
+
+    filtre_duerp = 'AND u.duerp_id = :duerp_id' if duerp_id is not None else ''
+    types = [type_objet] if type_objet else ['risque', 'mesure']
+    union = ' UNION ALL '.join(
+        SOUS_REQUETES[t].format(filtre_duerp=filtre_duerp) for t in types
+    )
+    filtre_cle = 'WHERE (score, type, id) > (:score, :type, :id)' if apres is not None else ''
+    sql = text(
+        f"SELECT * FROM ({union}) {filtre_cle} ORDER BY score, type, id LIMIT :limite"
+    )
+
+    score, type_cle, id_cle = apres if apres is not None else (None, None, None)
+    lignes = session.execute(sql, {
+        'requete': requete,
+        'duerp_id': duerp_id,
+        'limite': limite + 1,
+        'score': score,
+        'type': type_cle,
+        'id': id_cle
+    }).mappings().all()
+
+    suivante = len(lignes) > limite
+    lignes = lignes[:limite]
+    resultats = [
+        {
+            'type': ligne['type'],
+            'id': ligne['id'],
+            'risque_id': ligne['risque_id'],
+            'duerp_id': ligne['duerp_id'],
+            'score': round(-ligne['score'], 6),
+            'extrait': ligne['extrait']
+        }
+        for ligne in lignes
+    ]
+    derniere_cle = (lignes[-1]['score'], lignes[-1]['type'], lignes[-1]['id']) if suivante else None
+    return resultats, derniere_cle
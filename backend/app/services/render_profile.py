@@ -0,0 +1,238 @@
+"""
+Profil de génération des documents
+
+Chaque rendu (PDF ou DOCX) produit un RenderProfile : durée de chaque
+section (page de garde, informations, synthèse, risques détaillés, mise en
+page), nombre de flowables et de tableaux, nombre de pages, taille du
+document, volume du DUERP (unités, risques, mesures, maximum de mesures
+d'une unité) et, si demandé, pic mémoire mesuré par tracemalloc.
+
+Le profil est renvoyé dans les en-têtes de la réponse (Server-Timing,
+X-Document-*), inscrit au manifeste de la génération par lot et agrégé dans
+les métriques : il sert à dimensionner les workers et à repérer les DUERP
+pathologiques (unités à plusieurs milliers de mesures) avant qu'ils
+n'atteignent le délai maximal d'une requête.
+"""
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from .metrics import metrics
+from .tracing import span
+
+metrics.describe('document_rendu_secondes', 'Durée de rendu des documents, par format')
+metrics.describe('document_section_secondes', 'Durée de rendu des sections des documents, par format et section')
+metrics.describe('document_pages', 'Nombre de pages des documents générés, par format')
+metrics.describe('document_taille_octets', 'Taille des documents générés, par format')
+metrics.describe('document_memoire_max_octets', 'Pic mémoire pendant le rendu des documents, par format')
+metrics.describe('document_mesures_max_unite', 'Nombre maximal de mesures d\'une unité de travail des documents générés')
+
+BORNES_PAGES = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BORNES_TAILLE = (10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000, 10_000_000, 50_000_000, 100_000_000)
+BORNES_MEMOIRE = (1 << 20, 5 << 20, 10 << 20, 50 << 20, 100 << 20, 250 << 20, 500 << 20, 1 << 30)
+BORNES_MESURES = (10, 50, 100, 500, 1000, 5000, 10000)
+
+
+class _SuiviMemoire:
+    """
+    Démarrage et arrêt de tracemalloc autour des rendus
+
+    tracemalloc est global au processus : il est démarré au premier rendu
+    mesuré et arrêté quand plus aucun n'est en cours (sauf s'il était déjà
+    actif). Lors de rendus simultanés, le pic mesuré est celui du processus
+    pendant le rendu et inclut donc les allocations des autres rendus.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._en_cours = 0
+        self._demarre = False
+
+    def start(self):
+        """Commence une mesure ; retourne la mémoire allouée au départ"""
+        with self._lock:
+            if self._en_cours == 0:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._demarre = True
+                tracemalloc.reset_peak()
+            self._en_cours += 1
+            return tracemalloc.get_traced_memory()[0]
+
+    def stop(self, initial):
+        """Termine une mesure ; retourne le pic (octets) au-delà de la mémoire initiale"""
+        with self._lock:
+            pic = tracemalloc.get_traced_memory()[1] - initial
+            self._en_cours -= 1
+            if self._en_cours == 0 and self._demarre:
+                tracemalloc.stop()
+                self._demarre = False
+            return max(pic, 0)
+
+
+_suivi_memoire = _SuiviMemoire()
+
+
+class RenderProfile:
+    """Mesures d'un rendu de document"""
+
+    def __init__(self, format_type, streaming=False, memoire=False):
+        """
+        Args:
+            format_type: pdf ou docx
+            streaming: Rendu en mode flux
+            memoire: Mesure du pic mémoire par tracemalloc (ralentit le rendu)
+        """
+        self.format = format_type
+        self.streaming = streaming
+        self.sections = {}
+        self.duree = None
+        self.flowables = 0
+        self.tableaux = 0
+        self.pages = None
+        self.taille = None
+        self.memoire_max = None
+        self.unites = None
+        self.risques = None
+        self.mesures = None
+        self.mesures_max_unite = None
+        self._memoire = memoire
+        self._debut = None
+        self._etape = None
+        self._memoire_initiale = None
+
+    def start(self):
+        self._debut = self._etape = time.perf_counter()
+        if self._memoire:
+            self._memoire_initiale = _suivi_memoire.start()
+
+    def stop(self, taille=None):
+        """Termine le profil ; taille est celle du document produit (octets)"""
+        if self._debut is None or self.duree is not None:
+            # Profil non démarré ou déjà terminé
+            return
+        self.duree = time.perf_counter() - self._debut
+        if self._memoire:
+            self.memoire_max = _suivi_memoire.stop(self._memoire_initiale)
+        self.taille = taille
+
+    @contextmanager
+    def section(self, nom):
+        """Chronomètre une section du rendu (et l'inscrit comme span de la trace courante)"""
+        debut = time.perf_counter()
+        with span(f'{self.format}.{nom}') as courant:
+            try:
+                yield courant
+            finally:
+                self.sections[nom] = self.sections.get(nom, 0.0) + time.perf_counter() - debut
+
+    def lap(self, nom):
+        """Attribue à la section nom le temps écoulé depuis la section précédente (ou le début)"""
+        maintenant = time.perf_counter()
+        self.sections[nom] = self.sections.get(nom, 0.0) + maintenant - self._etape
+        self._etape = maintenant
+
+    def timed(self, nom, produire):
+        """
+        Chronomètre une section produite au fil du rendu (mode flux)
+
+        Args:
+            nom: Nom de la section
+            produire: Fonction sans argument retournant les flowables de la
+                section (liste ou itérable)
+
+        Seul le temps passé à produire les flowables est attribué à la
+        section, et non celui de la mise en page qui les consomme.
+        """
+        debut = time.perf_counter()
+        try:
+            iterateur = iter(produire())
+        finally:
+            self.sections[nom] = self.sections.get(nom, 0.0) + time.perf_counter() - debut
+        while True:
+            debut = time.perf_counter()
+            try:
+                flowable = next(iterateur)
+            except StopIteration:
+                return
+            finally:
+                self.sections[nom] = self.sections.get(nom, 0.0) + time.perf_counter() - debut
+            yield flowable
+
+    def count(self, flowables):
+        """Compte les flowables et les tableaux d'une story (liste ou itérable consommé au fil du rendu)"""
+        from reportlab.platypus import Table
+
+        for flowable in flowables:
+            self.flowables += 1
+            if isinstance(flowable, Table):
+                self.tableaux += 1
+            yield flowable
+
+    def start_tree(self):
+        """Remet à zéro le volume du DUERP, compté au fil du rendu (mode flux)"""
+        self.unites = self.risques = self.mesures = self.mesures_max_unite = 0
+
+    def measure_tree(self, duerp):
+        """Volume d'un DUERP chargé (DUERPRecord) : unités, risques, mesures"""
+        self.unites = len(duerp.unites_travail)
+        self.risques = 0
+        self.mesures = 0
+        self.mesures_max_unite = 0
+        for unite in duerp.unites_travail:
+            mesures = sum(len(risque.mesures_prevention) for risque in unite.risques)
+            self.risques += len(unite.risques)
+            self.mesures += mesures
+            self.mesures_max_unite = max(self.mesures_max_unite, mesures)
+
+    def to_dict(self):
+        """Profil sérialisable (durées en secondes, tailles en octets)"""
+        return {
+            'format': self.format,
+            'streaming': self.streaming,
+            'duree': round(self.duree, 4) if self.duree is not None else None,
+            'sections': {nom: round(duree, 4) for nom, duree in self.sections.items()},
+            'flowables': self.flowables,
+            'tableaux': self.tableaux,
+            'pages': self.pages,
+            'taille': self.taille,
+            'memoire_max': self.memoire_max,
+            'unites': self.unites,
+            'risques': self.risques,
+            'mesures': self.mesures,
+            'mesures_max_unite': self.mesures_max_unite
+        }
+
+    def headers(self):
+        """En-têtes HTTP décrivant le rendu (Server-Timing en millisecondes)"""
+        durees = [(nom, duree) for nom, duree in self.sections.items()]
+        if self.duree is not None:
+            durees.append(('rendu', self.duree))
+        entetes = {'Server-Timing': ', '.join(f'{nom};dur={duree * 1000:.1f}' for nom, duree in durees)}
+        valeurs = {
+            'X-Document-Pages': self.pages,
+            'X-Document-Size': self.taille,
+            'X-Document-Flowables': self.flowables if self.format == 'pdf' else None,
+            'X-Document-Tables': self.tableaux,
+            'X-Document-Peak-Memory': self.memoire_max,
+            'X-Document-Max-Unit-Measures': self.mesures_max_unite
+        }
+        entetes.update({nom: str(valeur) for nom, valeur in valeurs.items() if valeur is not None})
+        return entetes
+
+
+def record_render(profil):
+    """Agrège le profil d'un rendu dans les métriques du processus"""
+    if profil.duree is not None:
+        metrics.observe('document_rendu_secondes', profil.duree, format=profil.format)
+    for nom, duree in profil.sections.items():
+        metrics.observe('document_section_secondes', duree, format=profil.format, section=nom)
+    if profil.pages is not None:
+        metrics.observe('document_pages', profil.pages, BORNES_PAGES, format=profil.format)
+    if profil.taille is not None:
+        metrics.observe('document_taille_octets', profil.taille, BORNES_TAILLE, format=profil.format)
+    if profil.memoire_max is not None:
+        metrics.observe('document_memoire_max_octets', profil.memoire_max, BORNES_MEMOIRE, format=profil.format)
+    if profil.mesures_max_unite is not None:
+        metrics.observe('document_mesures_max_unite', profil.mesures_max_unite, BORNES_MESURES)
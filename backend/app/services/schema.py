@@ -0,0 +1,140 @@
+"""
+Initialisation et migration du schéma de la base de données au démarrage
+
+La version du schéma enregistrée dans la base (PRAGMA user_version pour
+SQLite) est comparée à SCHEMA_VERSION : si la base est à jour, le démarrage
+ne fait qu'une lecture de cette version, sans create_all ni création des
+index plein texte.
+
+Sinon, les migrations des versions manquantes sont appliquées dans l'ordre
+(ajout des colonnes aux tables existantes et remplissage des lignes
+existantes), puis les tables et index manquants sont créés et la version est
+enregistrée, le tout dans une seule transaction : en cas d'échec, la base
+reste à sa version d'origine. Une version sans migration déclarée dans
+MIGRATIONS empêche le démarrage.
+
+SCHEMA_VERSION doit être incrémentée à chaque modification du schéma, avec
+la migration correspondante.
+"""
+from sqlalchemy import text
+
+from ..models import db
+from .recherche import init_recherche
+from .scoring import VERSION_PAR_DEFAUT
+
+SCHEMA_VERSION = 3
+
+
+class SchemaError(RuntimeError):
+    """Base de données qui ne peut pas être migrée vers SCHEMA_VERSION"""
+
+
+def _tables(conn):
+    return {ligne[0] for ligne in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+
+
+def _ajouter_colonne(conn, table, colonne, definition, remplissage=None):
+    """
+    Ajoute une colonne à une table existante, puis remplit les lignes existantes
+
+    Sans effet si la table n'existe pas (elle sera créée complète par
+    create_all) ou si la colonne existe déjà (base créée par create_all avant
+    l'enregistrement de la version du schéma).
+    """
+    if table not in _tables(conn):
+        return
+    colonnes = {ligne[1] for ligne in conn.execute(text(f'PRAGMA table_info("{table}")'))}
+    if colonne in colonnes:
+        return
+    conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {colonne} {definition}'))
+    if remplissage:
+        conn.execute(text(remplissage))
+
+
+def _migration_1(conn):
+    """
+    Colonnes ajoutées depuis le schéma initial
+
+    - revision (DUERP) et version_id (contrôle de version optimiste) : 1
+    - origine_id (copie d'un DUERP) : vide, l'objet est sa propre origine
+    - version_cotation : modèle intégré, qui a coté les risques existants
+    - instantané des entrées d'historique : vide (pas de comparaison possible)
+
+    Les tables snapshot_bloc et cle_idempotence, les index de recherche et
+    les index plein texte sont créés ensuite.
+    """
+    _ajouter_colonne(conn, 'duerp', 'revision', 'INTEGER NOT NULL DEFAULT 1')
+    for table in ('duerp', 'unite_travail', 'risque', 'mesure_prevention'):
+        _ajouter_colonne(conn, table, 'origine_id', 'INTEGER')
+        _ajouter_colonne(conn, table, 'version_id', 'INTEGER NOT NULL DEFAULT 1')
+    _ajouter_colonne(
+        conn, 'risque', 'version_cotation', 'VARCHAR(20)',
+        f"UPDATE risque SET version_cotation = '{VERSION_PAR_DEFAUT}' WHERE criticite IS NOT NULL"
+    )
+    _ajouter_colonne(conn, 'evaluation_historique', 'snapshot', 'BLOB')
+    _ajouter_colonne(conn, 'evaluation_historique', 'snapshot_hash', 'VARCHAR(64)')
+
+
+def _migration_2(conn):
+    """Table publication (artefacts figés des DUERP validés), créée ensuite"""
+
+
+def _migration_3(conn):
+    """Index du plan d'action : (date_echeance, statut) remplace (statut, date_echeance)"""
+    conn.execute(text('DROP INDEX IF EXISTS ix_mesure_statut_echeance'))
+
+
+# Migration vers chaque version du schéma
+MIGRATIONS = {
+    1: _migration_1,
+    2: _migration_2,
+    3: _migration_3
+}
+
+
+def init_schema(app):
+    """
+    Vérifie la version du schéma et migre la base si besoin
+
+    Returns:
+        bool: True si la recherche plein texte est disponible
+
+    Raises:
+        SchemaError: Si une version intermédiaire n'a pas de migration
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        db.create_all()
+        return init_recherche(engine)
+
+    with engine.connect() as conn:
+        version = conn.execute(text('PRAGMA user_version')).scalar()
+        if version >= SCHEMA_VERSION:
+            return conn.execute(text(
+                "SELECT count(*) FROM sqlite_master WHERE name IN ('risque_fts', 'mesure_fts')"
+            )).scalar() == 2
+
+    manquantes = [v for v in range(version + 1, SCHEMA_VERSION + 1) if v not in MIGRATIONS]
+    if manquantes:
+        raise SchemaError(
+            f'Migration du schéma manquante pour la version {manquantes[0]} '
+            f'(base en version {version}, application en version {SCHEMA_VERSION})'
+        )
+
+    app.logger.info('Migration du schéma de la base (version %s -> %s)', version, SCHEMA_VERSION)
+    with engine.begin() as conn:
+        # pysqlite n'ouvre une transaction qu'avant une instruction de
+        # modification des données : sans BEGIN explicite, chaque ALTER ou
+        # CREATE serait validé immédiatement
+        conn.exec_driver_sql('BEGIN')
+        for cible in range(version + 1, SCHEMA_VERSION + 1):
+            MIGRATIONS[cible](conn)
+        # Tables manquantes, puis index manquants des tables existantes
+        # (create_all ne crée les index qu'avec leur table)
+        db.metadata.create_all(conn)
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        conn.execute(text(f'PRAGMA user_version = {SCHEMA_VERSION}'))
+
+    return init_recherche(engine)
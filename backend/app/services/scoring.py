@@ -0,0 +1,238 @@
+"""
+Modèles de cotation des risques
+La criticité et le niveau de risque sont calculés par un modèle versionné et
+configurable. Le même modèle produit le calcul Python (création et mise à jour
+d'un risque) et les expressions SQL équivalentes (recotation en masse).
+"""
+import json
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import Integer, and_, case, cast, func, or_, select, update
+
+VERSION_PAR_DEFAUT = '1.0'
+
+
+class ScoringModel:
+    """
+    Modèle de cotation : criticité = G × P × facteur de fréquence, arrondie,
+    puis niveau de risque déterminé par des seuils croissants
+    """
+
+    def __init__(self, version, seuils, niveau_superieur, facteurs_frequence=None, description=''):
+        """
+        Args:
+            version: Identifiant de version du modèle
+            seuils: Liste de couples (criticité maximale, niveau), croissante
+            niveau_superieur: Niveau attribué au-delà du dernier seuil
+            facteurs_frequence: Coefficients par fréquence d'exposition (1 par défaut)
+            description: Description de la méthode
+        """
+        self.version = str(version)
+        self.seuils = [(int(maximum), niveau) for maximum, niveau in seuils]
+        self.niveau_superieur = niveau_superieur
+        self.facteurs_frequence = dict(facteurs_frequence or {})
+        self.description = description
+
+        if [s[0] for s in self.seuils] != sorted(s[0] for s in self.seuils):
+            raise ValueError('Les seuils du modèle de cotation doivent être croissants')
+
+    @classmethod
+    def from_dict(cls, data):
+        """Construit un modèle à partir de sa définition JSON"""
+        try:
+            return cls(
+                version=data['version'],
+                seuils=data['seuils'],
+                niveau_superieur=data['niveau_superieur'],
+                facteurs_frequence=data.get('facteurs_frequence'),
+                description=data.get('description', '')
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError(f'Définition de modèle de cotation invalide: {e}')
+
+    def to_dict(self):
+        """Convertit le modèle en dictionnaire"""
+        return {
+            'version': self.version,
+            'description': self.description,
+            'seuils': [list(seuil) for seuil in self.seuils],
+            'niveau_superieur': self.niveau_superieur,
+            'facteurs_frequence': self.facteurs_frequence
+        }
+
+    @property
+    def niveaux(self):
+        """Niveaux de risque du modèle, du plus faible au plus élevé"""
+        return [niveau for _, niveau in self.seuils] + [self.niveau_superieur]
+
+    @property
+    def niveaux_prioritaires(self):
+        """Les deux niveaux les plus élevés (actions de prévention prioritaires)"""
+        return self.niveaux[-2:]
+
+    def criticite(self, gravite, probabilite, frequence_exposition=None):
+        """Calcule la criticité d'un risque"""
+        if not self.facteurs_frequence:
+            return gravite * probabilite
+        facteur = self.facteurs_frequence.get(frequence_exposition, 1)
+        # Arrondi au plus proche, identique au CAST(x + 0.5 AS INTEGER) SQL
+        return int(gravite * probabilite * facteur + 0.5)
+
+    def niveau(self, criticite):
+        """Détermine le niveau de risque correspondant à une criticité"""
+        for maximum, niveau in self.seuils:
+            if criticite <= maximum:
+                return niveau
+        return self.niveau_superieur
+
+    def criticite_sql(self, table):
+        """Expression SQL de la criticité pour une table de risques"""
+        base = table.c.gravite * table.c.probabilite
+        if not self.facteurs_frequence:
+            return base
+        facteur = case(self.facteurs_frequence, value=table.c.frequence_exposition, else_=1)
+        return cast(base * facteur + 0.5, Integer)
+
+    def niveau_sql(self, criticite):
+        """Expression SQL (CASE) du niveau de risque pour une criticité"""
+        return case(
+            *[(criticite <= maximum, niveau) for maximum, niveau in self.seuils],
+            else_=self.niveau_superieur
+        )
+
+
+MODELES_INTEGRES = {
+    VERSION_PAR_DEFAUT: ScoringModel(
+        version=VERSION_PAR_DEFAUT,
+        seuils=[(2, 'Acceptable'), (6, 'Modéré'), (12, 'Important')],
+        niveau_superieur='Critique',
+        description='Criticité = Gravité × Probabilité'
+    )
+}
+
+
+def load_models(app):
+    """
+    Charge les modèles de cotation disponibles pour l'application
+
+    Les modèles intégrés sont complétés par ceux du fichier JSON désigné par
+    SCORING_MODELS_FILE (liste de définitions). SCORING_MODEL désigne le
+    modèle actif.
+    """
+    modeles = dict(MODELES_INTEGRES)
+
+    fichier = app.config.get('SCORING_MODELS_FILE')
+    if fichier:
+        with open(fichier, encoding='utf-8') as f:
+            for definition in json.load(f):
+                modele = ScoringModel.from_dict(definition)
+                modeles[modele.version] = modele
+
+    actif = app.config.get('SCORING_MODEL', VERSION_PAR_DEFAUT)
+    if actif not in modeles:
+        raise ValueError(f'Modèle de cotation inconnu: {actif}')
+
+    app.extensions['scoring_models'] = modeles
+    app.extensions['scoring_model'] = modeles[actif]
+
+
+def get_models():
+    """Retourne les modèles de cotation disponibles, par version"""
+    if has_app_context() and 'scoring_models' in current_app.extensions:
+        return current_app.extensions['scoring_models']
+    return MODELES_INTEGRES
+
+
+def get_active_model():
+    """Retourne le modèle de cotation actif"""
+    if has_app_context() and 'scoring_model' in current_app.extensions:
+        return current_app.extensions['scoring_model']
+    return MODELES_INTEGRES[VERSION_PAR_DEFAUT]
+
+
+def rescore(session, risque_table, duerp_table, unite_table, modele, dry_run=True, taille_lot=5000):
+    """
+    Recote l'ensemble des risques avec un modèle de cotation
+
+    Le calcul est ensembliste : un UPDATE ... CASE par lot de taille_lot
+    identifiants, chaque lot étant validé dans sa propre transaction. Seules
+    les lignes dont la cotation change sont réécrites (avec incrémentation de
+    leur version de ligne), et la révision des DUERP concernés est incrémentée.
+
+    Args:
+        session: Session SQLAlchemy
+        risque_table, duerp_table, unite_table: Tables SQLAlchemy concernées
+        modele: Modèle de cotation à appliquer
+        dry_run: Si True, calcule seulement l'impact de la recotation
+        taille_lot: Nombre d'identifiants de risques traités par lot
+
+    Returns:
+        dict: Résumé de l'impact (risques modifiés, transitions de niveau)
+    """
+    debut = time.perf_counter()
+    t = risque_table
+    criticite = modele.criticite_sql(t)
+    niveau = modele.niveau_sql(criticite)
+
+    cotable = and_(t.c.gravite > 0, t.c.probabilite > 0)
+    score_modifie = or_(
+        t.c.criticite.is_distinct_from(criticite),
+        t.c.niveau_risque.is_distinct_from(niveau)
+    )
+
+    # Impact : une seule requête agrégée par (ancien niveau, nouveau niveau)
+    transitions = {}
+    total = modifies = changements_niveau = 0
+    for ancien, nouveau, nombre, nombre_modifies in session.execute(
+        select(
+            t.c.niveau_risque, niveau, func.count(),
+            func.sum(case((score_modifie, 1), else_=0))
+        ).where(cotable).group_by(t.c.niveau_risque, niveau)
+    ):
+        total += nombre
+        modifies += nombre_modifies or 0
+        if ancien != nouveau:
+            changements_niveau += nombre
+            transitions[f'{ancien} → {nouveau}'] = nombre
+
+    resultat = {
+        'modele': modele.to_dict(),
+        'dry_run': dry_run,
+        'nombre_risques': total,
+        'risques_modifies': modifies,
+        'changements_niveau': changements_niveau,
+        'transitions': transitions,
+        'lots': 0
+    }
+
+    if not dry_run:
+        id_min, id_max = session.execute(select(func.min(t.c.id), func.max(t.c.id))).one()
+        a_mettre_a_jour = or_(score_modifie, t.c.version_cotation.is_distinct_from(modele.version))
+
+        if id_min is not None:
+            for borne in range(id_min, id_max + 1, taille_lot):
+                dans_lot = and_(t.c.id >= borne, t.c.id < borne + taille_lot, cotable)
+
+                session.execute(
+                    update(duerp_table)
+                    .where(duerp_table.c.id.in_(
+                        select(unite_table.c.duerp_id)
+                        .join(t, t.c.unite_travail_id == unite_table.c.id)
+                        .where(dans_lot, score_modifie)
+                    ))
+                    .values(revision=duerp_table.c.revision + 1)
+                )
+                session.execute(
+                    update(t)
+                    .where(dans_lot, a_mettre_a_jour)
+                    .values(
+                        criticite=criticite, niveau_risque=niveau, version_cotation=modele.version,
+                        version_id=t.c.version_id + 1
+                    )
+                )
+                session.commit()
+                resultat['lots'] += 1
+
+    resultat['duree_secondes'] = round(time.perf_counter() - debut, 3)
+    return resultat
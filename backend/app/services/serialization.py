@@ -0,0 +1,163 @@
+"""
+Sérialisation rapide des réponses JSON volumineuses
+
+Les charges utiles sont construites directement à partir des lignes
+retournées par des requêtes sur les colonnes (sans instancier d'objet ORM ni
+appeler to_dict), puis encodées par orjson s'il est installé, ou par le
+module json de la bibliothèque standard. Les dates sont laissées telles
+quelles dans les lignes et converties au format ISO 8601 par l'encodeur.
+
+Les routes de liste acceptent aussi un format en colonnes (?format=colonnes) :
+un tableau de valeurs par champ au lieu d'un objet par élément, ce qui évite
+de répéter les noms de champs.
+"""
+import json
+from datetime import date, datetime
+
+from flask import current_app
+from sqlalchemy import select
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson est optionnel
+    orjson = None
+
+ENCODEURS = ('auto', 'orjson', 'json')
+
+# Champs exposés par l'API (mêmes champs que les méthodes to_dict des modèles)
+CHAMPS_DUERP = [
+    'id', 'entreprise_nom', 'entreprise_siret', 'entreprise_adresse', 'entreprise_activite',
+    'effectif', 'version', 'date_creation', 'date_derniere_maj', 'date_prochaine_evaluation',
+    'responsable_evaluation', 'responsable_validation', 'statut', 'revision', 'origine_id', 'version_id'
+]
+CHAMPS_UNITE = ['id', 'nom', 'description', 'localisation', 'nombre_employes', 'version_id']
+CHAMPS_RISQUE = [
+    'id', 'categorie', 'sous_categorie', 'description', 'situation_danger', 'gravite',
+    'probabilite', 'frequence_exposition', 'criticite', 'niveau_risque', 'version_cotation',
+    'personnes_exposees', 'personnes_concernees', 'version_id'
+]
+CHAMPS_MESURE = [
+    'id', 'type_mesure', 'niveau_hierarchie', 'description', 'statut', 'date_mise_en_oeuvre',
+    'date_echeance', 'responsable', 'cout_estime', 'efficacite', 'version_id'
+]
+
+
+def _defaut(valeur):
+    """Conversion des types non gérés nativement par l'encodeur"""
+    if isinstance(valeur, (date, datetime)):
+        return valeur.isoformat()
+    raise TypeError(f'Type non sérialisable en JSON : {type(valeur).__name__}')
+
+
+class Serializer:
+    """Encodeur JSON des réponses, orjson s'il est disponible"""
+
+    def __init__(self, encodeur='auto'):
+        self.configure(encodeur)
+
+    def init_app(self, app):
+        """Choisit l'encodeur à partir de la configuration Flask (JSON_ENCODER)"""
+        self.configure(app.config.get('JSON_ENCODER', 'auto'))
+
+    def configure(self, encodeur):
+        """
+        Args:
+            encodeur: 'orjson', 'json' (bibliothèque standard) ou 'auto'
+                (orjson s'il est installé)
+        """
+        if encodeur not in ENCODEURS:
+            raise ValueError(f'Encodeur JSON inconnu : {encodeur}')
+        if encodeur == 'orjson' and orjson is None:
+            raise RuntimeError("orjson n'est pas installé. Installez-le avec: pip install orjson")
+        self.encodeur = 'orjson' if encodeur != 'json' and orjson is not None else 'json'
+
+    def dumps(self, data):
+        """Encode une structure en JSON (bytes UTF-8)"""
+        if self.encodeur == 'orjson':
+            return orjson.dumps(data, default=_defaut, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(data, default=_defaut, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def response(self, payload):
+        """Réponse JSON encodée par l'encodeur configuré"""
+        return current_app.response_class(self.dumps(payload), mimetype='application/json')
+
+
+def records(champs, lignes):
+    """Lignes de requête en liste d'objets {champ: valeur}"""
+    return [dict(zip(champs, ligne)) for ligne in lignes]
+
+
+def columns(champs, lignes):
+    """Lignes de requête au format en colonnes {champ: [valeurs]}"""
+    if not lignes:
+        return {champ: [] for champ in champs}
+    return dict(zip(champs, map(list, zip(*lignes))))
+
+
+def duerp_trees(session, duerp_id=None):
+    """
+    Arborescences complètes des DUERP (même contenu que DUERP.to_dict())
+
+    Chaque niveau (DUERP, unités, risques, mesures) est lu par une seule
+    requête sur les colonnes, dans l'ordre des identifiants.
+
+    Args:
+        session: Session SQLAlchemy
+        duerp_id: Identifiant d'un DUERP, ou None pour tous les DUERP
+
+    Returns:
+        list: Arborescences des DUERP
+    """
+    from ..models import DUERP, UniteTrail, Risque, MesurePrevention
+
+    requete = select(*[getattr(DUERP, c) for c in CHAMPS_DUERP]).order_by(DUERP.id)
+    if duerp_id is not None:
+        requete = requete.where(DUERP.id == duerp_id)
+    duerps = {}
+    for ligne in session.execute(requete).tuples():
+        duerp = dict(zip(CHAMPS_DUERP, ligne))
+        duerp['unites_travail'] = []
+        duerps[duerp['id']] = duerp
+    if not duerps:
+        return []
+
+    requete = select(UniteTrail.duerp_id, *[getattr(UniteTrail, c) for c in CHAMPS_UNITE]).order_by(UniteTrail.id)
+    if duerp_id is not None:
+        requete = requete.where(UniteTrail.duerp_id == duerp_id)
+    unites = {}
+    for ligne in session.execute(requete).tuples():
+        unite = dict(zip(CHAMPS_UNITE, ligne[1:]))
+        unite['risques'] = []
+        unites[unite['id']] = unite
+        duerps[ligne[0]]['unites_travail'].append(unite)
+
+    requete = (
+        select(Risque.unite_travail_id, *[getattr(Risque, c) for c in CHAMPS_RISQUE])
+        .join(UniteTrail, Risque.unite_travail_id == UniteTrail.id)
+        .order_by(Risque.id)
+    )
+    if duerp_id is not None:
+        requete = requete.where(UniteTrail.duerp_id == duerp_id)
+    risques = {}
+    for ligne in session.execute(requete).tuples():
+        risque = dict(zip(CHAMPS_RISQUE, ligne[1:]))
+        risque['mesures_prevention'] = []
+        risques[risque['id']] = risque
+        unites[ligne[0]]['risques'].append(risque)
+
+    requete = (
+        select(MesurePrevention.risque_id, *[getattr(MesurePrevention, c) for c in CHAMPS_MESURE])
+        .join(Risque, MesurePrevention.risque_id == Risque.id)
+        .join(UniteTrail, Risque.unite_travail_id == UniteTrail.id)
+        .order_by(MesurePrevention.id)
+    )
+    if duerp_id is not None:
+        requete = requete.where(UniteTrail.duerp_id == duerp_id)
+    for ligne in session.execute(requete).tuples():
+        risques[ligne[0]]['mesures_prevention'].append(dict(zip(CHAMPS_MESURE, ligne[1:])))
+
+    return list(duerps.values())
+
+
+# Instance partagée par l'application
+serializer = Serializer()
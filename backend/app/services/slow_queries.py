@@ -0,0 +1,253 @@
+"""
+Journal des requêtes SQL lentes
+
+Chaque requête exécutée par le moteur SQLAlchemy est chronométrée
+(événements before/after_cursor_execute). Au-delà de SLOW_QUERY_THRESHOLD_MS,
+elle est consignée dans un fichier journal à rotation (SLOW_QUERY_LOG_FILE)
+avec sa durée, la route appelante, le SQL, la forme des paramètres (types,
+jamais les valeurs) et son plan d'exécution (EXPLAIN QUERY PLAN, SQLite).
+
+Indépendamment de la durée, le plan de chaque requête distincte portant sur
+une table surveillée (SLOW_QUERY_WATCHED_TABLES) est examiné une fois par
+processus : un parcours complet de la table y est signalé aussitôt, ce qui
+révèle un index manquant avant que la table ne grossisse.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from .metrics import metrics
+
+metrics.describe('requetes_sql_lentes_total', 'Requêtes SQL dépassant le seuil de lenteur, par route')
+metrics.describe('requetes_sql_parcours_complets_total', 'Requêtes SQL distinctes parcourant entièrement une table surveillée')
+
+logger = logging.getLogger('qhse.slow_queries')
+
+# Instructions dont le plan d'exécution peut être demandé
+INSTRUCTIONS_EXPLIQUEES = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Nombre de plans d'exécution conservés (un par texte SQL distinct)
+TAILLE_CACHE_PLANS = 1024
+
+# Alias de table dans le SQL généré ("risque AS risque_1") : le plan
+# d'exécution désigne les tables par leur alias
+_ALIAS = re.compile(r'"?(\w+)"?\s+AS\s+"?(\w+)"?', re.IGNORECASE)
+
+# Parcours d'une table dans le plan : "SCAN risque" ("SCAN TABLE risque" avant SQLite 3.36)
+_PARCOURS = re.compile(r'SCAN (?:TABLE )?"?(\w+)"?')
+
+_fichiers_journal = set()
+_lock_journal = threading.Lock()
+
+
+def parameter_shape(parameters):
+    """
+    Forme des paramètres d'une requête : types seulement, jamais les valeurs
+
+    Les longues séries de paramètres de même type (listes IN) sont résumées,
+    par exemple "(int × 500, str)".
+    """
+    def type_de(valeur):
+        return 'NULL' if valeur is None else type(valeur).__name__
+
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{cle}: {type_de(valeur)}' for cle, valeur in parameters.items()) + '}'
+
+    series = []
+    for valeur in parameters or ():
+        nom = type_de(valeur)
+        if series and series[-1][0] == nom:
+            series[-1][1] += 1
+        else:
+            series.append([nom, 1])
+    return '(' + ', '.join(nom if nombre == 1 else f'{nom} × {nombre}' for nom, nombre in series) + ')'
+
+
+def _route():
+    """Route à l'origine de la requête SQL (règle d'URL, pas le chemin)"""
+    if not has_request_context():
+        return 'hors requête'
+    regle = request.url_rule.rule if request.url_rule is not None else request.path
+    return f'{request.method} {regle}'
+
+
+class SlowQueryLog:
+    """Chronométrage et analyse des requêtes d'un moteur SQLAlchemy"""
+
+    def __init__(self, seuil, tables=()):
+        """
+        Args:
+            seuil: Durée (secondes) à partir de laquelle une requête est lente
+            tables: Tables dont les parcours complets sont signalés
+        """
+        self.seuil = seuil
+        self.tables = frozenset(table.lower() for table in tables)
+        self.explain = False
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def attach(self, engine):
+        """Branche le chronométrage sur les événements du moteur"""
+        # EXPLAIN QUERY PLAN est propre à SQLite
+        self.explain = engine.dialect.name == 'sqlite'
+        event.listen(engine, 'before_cursor_execute', self._avant)
+        event.listen(engine, 'after_cursor_execute', self._apres)
+
+    def _avant(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['debut_requete'] = time.perf_counter()
+
+    def _apres(self, conn, cursor, statement, parameters, context, executemany):
+        duree = time.perf_counter() - conn.info.pop('debut_requete', time.perf_counter())
+        lente = duree >= self.seuil
+        surveillee = any(table in statement for table in self.tables)
+        if not (lente or surveillee):
+            return
+
+        lots = None
+        if executemany:
+            lots, parameters = len(parameters), (parameters[0] if parameters else ())
+
+        plan, nouveau = self.plan(cursor.connection, statement, parameters)
+        parcours = self.full_scans(statement, plan or ())
+        if nouveau and parcours:
+            metrics.inc('requetes_sql_parcours_complets_total', table=','.join(parcours))
+
+        if lente:
+            route = _route()
+            metrics.inc('requetes_sql_lentes_total', route=route)
+            forme = parameter_shape(parameters)
+            if lots is not None:
+                forme = f'{lots} lots de {forme}'
+            logger.warning(
+                'Requête lente : %.1f ms, route %s\nSQL : %s\nParamètres : %s\nPlan :\n%s%s',
+                duree * 1000, route, statement, forme, self._format_plan(plan), self._format_parcours(parcours)
+            )
+        elif nouveau and parcours:
+            logger.warning(
+                'Parcours complet (%.1f ms), route %s\nSQL : %s\nPlan :\n%s%s',
+                duree * 1000, _route(), statement, self._format_plan(plan), self._format_parcours(parcours)
+            )
+
+    def plan(self, connexion, statement, parameters):
+        """
+        Plan d'exécution d'une requête, mis en cache par texte SQL
+
+        Args:
+            connexion: Connexion DBAPI (sqlite3) ayant exécuté la requête
+            statement: Texte SQL
+            parameters: Paramètres de la requête
+
+        Returns:
+            tuple: (lignes du plan ou None, True si le plan vient d'être calculé)
+        """
+        if not self.explain or not statement.lstrip()[:7].upper().startswith(INSTRUCTIONS_EXPLIQUEES):
+            return None, False
+
+        with self._lock:
+            if statement in self._plans:
+                self._plans.move_to_end(statement)
+                return self._plans[statement], False
+
+        try:
+            # Curseur distinct, hors événements SQLAlchemy : le résultat de la
+            # requête d'origine n'est pas consommé
+            lignes = connexion.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        except Exception as e:
+            logger.debug('Plan indisponible : %s', e)
+            return None, False
+
+        # Indentation selon la profondeur dans l'arbre du plan
+        profondeurs = {0: 0}
+        plan = []
+        for identifiant, parent, _, detail in lignes:
+            profondeurs[identifiant] = profondeurs.get(parent, 0) + 1
+            plan.append('  ' * profondeurs[identifiant] + detail)
+        plan = tuple(plan)
+
+        with self._lock:
+            self._plans[statement] = plan
+            if len(self._plans) > TAILLE_CACHE_PLANS:
+                self._plans.popitem(last=False)
+        return plan, True
+
+    def full_scans(self, statement, plan):
+        """Tables surveillées parcourues entièrement (sans index) par le plan"""
+        alias = {a.lower(): table.lower() for table, a in _ALIAS.findall(statement)}
+        tables = []
+        for ligne in plan:
+            detail = ligne.strip()
+            correspondance = _PARCOURS.match(detail)
+            # "USING INDEX" / "USING COVERING INDEX" : parcours d'un index, pas de la table
+            if correspondance is None or 'INDEX' in detail:
+                continue
+            nom = correspondance.group(1).lower()
+            table = alias.get(nom, nom)
+            if table in self.tables and table not in tables:
+                tables.append(table)
+        return tables
+
+    @staticmethod
+    def _format_plan(plan):
+        if plan is None:
+            return '  (indisponible)'
+        return '\n'.join(plan)
+
+    @staticmethod
+    def _format_parcours(parcours):
+        return ''.join(f'\nPARCOURS COMPLET de la table {table} : index manquant ?' for table in parcours)
+
+
+class _JournalRotatif(RotatingFileHandler):
+    """Fichier journal à rotation dont le dossier n'est créé qu'à la première écriture"""
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename) or '.', exist_ok=True)
+        return super()._open()
+
+
+def _configurer_journal(chemin, taille_max, sauvegardes):
+    """Ajoute au journal un fichier à rotation (une seule fois par fichier et par processus)"""
+    with _lock_journal:
+        if chemin in _fichiers_journal:
+            return
+        handler = _JournalRotatif(
+            chemin, maxBytes=taille_max, backupCount=sauvegardes, encoding='utf-8', delay=True
+        )
+        handler.setFormatter(logging.Formatter('%(asctime)s [pid %(process)d] %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        _fichiers_journal.add(chemin)
+
+
+def init_slow_queries(app):
+    """
+    Active le journal des requêtes lentes sur le moteur de l'application
+
+    Returns:
+        SlowQueryLog | None: None si SLOW_QUERY_ENABLED est désactivé
+    """
+    if not app.config.get('SLOW_QUERY_ENABLED'):
+        return None
+
+    from ..models import db
+
+    _configurer_journal(
+        app.config['SLOW_QUERY_LOG_FILE'],
+        app.config.get('SLOW_QUERY_LOG_MAX_BYTES', 5 * 1024 * 1024),
+        app.config.get('SLOW_QUERY_LOG_BACKUPS', 5)
+    )
+    journal = SlowQueryLog(
+        app.config.get('SLOW_QUERY_THRESHOLD_MS', 200) / 1000,
+        app.config.get('SLOW_QUERY_WATCHED_TABLES', ())
+    )
+    with app.app_context():
+        journal.attach(db.engine)
+    return journal
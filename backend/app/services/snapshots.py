@@ -0,0 +1,346 @@
+"""
+Instantanés des versions de DUERP et comparaison entre versions
+
+Un instantané se compose d'un manifeste (informations du DUERP et liste des
+unités de travail avec l'empreinte de leur bloc) et de blocs, un par unité,
+contenant la sous-arborescence risques/mesures. Manifeste et blocs sont
+sérialisés en JSON canonique puis compressés ; les blocs sont dédupliqués
+par empreinte SHA-256.
+
+Unités, risques et mesures sont identifiés par leur clé d'origine (origine_id,
+ou id pour un objet jamais copié) et non par leur id : une unité inchangée
+dans la nouvelle version d'un DUERP partage donc le bloc de la version
+précédente, et la comparaison fonctionne d'une version à l'autre. Les
+instantanés enregistrés avant l'introduction de ces clés (éléments identifiés
+par leur id) restent comparables.
+"""
+import hashlib
+import json
+import zlib
+from datetime import date, datetime
+
+from sqlalchemy import insert, select
+
+from ..models import DUERP, UniteTrail, Risque, MesurePrevention, EvaluationHistorique, SnapshotBloc
+
+CHAMPS_DUERP = [
+    'id', 'entreprise_nom', 'entreprise_siret', 'entreprise_adresse', 'entreprise_activite',
+    'effectif', 'version', 'date_prochaine_evaluation', 'responsable_evaluation',
+    'responsable_validation', 'statut'
+]
+CHAMPS_UNITE = ['nom', 'description', 'localisation', 'nombre_employes']
+CHAMPS_RISQUE = [
+    'categorie', 'sous_categorie', 'description', 'situation_danger', 'gravite',
+    'probabilite', 'frequence_exposition', 'criticite', 'niveau_risque',
+    'personnes_exposees', 'personnes_concernees'
+]
+CHAMPS_MESURE = [
+    'type_mesure', 'niveau_hierarchie', 'description', 'statut', 'date_mise_en_oeuvre',
+    'date_echeance', 'responsable', 'cout_estime', 'efficacite'
+]
+
+
+def _valeur(valeur):
+    if isinstance(valeur, (date, datetime)):
+        return valeur.isoformat()
+    return valeur
+
+
+def _enregistrement(ligne, champs):
+    return {champ: _valeur(getattr(ligne, champ)) for champ in champs}
+
+
+def _element(ligne, champs):
+    """Enregistrement d'une unité, d'un risque ou d'une mesure avec sa clé d'origine"""
+    element = _enregistrement(ligne, champs)
+    element['cle'] = ligne.origine_id or ligne.id
+    return element
+
+
+def _cle(element):
+    """
+    Clé d'un élément de bloc
+
+    Les instantanés antérieurs aux clés d'origine identifient les éléments par
+    leur id : les objets n'étant alors jamais copiés, l'id y vaut la clé.
+    """
+    return element['cle'] if 'cle' in element else element['id']
+
+
+def canonical_json(data):
+    """Sérialisation JSON canonique (clés triées, sans espaces)"""
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def compress(data):
+    """Sérialise et compresse une structure JSON, retourne (empreinte, contenu)"""
+    brut = canonical_json(data)
+    return hashlib.sha256(brut).hexdigest(), zlib.compress(brut, 6)
+
+
+def decompress(contenu):
+    """Décompresse et désérialise un manifeste ou un bloc"""
+    return json.loads(zlib.decompress(contenu).decode('utf-8'))
+
+
+def build_snapshot(session, duerp_id):
+    """
+    Construit l'instantané d'un DUERP à partir de requêtes sur les lignes
+
+    Args:
+        session: Session SQLAlchemy
+        duerp_id: Identifiant du DUERP
+
+    Returns:
+        tuple: (manifeste, blocs) où blocs associe empreinte -> contenu compressé
+    """
+    duerp = session.execute(
+        select(*[getattr(DUERP, c) for c in CHAMPS_DUERP]).where(DUERP.id == duerp_id)
+    ).one()
+
+    unites = {
+        u.id: dict(_element(u, CHAMPS_UNITE), risques=[])
+        for u in session.execute(
+            select(UniteTrail.id, UniteTrail.origine_id, *[getattr(UniteTrail, c) for c in CHAMPS_UNITE])
+            .where(UniteTrail.duerp_id == duerp_id)
+            .order_by(UniteTrail.id)
+        )
+    }
+
+    risques = {}
+    for r in session.execute(
+        select(Risque.id, Risque.origine_id, Risque.unite_travail_id, *[getattr(Risque, c) for c in CHAMPS_RISQUE])
+        .join(UniteTrail, Risque.unite_travail_id == UniteTrail.id)
+        .where(UniteTrail.duerp_id == duerp_id)
+        .order_by(Risque.id)
+    ):
+        risque = dict(_element(r, CHAMPS_RISQUE), mesures=[])
+        risques[r.id] = risque
+        unites[r.unite_travail_id]['risques'].append(risque)
+
+    for m in session.execute(
+        select(
+            MesurePrevention.id, MesurePrevention.origine_id, MesurePrevention.risque_id,
+            *[getattr(MesurePrevention, c) for c in CHAMPS_MESURE]
+        )
+        .join(Risque, MesurePrevention.risque_id == Risque.id)
+        .join(UniteTrail, Risque.unite_travail_id == UniteTrail.id)
+        .where(UniteTrail.duerp_id == duerp_id)
+        .order_by(MesurePrevention.id)
+    ):
+        risques[m.risque_id]['mesures'].append(_element(m, CHAMPS_MESURE))
+
+    blocs = {}
+    references = []
+    for unite in unites.values():
+        empreinte, contenu = compress(unite)
+        blocs[empreinte] = contenu
+        references.append([unite['cle'], empreinte])
+
+    manifeste = {
+        'duerp': _enregistrement(duerp, CHAMPS_DUERP),
+        'unites': references
+    }
+    return manifeste, blocs
+
+
+def content_hash(session, duerp_id):
+    """
+    Empreinte du contenu courant d'un DUERP (informations, unités, risques
+    et mesures), identique tant que ce contenu n'est pas modifié
+
+    Returns:
+        str: Empreinte SHA-256 du manifeste de l'instantané
+    """
+    manifeste, _ = build_snapshot(session, duerp_id)
+    return compress(manifeste)[0]
+
+
+def save_snapshot(session, historique):
+    """
+    Enregistre l'instantané courant du DUERP sur une entrée d'historique
+
+    Seuls les blocs absents de la base sont insérés.
+
+    Args:
+        session: Session SQLAlchemy
+        historique: Entrée EvaluationHistorique (non encore validée)
+    """
+    manifeste, blocs = build_snapshot(session, historique.duerp_id)
+
+    existants = set()
+    empreintes = list(blocs)
+    for i in range(0, len(empreintes), 500):
+        existants.update(session.execute(
+            select(SnapshotBloc.hash).where(SnapshotBloc.hash.in_(empreintes[i:i + 500]))
+        ).scalars())
+
+    nouveaux = [
+        {'hash': empreinte, 'contenu': contenu, 'date_creation': datetime.utcnow()}
+        for empreinte, contenu in blocs.items() if empreinte not in existants
+    ]
+    if nouveaux:
+        session.execute(
+            insert(SnapshotBloc.__table__).prefix_with('OR IGNORE', dialect='sqlite'),
+            nouveaux
+        )
+
+    historique.snapshot_hash, historique.snapshot = compress(manifeste)
+
+
+def load_snapshot_entry(session, historique_id):
+    """
+    Charge le manifeste d'une entrée d'historique sans instancier d'objet ORM
+
+    Returns:
+        dict: Métadonnées de l'entrée et manifeste, ou None si absente
+    """
+    ligne = session.execute(
+        select(
+            EvaluationHistorique.id, EvaluationHistorique.duerp_id,
+            EvaluationHistorique.version, EvaluationHistorique.date_evaluation,
+            EvaluationHistorique.type_modification, EvaluationHistorique.snapshot
+        ).where(EvaluationHistorique.id == historique_id)
+    ).one_or_none()
+    if ligne is None:
+        return None
+
+    return {
+        'historique_id': ligne.id,
+        'duerp_id': ligne.duerp_id,
+        'version': ligne.version,
+        'date_evaluation': _valeur(ligne.date_evaluation),
+        'type_modification': ligne.type_modification,
+        'manifeste': decompress(ligne.snapshot) if ligne.snapshot else None
+    }
+
+
+def _charger_blocs(session, empreintes):
+    blocs = {}
+    empreintes = list(empreintes)
+    for i in range(0, len(empreintes), 500):
+        for empreinte, contenu in session.execute(
+            select(SnapshotBloc.hash, SnapshotBloc.contenu)
+            .where(SnapshotBloc.hash.in_(empreintes[i:i + 500]))
+        ):
+            blocs[empreinte] = decompress(contenu)
+    return blocs
+
+
+def _resume_risque(unite_cle, risque):
+    return {
+        'cle': _cle(risque),
+        'unite_cle': unite_cle,
+        'categorie': risque['categorie'],
+        'description': risque['description'],
+        'criticite': risque['criticite'],
+        'niveau_risque': risque['niveau_risque']
+    }
+
+
+def diff_snapshots(session, manifeste_a, manifeste_b):
+    """
+    Compare deux instantanés structurellement
+
+    Les unités dont le bloc a la même empreinte dans les deux versions sont
+    ignorées sans être décompressées.
+
+    Args:
+        session: Session SQLAlchemy
+        manifeste_a: Manifeste de la version de référence
+        manifeste_b: Manifeste de la version comparée
+
+    Returns:
+        dict: Différences (DUERP, unités, risques, mesures)
+    """
+    duerp_a, duerp_b = manifeste_a['duerp'], manifeste_b['duerp']
+    diff = {
+        'duerp': {
+            champ: [duerp_a.get(champ), duerp_b.get(champ)]
+            for champ in CHAMPS_DUERP
+            if champ != 'id' and duerp_a.get(champ) != duerp_b.get(champ)
+        },
+        'unites_inchangees': 0,
+        'unites_ajoutees': [],
+        'unites_supprimees': [],
+        'unites_modifiees': [],
+        'risques_ajoutes': [],
+        'risques_supprimes': [],
+        'risques_recotes': [],
+        'mesures_ajoutees': [],
+        'mesures_supprimees': [],
+        'mesures_statut_modifie': []
+    }
+
+    unites_a = dict((cle, empreinte) for cle, empreinte in manifeste_a['unites'])
+    unites_b = dict((cle, empreinte) for cle, empreinte in manifeste_b['unites'])
+
+    a_charger = set()
+    for cle in set(unites_a) | set(unites_b):
+        if unites_a.get(cle) == unites_b.get(cle):
+            diff['unites_inchangees'] += 1
+            continue
+        for empreinte in (unites_a.get(cle), unites_b.get(cle)):
+            if empreinte:
+                a_charger.add(empreinte)
+
+    blocs = _charger_blocs(session, a_charger)
+
+    for cle in sorted(set(unites_a) | set(unites_b)):
+        if unites_a.get(cle) == unites_b.get(cle):
+            continue
+        bloc_a = blocs.get(unites_a.get(cle))
+        bloc_b = blocs.get(unites_b.get(cle))
+
+        if bloc_a is None:
+            diff['unites_ajoutees'].append({'cle': cle, 'nom': bloc_b['nom']})
+            diff['risques_ajoutes'].extend(_resume_risque(cle, r) for r in bloc_b['risques'])
+            continue
+        if bloc_b is None:
+            diff['unites_supprimees'].append({'cle': cle, 'nom': bloc_a['nom']})
+            diff['risques_supprimes'].extend(_resume_risque(cle, r) for r in bloc_a['risques'])
+            continue
+
+        champs_modifies = {
+            champ: [bloc_a[champ], bloc_b[champ]]
+            for champ in CHAMPS_UNITE
+            if bloc_a[champ] != bloc_b[champ]
+        }
+        if champs_modifies:
+            diff['unites_modifiees'].append({'cle': cle, 'champs': champs_modifies})
+
+        risques_a = {_cle(r): r for r in bloc_a['risques']}
+        risques_b = {_cle(r): r for r in bloc_b['risques']}
+
+        for risque_cle in sorted(set(risques_a) | set(risques_b)):
+            risque_a, risque_b = risques_a.get(risque_cle), risques_b.get(risque_cle)
+            if risque_a is None:
+                diff['risques_ajoutes'].append(_resume_risque(cle, risque_b))
+                continue
+            if risque_b is None:
+                diff['risques_supprimes'].append(_resume_risque(cle, risque_a))
+                continue
+
+            if (risque_a['criticite'], risque_a['niveau_risque']) != (risque_b['criticite'], risque_b['niveau_risque']):
+                diff['risques_recotes'].append({
+                    'cle': risque_cle,
+                    'unite_cle': cle,
+                    'gravite': [risque_a['gravite'], risque_b['gravite']],
+                    'probabilite': [risque_a['probabilite'], risque_b['probabilite']],
+                    'criticite': [risque_a['criticite'], risque_b['criticite']],
+                    'niveau_risque': [risque_a['niveau_risque'], risque_b['niveau_risque']]
+                })
+
+            mesures_a = {_cle(m): m for m in risque_a['mesures']}
+            mesures_b = {_cle(m): m for m in risque_b['mesures']}
+            for mesure_cle in sorted(set(mesures_a) | set(mesures_b)):
+                mesure_a, mesure_b = mesures_a.get(mesure_cle), mesures_b.get(mesure_cle)
+                resume = {'cle': mesure_cle, 'risque_cle': risque_cle}
+                if mesure_a is None:
+                    diff['mesures_ajoutees'].append(dict(resume, description=mesure_b['description'], statut=mesure_b['statut']))
+                elif mesure_b is None:
+                    diff['mesures_supprimees'].append(dict(resume, description=mesure_a['description'], statut=mesure_a['statut']))
+                elif mesure_a['statut'] != mesure_b['statut']:
+                    diff['mesures_statut_modifie'].append(dict(resume, statut=[mesure_a['statut'], mesure_b['statut']]))
+
+    return diff
@@ -0,0 +1,350 @@
+"""
+Traçage des requêtes (spans)
+
+Une requête échantillonnée (TRACING_SAMPLE_RATE) ouvre une trace : un span racine couvre la route, puis
+chaque requête SQL et chaque section de la génération de documents ouvre un
+span enfant. Le span courant est propagé par contextvars : le code
+instrumenté n'a rien à transmettre.
+
+Hors requête échantillonnée, span() ne fait qu'une lecture de contextvar :
+le surcoût est négligeable.
+
+Un en-tête W3C traceparent rattache la trace à celle de l'appelant. Son
+drapeau "sampled" n'impose le traçage que si l'appelant est de confiance
+(TRACING_TRUST_TRACEPARENT) : sinon, n'importe quel client pourrait faire
+tracer toutes ses requêtes, et la décision reste celle du taux
+d'échantillonnage.
+
+Chaque trace terminée est écrite sur une ligne du fichier TRACING_FILE, au
+format JSON d'OTLP (OpenTelemetry : resourceSpans / scopeSpans / spans),
+lisible par un collecteur OpenTelemetry ou par des outils de visualisation
+de traces. Au-delà de TRACING_FILE_MAX_BYTES, le fichier est renommé
+(traces.jsonl.1, .2...) et seuls TRACING_FILE_BACKUPS fichiers sont conservés.
+"""
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from flask import g, request
+from sqlalchemy import event
+
+from .serialization import serializer
+
+# Types de spans OTLP
+SPAN_INTERNE = 1
+SPAN_SERVEUR = 2
+SPAN_CLIENT = 3
+
+# Statut OTLP d'un span en erreur
+STATUT_ERREUR = 2
+
+# Longueur maximale du SQL conservé dans un span
+TAILLE_MAX_SQL = 2000
+
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_span_courant = ContextVar('span_courant', default=None)
+
+
+def _attribut_otlp(cle, valeur):
+    """Attribut au format JSON d'OTLP (les entiers 64 bits sont des chaînes)"""
+    if isinstance(valeur, bool):
+        return {'key': cle, 'value': {'boolValue': valeur}}
+    if isinstance(valeur, int):
+        return {'key': cle, 'value': {'intValue': str(valeur)}}
+    if isinstance(valeur, float):
+        return {'key': cle, 'value': {'doubleValue': valeur}}
+    return {'key': cle, 'value': {'stringValue': str(valeur)}}
+
+
+class _Trace:
+    """Spans d'une requête échantillonnée, exportés à la fin du span racine"""
+
+    def __init__(self, trace_id, max_spans):
+        self.trace_id = trace_id
+        self.max_spans = max_spans
+        self.spans = []
+        self.ignores = 0
+
+    def add(self, span):
+        if len(self.spans) < self.max_spans:
+            self.spans.append(span)
+        else:
+            self.ignores += 1
+
+
+class Span:
+    """Opération chronométrée d'une trace"""
+
+    __slots__ = ('trace', 'span_id', 'parent_id', 'nom', 'type', 'debut', '_t0', 'fin', 'attributs', 'erreur')
+
+    def __init__(self, trace, nom, parent_id=None, type=SPAN_INTERNE, attributs=None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.nom = nom
+        self.type = type
+        self.debut = time.time_ns()
+        self._t0 = time.perf_counter_ns()
+        self.fin = None
+        self.attributs = attributs or {}
+        self.erreur = None
+        trace.add(self)
+
+    def child(self, nom, type=SPAN_INTERNE, attributs=None):
+        """Crée un span enfant (sans en faire le span courant)"""
+        return Span(self.trace, nom, self.span_id, type, attributs)
+
+    def end(self, erreur=None):
+        """Termine le span ; la durée est mesurée par l'horloge monotone"""
+        self.fin = self.debut + time.perf_counter_ns() - self._t0
+        if erreur is not None:
+            self.erreur = str(erreur)
+
+    @property
+    def traceparent(self):
+        """En-tête W3C traceparent désignant ce span"""
+        return f'00-{self.trace.trace_id}-{self.span_id}-01'
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.nom,
+            'kind': self.type,
+            'startTimeUnixNano': str(self.debut),
+            'endTimeUnixNano': str(self.fin if self.fin is not None else self.debut),
+            'attributes': [_attribut_otlp(cle, valeur) for cle, valeur in self.attributs.items()]
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.erreur is not None:
+            span['status'] = {'code': STATUT_ERREUR, 'message': self.erreur}
+        return span
+
+
+class Tracer:
+    """Échantillonnage des requêtes, propagation des spans et export JSON lines"""
+
+    def __init__(self, taux=0.0, fichier=None, max_spans=1000, taille_max=50 * 1024 * 1024, sauvegardes=3,
+                 confiance=False):
+        """
+        Args:
+            taux: Proportion des requêtes tracées (0 à 1)
+            fichier: Fichier JSON lines recevant les traces
+            max_spans: Nombre maximal de spans conservés par trace
+            taille_max: Taille (octets) au-delà de laquelle le fichier est renommé
+            sauvegardes: Nombre de fichiers renommés conservés
+            confiance: Le drapeau "sampled" de l'en-tête traceparent impose le traçage
+        """
+        self.taux = taux
+        self.fichier = fichier
+        self.max_spans = max_spans
+        self.taille_max = taille_max
+        self.sauvegardes = sauvegardes
+        self.confiance = confiance
+        self.service = 'qhse'
+        self._systeme_sql = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Configure le traçage et l'active sur les requêtes et le moteur SQL de l'application"""
+        if not app.config.get('TRACING_ENABLED'):
+            return
+        from ..models import db
+
+        self.taux = app.config.get('TRACING_SAMPLE_RATE', self.taux)
+        self.fichier = app.config['TRACING_FILE']
+        self.max_spans = app.config.get('TRACING_MAX_SPANS', self.max_spans)
+        self.taille_max = app.config.get('TRACING_FILE_MAX_BYTES', self.taille_max)
+        self.sauvegardes = app.config.get('TRACING_FILE_BACKUPS', self.sauvegardes)
+        self.confiance = app.config.get('TRACING_TRUST_TRACEPARENT', self.confiance)
+
+        app.before_request(self._debut_requete)
+        app.after_request(self._reponse)
+        app.teardown_request(self._fin_requete)
+        with app.app_context():
+            engine = db.engine
+            self._systeme_sql = engine.dialect.name
+            event.listen(engine, 'before_cursor_execute', self._avant_sql)
+            event.listen(engine, 'after_cursor_execute', self._apres_sql)
+            event.listen(engine, 'handle_error', self._erreur_sql)
+
+    # Requêtes HTTP
+
+    def _debut_requete(self):
+        parent = _TRACEPARENT.match(request.headers.get('traceparent', ''))
+        if parent is not None and self.confiance:
+            # Appelant de confiance : sa décision d'échantillonnage (drapeau
+            # "sampled") s'applique
+            echantillonnee = bool(int(parent.group(3), 16) & 1)
+        else:
+            echantillonnee = self.taux > 0 and random.random() < self.taux
+        if not echantillonnee:
+            return
+
+        if parent is not None:
+            trace_id, parent_id = parent.group(1), parent.group(2)
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+
+        regle = request.url_rule.rule if request.url_rule is not None else request.path
+        racine = Span(_Trace(trace_id, self.max_spans), f'{request.method} {regle}', parent_id, SPAN_SERVEUR, {
+            'http.request.method': request.method,
+            'http.route': regle,
+            'url.path': request.path
+        })
+        g.trace = (racine, _span_courant.set(racine))
+
+    def _reponse(self, response):
+        trace = g.get('trace')
+        if trace is not None:
+            racine = trace[0]
+            racine.attributs['http.response.status_code'] = response.status_code
+            if response.status_code >= 500:
+                racine.erreur = f'HTTP {response.status_code}'
+            response.headers['traceparent'] = racine.traceparent
+        return response
+
+    def _fin_requete(self, exception=None):
+        trace = g.pop('trace', None)
+        if trace is None:
+            return
+        racine, jeton = trace
+        racine.end(exception)
+        _span_courant.reset(jeton)
+        self.export(racine.trace)
+
+    # Requêtes SQL
+
+    def _avant_sql(self, conn, cursor, statement, parameters, context, executemany):
+        parent = _span_courant.get()
+        if parent is None:
+            return
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'SQL'
+        conn.info['span_sql'] = parent.child(f'SQL {operation}', SPAN_CLIENT, {
+            'db.system': self._systeme_sql,
+            'db.statement': statement[:TAILLE_MAX_SQL]
+        })
+
+    def _apres_sql(self, conn, cursor, statement, parameters, context, executemany):
+        span = conn.info.pop('span_sql', None)
+        if span is not None:
+            span.end()
+
+    def _erreur_sql(self, contexte):
+        if contexte.connection is None:
+            return
+        span = contexte.connection.info.pop('span_sql', None)
+        if span is not None:
+            span.end(contexte.original_exception)
+
+    # Spans applicatifs
+
+    @contextmanager
+    def span(self, nom, **attributs):
+        """
+        Span enfant du span courant, qui devient le span courant dans le bloc
+
+        Hors trace (requête non échantillonnée), ne fait rien et produit None.
+        """
+        parent = _span_courant.get()
+        if parent is None:
+            yield None
+            return
+        courant = parent.child(nom, attributs=attributs)
+        jeton = _span_courant.set(courant)
+        try:
+            yield courant
+        except BaseException as e:
+            courant.end(e)
+            raise
+        else:
+            courant.end()
+        finally:
+            _span_courant.reset(jeton)
+
+    # Export
+
+    def export(self, trace):
+        """Écrit une trace terminée sur une ligne du fichier (format JSON d'OTLP)"""
+        if not self.fichier or not trace.spans:
+            return
+        ressource = [_attribut_otlp('service.name', self.service), _attribut_otlp('process.pid', os.getpid())]
+        if trace.ignores:
+            ressource.append(_attribut_otlp('qhse.spans_ignores', trace.ignores))
+        ligne = serializer.dumps({'resourceSpans': [{
+            'resource': {'attributes': ressource},
+            'scopeSpans': [{
+                'scope': {'name': 'qhse.tracing'},
+                'spans': [span.to_otlp() for span in trace.spans]
+            }]
+        }]}) + b'\n'
+        # Une seule écriture en mode ajout : les lignes des différents
+        # processus ne s'entremêlent pas
+        with self._lock:
+            try:
+                fd = os.open(self.fichier, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            except FileNotFoundError:
+                # Dossier créé à la première trace
+                os.makedirs(os.path.dirname(self.fichier) or '.', exist_ok=True)
+                fd = os.open(self.fichier, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, ligne)
+                taille = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            if self.taille_max and taille >= self.taille_max:
+                self._rotation()
+
+    def _rotation(self):
+        """
+        Renomme le fichier des traces (traces.jsonl.1, .2...) et supprime le plus ancien
+
+        Entre processus, la taille est approximative : un autre processus peut
+        encore écrire quelques lignes dans le fichier renommé.
+        """
+        try:
+            if self.sauvegardes > 0:
+                for numero in range(self.sauvegardes - 1, 0, -1):
+                    source = f'{self.fichier}.{numero}'
+                    if os.path.exists(source):
+                        os.replace(source, f'{self.fichier}.{numero + 1}')
+                os.replace(self.fichier, f'{self.fichier}.1')
+            else:
+                os.unlink(self.fichier)
+        except FileNotFoundError:
+            # Rotation déjà faite par un autre processus
+            pass
+
+
+def span(nom, **attributs):
+    """Span enfant du span courant (voir Tracer.span)"""
+    return tracer.span(nom, **attributs)
+
+
+def traced(nom):
+    """Décorateur : exécute la fonction dans un span"""
+    def decorateur(fonction):
+        @wraps(fonction)
+        def enveloppe(*args, **kwargs):
+            with tracer.span(nom):
+                return fonction(*args, **kwargs)
+        return enveloppe
+    return decorateur
+
+
+def annotate(**attributs):
+    """Ajoute des attributs au span courant (sans effet hors trace)"""
+    courant = _span_courant.get()
+    if courant is not None:
+        courant.attributs.update(attributs)
+
+
+# Instance partagée par l'application
+tracer = Tracer()
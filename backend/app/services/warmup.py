@@ -0,0 +1,51 @@
+"""
+Préchargement des moteurs de génération de documents
+
+ReportLab et python-docx ne sont importés qu'à la première génération de
+document. Pour qu'aucune requête ne paie ce coût, chaque worker peut les
+précharger juste après son démarrage (après le fork) : import des modules,
+polices, feuille de styles et première mise en page.
+"""
+import threading
+import time
+
+from flask import current_app
+
+
+def warm_up():
+    """
+    Précharge ReportLab (polices, styles) et python-docx
+
+    Returns:
+        float: Durée du préchargement en secondes
+    """
+    debut = time.perf_counter()
+
+    from .document_generator import preload
+    preload()
+
+    try:
+        from docx import Document
+        Document()
+    except ImportError:
+        # python-docx absent : seul le PDF est disponible
+        pass
+
+    return time.perf_counter() - debut
+
+
+def init_warmup(app):
+    """
+    Lance le préchargement en tâche de fond si WARMUP_DOCUMENTS est activé
+
+    Le démarrage de l'application n'attend pas la fin du préchargement.
+    """
+    if not app.config.get('WARMUP_DOCUMENTS'):
+        return
+
+    def precharger():
+        with app.app_context():
+            duree = warm_up()
+            current_app.logger.info('Moteurs de documents préchargés en %.2f s', duree)
+
+    threading.Thread(target=precharger, name='warmup-documents', daemon=True).start()
@@ -25,6 +25,101 @@ class Config:
     # CORS settings
     CORS_HEADERS = 'Content-Type'
 
+    # Modèle de cotation des risques (version active et définitions additionnelles)
+    SCORING_MODEL = os.getenv('SCORING_MODEL', '1.0')
+    SCORING_MODELS_FILE = os.getenv('SCORING_MODELS_FILE')
+
+    # Cache des réponses calculées (nombre d'entrées)
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 256))
+
+    # Nombre maximal d'opérations par requête /api/batch
+    BATCH_MAX_OPERATIONS = int(os.getenv('BATCH_MAX_OPERATIONS', 500))
+
+    # Clés d'idempotence des créations : durée de conservation des réponses
+    # et délai au-delà duquel une requête en cours est considérée abandonnée
+    # (jamais inférieur à SERVER_TIMEOUT, durée maximale d'une requête)
+    IDEMPOTENCY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_TTL_HOURS', 24))
+    IDEMPOTENCY_PENDING_SECONDS = int(os.getenv('IDEMPOTENCY_PENDING_SECONDS', os.getenv('SERVER_TIMEOUT', 120)))
+
+    # Contrôle d'admission des traitements coûteux, par classe de routes et par
+    # processus : exécutions simultanées, places en file d'attente et délai
+    # d'attente maximal (secondes) avant refus (429)
+    ADMISSION_LIMITS = {
+        'render': {'concurrence': int(os.getenv('ADMISSION_RENDER_CONCURRENCE', 2)), 'file': 4, 'attente': 30},
+        'import': {'concurrence': 2, 'file': 4, 'attente': 10},
+        'stats': {'concurrence': 4, 'file': 8, 'attente': 5}
+    }
+
+    # Regroupement des calculs identiques simultanés : dossier des verrous et
+    # résultats partagés entre processus (instance/coalescing par défaut),
+    # durée de reprise d'un résultat et attente maximale d'un calcul en cours
+    # (secondes)
+    COALESCING_FOLDER = os.getenv('COALESCING_FOLDER')
+    COALESCING_RESULT_TTL = int(os.getenv('COALESCING_RESULT_TTL', 30))
+    COALESCING_TIMEOUT = int(os.getenv('COALESCING_TIMEOUT', 120))
+
+    # Nombre de risques à partir duquel le PDF est généré en mode flux
+    # (lecture par lots, mémoire bornée)
+    PDF_STREAMING_THRESHOLD = int(os.getenv('PDF_STREAMING_THRESHOLD', 2000))
+
+    # Artefacts figés des DUERP validés (JSON et PDF adressés par leur
+    # empreinte, voir services/publication.py) et durée de cache (secondes)
+    # de leurs adresses de contenu
+    PUBLISHED_FOLDER = os.getenv('PUBLISHED_FOLDER', os.path.join(BASE_DIR, 'published'))
+    PUBLISHED_MAX_AGE = int(os.getenv('PUBLISHED_MAX_AGE', 365 * 24 * 3600))
+
+    # Mesure du pic mémoire de chaque génération de document (tracemalloc,
+    # voir services/render_profile.py) : ralentit le rendu
+    DOCUMENT_PROFILE_MEMORY = os.getenv('DOCUMENT_PROFILE_MEMORY', 'false').lower() == 'true'
+
+    # Encodeur JSON des réponses volumineuses : auto (orjson s'il est
+    # installé), orjson ou json (bibliothèque standard)
+    JSON_ENCODER = os.getenv('JSON_ENCODER', 'auto')
+
+    # Compression des réponses (gzip, ou brotli s'il est installé) : taille
+    # minimale compressée (octets) et niveaux des réponses compressées à la volée
+    COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+    COMPRESSION_LEVELS = {'gzip': 6, 'br': 5}
+
+    # Préchargement de ReportLab et python-docx au démarrage de chaque worker
+    # (en tâche de fond) : la première génération de document n'en paie pas le coût
+    WARMUP_DOCUMENTS = os.getenv('WARMUP_DOCUMENTS', 'false').lower() == 'true'
+
+    # Serveur de production (gunicorn, voir backend/server.py) : adresse,
+    # workers (0 : un par cœur), threads par worker, recyclage d'un worker
+    # après N requêtes (± marge aléatoire), délais en secondes
+    SERVER_BIND = os.getenv('SERVER_BIND', '0.0.0.0:5000')
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', 0))
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', 4))
+    SERVER_MAX_REQUESTS = int(os.getenv('SERVER_MAX_REQUESTS', 1000))
+    SERVER_MAX_REQUESTS_JITTER = int(os.getenv('SERVER_MAX_REQUESTS_JITTER', 100))
+    SERVER_TIMEOUT = int(os.getenv('SERVER_TIMEOUT', 120))
+    SERVER_GRACEFUL_TIMEOUT = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', 30))
+
+    # Journal des requêtes SQL lentes (voir services/slow_queries.py) : seuil
+    # en millisecondes, fichier à rotation (taille maximale en octets, nombre
+    # de fichiers conservés) et tables dont les parcours complets sont signalés
+    SLOW_QUERY_ENABLED = os.getenv('SLOW_QUERY_ENABLED', 'true').lower() == 'true'
+    SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 200))
+    SLOW_QUERY_LOG_FILE = os.getenv('SLOW_QUERY_LOG_FILE', os.path.join(BASE_DIR, 'logs', 'slow_queries.log'))
+    SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv('SLOW_QUERY_LOG_MAX_BYTES', 5 * 1024 * 1024))
+    SLOW_QUERY_LOG_BACKUPS = int(os.getenv('SLOW_QUERY_LOG_BACKUPS', 5))
+    SLOW_QUERY_WATCHED_TABLES = ['risque', 'mesure_prevention']
+
+    # Traçage des requêtes (voir services/tracing.py) : proportion des
+    # requêtes tracées, fichier JSON lines des traces (format OTLP, renommé
+    # au-delà de sa taille maximale en octets, nombre de fichiers conservés),
+    # nombre maximal de spans par trace, et prise en compte du drapeau
+    # "sampled" de l'en-tête traceparent (appelants de confiance seulement)
+    TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+    TRACING_SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', 0.01))
+    TRACING_FILE = os.getenv('TRACING_FILE', os.path.join(BASE_DIR, 'logs', 'traces.jsonl'))
+    TRACING_FILE_MAX_BYTES = int(os.getenv('TRACING_FILE_MAX_BYTES', 50 * 1024 * 1024))
+    TRACING_FILE_BACKUPS = int(os.getenv('TRACING_FILE_BACKUPS', 3))
+    TRACING_MAX_SPANS = int(os.getenv('TRACING_MAX_SPANS', 1000))
+    TRACING_TRUST_TRACEPARENT = os.getenv('TRACING_TRUST_TRACEPARENT', 'false').lower() == 'true'
+
 class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
@@ -34,11 +129,14 @@ class ProductionConfig(Config):
     """Production configuration"""
     DEBUG = False
     TESTING = False
+    WARMUP_DOCUMENTS = os.getenv('WARMUP_DOCUMENTS', 'true').lower() == 'true'
 
 class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SLOW_QUERY_ENABLED = False
+    TRACING_ENABLED = False
 
 # Configuration dictionary
 config = {
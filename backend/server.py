@@ -0,0 +1,73 @@
+"""
+Serveur de production multi-processus (gunicorn)
+
+Le processus maître démarre SERVER_WORKERS workers (fork), chacun servant
+les requêtes avec SERVER_THREADS threads. L'application (moteur de base de
+données, caches, limiteurs, modèles de cotation) est créée dans chaque
+worker après le fork, jamais dans le maître : aucune connexion ni verrou
+n'est partagé entre processus.
+
+Un worker est recyclé après SERVER_MAX_REQUESTS requêtes (avec une marge
+aléatoire pour qu'ils ne redémarrent pas tous ensemble), ce qui borne la
+croissance mémoire due à la génération des documents. Le signal HUP envoyé
+au maître recharge les workers sans interrompre le service.
+"""
+import multiprocessing
+
+from gunicorn.app.base import BaseApplication
+
+from config.settings import config
+
+
+def server_options(config_name='production'):
+    """Options gunicorn tirées de la configuration de l'application"""
+    reglages = config[config_name]
+    return {
+        'bind': reglages.SERVER_BIND,
+        'workers': reglages.SERVER_WORKERS or multiprocessing.cpu_count(),
+        'worker_class': 'gthread',
+        'threads': reglages.SERVER_THREADS,
+        'max_requests': reglages.SERVER_MAX_REQUESTS,
+        'max_requests_jitter': reglages.SERVER_MAX_REQUESTS_JITTER,
+        'timeout': reglages.SERVER_TIMEOUT,
+        'graceful_timeout': reglages.SERVER_GRACEFUL_TIMEOUT,
+        'keepalive': 5,
+        'preload_app': False,
+        'accesslog': '-',
+        'post_fork': post_fork
+    }
+
+
+def post_fork(server, worker):
+    """Journalise le démarrage d'un worker (l'application est créée ensuite, dans le worker)"""
+    server.log.info('Worker %s démarré', worker.pid)
+
+
+class QHSEServer(BaseApplication):
+    """Application gunicorn créant l'application Flask dans chaque worker"""
+
+    def __init__(self, app_factory, config_name='production', options=None):
+        """
+        Args:
+            app_factory: Factory create_app de l'application Flask
+            config_name: Nom de la configuration à utiliser
+            options: Options gunicorn, par défaut celles de server_options()
+        """
+        self.app_factory = app_factory
+        self.config_name = config_name
+        self.options = options if options is not None else server_options(config_name)
+        super().__init__()
+
+    def load_config(self):
+        for cle, valeur in self.options.items():
+            if cle in self.cfg.settings and valeur is not None:
+                self.cfg.set(cle, valeur)
+
+    def load(self):
+        # Appelé dans chaque worker, après le fork (preload_app désactivé)
+        return self.app_factory(self.config_name)
+
+
+def serve(app_factory, config_name='production'):
+    """Lance le serveur de production (bloquant)"""
+    QHSEServer(app_factory, config_name).run()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Mesure du temps de démarrage de l'application
+
+Chaque mesure est faite dans un processus neuf : import du module de
+l'application, appel de create_app, première requête, puis (optionnel)
+préchargement des moteurs de documents et première génération de PDF. Le
+premier démarrage sur une base vide (création du schéma) est mesuré à part.
+
+Exemples :
+    python benchmarks/startup.py
+    python benchmarks/startup.py --repetitions 10 --pdf
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Script exécuté dans chaque processus mesuré
+MESURE = r'''
+import json, sys, time
+debut = time.perf_counter()
+sys.path.insert(0, {racine!r})
+from run import load_create_app
+create_app = load_create_app()
+mesures = {{'import': time.perf_counter() - debut}}
+
+t = time.perf_counter()
+app = create_app('production')
+mesures['create_app'] = time.perf_counter() - t
+mesures['reportlab_charge'] = 'reportlab' in sys.modules
+
+client = app.test_client()
+t = time.perf_counter()
+client.get('/health')
+mesures['premiere_requete'] = time.perf_counter() - t
+mesures['total'] = time.perf_counter() - debut
+
+if {pdf!r}:
+    reponse = client.post('/api/duerp/', json={{'entreprise_nom': 'Démarrage', 'responsable_evaluation': 'X'}})
+    duerp_id = reponse.get_json()['data']['id']
+    if {warmup!r}:
+        from app.services.warmup import warm_up
+        with app.app_context():
+            mesures['prechargement'] = warm_up()
+    t = time.perf_counter()
+    client.post(f'/api/duerp/{{duerp_id}}/generate', json={{'format': 'pdf'}})
+    mesures['premier_pdf'] = time.perf_counter() - t
+
+print(json.dumps(mesures))
+'''
+
+
+def mesurer(base, pdf=False, warmup=False):
+    """Démarre l'application dans un processus neuf et retourne ses mesures"""
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{base}', FLASK_ENV='production')
+    script = MESURE.format(racine=RACINE, pdf=pdf, warmup=warmup)
+    sortie = subprocess.run(
+        [sys.executable, '-c', script], env=env, cwd=RACINE,
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(sortie.strip().splitlines()[-1])
+
+
+def afficher(titre, series):
+    print(titre)
+    for cle in series[0]:
+        valeurs = [s[cle] for s in series]
+        if isinstance(valeurs[0], bool):
+            print(f'  {cle:<20} {valeurs[0]}')
+        else:
+            print(f'  {cle:<20} médiane {statistics.median(valeurs) * 1000:8.1f} ms'
+                  f'   min {min(valeurs) * 1000:8.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Temps de démarrage de l\'application')
+    parser.add_argument('--repetitions', type=int, default=5, help='Nombre de démarrages mesurés')
+    parser.add_argument('--pdf', action='store_true', help='Mesure aussi la première génération de PDF')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dossier:
+        base = os.path.join(dossier, 'startup.db')
+
+        afficher('Premier démarrage (base vide, création du schéma)', [mesurer(base)])
+        afficher('Démarrage (schéma à jour)', [mesurer(base) for _ in range(args.repetitions)])
+
+        if args.pdf:
+            afficher('Première génération PDF sans préchargement',
+                     [mesurer(base, pdf=True) for _ in range(args.repetitions)])
+            afficher('Première génération PDF après préchargement',
+                     [mesurer(base, pdf=True, warmup=True) for _ in range(args.repetitions)])
+
+
+if __name__ == '__main__':
+    main()
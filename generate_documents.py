@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Génération par lot des documents DUERP (traitement de nuit)
+
+Génère le document de chaque DUERP (tous, ou une sélection par statut,
+identifiant ou entreprise) dans un dossier de sortie, en répartissant les
+DUERP sur un pool de processus. Un DUERP dont le contenu n'a pas changé
+depuis le lot précédent (même empreinte) n'est pas régénéré. Le manifeste
+manifest.json décrit chaque document (empreinte, taille, durée, profil du
+rendu : durée par section, pages, volume du DUERP, pic mémoire avec
+--profil-memoire) et les documents peuvent être regroupés dans une archive ZIP.
+
+Exemples :
+    python generate_documents.py --statut validé
+    python generate_documents.py --format docx --workers 8 --zip lot.zip
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from run import load_create_app
+
+MANIFESTE = 'manifest.json'
+
+# Application Flask du processus courant (créée par _initialiser dans le pool)
+_app = None
+
+
+def _initialiser(env):
+    """Crée l'application Flask dans chaque processus du pool"""
+    global _app
+    _app = load_create_app()(env)
+
+
+def _ecrire(chemin, contenu):
+    """Écrit un fichier de façon atomique (fichier temporaire renommé)"""
+    descripteur, temporaire = tempfile.mkstemp(dir=os.path.dirname(chemin), suffix='.tmp')
+    try:
+        # Documents lisibles par la GED (mkstemp crée le fichier en 0600)
+        os.chmod(temporaire, 0o644)
+        with os.fdopen(descripteur, 'wb') as f:
+            f.write(contenu)
+        os.replace(temporaire, chemin)
+    except BaseException:
+        os.unlink(temporaire)
+        raise
+
+
+def generer_document(duerp_id, format_type, dossier, precedent=None, forcer=False, memoire=False):
+    """
+    Génère le document d'un DUERP (exécuté dans un processus du pool)
+
+    Args:
+        duerp_id: Identifiant du DUERP
+        format_type: pdf ou docx
+        dossier: Dossier de sortie
+        precedent: Entrée du manifeste précédent pour ce DUERP
+        forcer: Régénère le document même si son contenu n'a pas changé
+        memoire: Mesure le pic mémoire du rendu (tracemalloc)
+
+    Returns:
+        dict: Entrée du manifeste
+    """
+    from app.models import db, DUERP
+    from app.services.document_generator import DUERPDocumentGenerator
+    from app.services.scoring import get_active_model
+    from app.services.snapshots import content_hash
+
+    debut = time.perf_counter()
+    entree = {'duerp_id': duerp_id, 'etat': 'erreur'}
+    try:
+        with _app.app_context():
+            duerp = db.session.get(DUERP, duerp_id)
+            entree.update({
+                'entreprise': duerp.entreprise_nom,
+                'version': duerp.version,
+                'statut': duerp.statut
+            })
+
+            # Le document dépend du contenu, du format et du modèle de cotation
+            empreinte = hashlib.sha256(
+                f'{content_hash(db.session, duerp_id)}:{format_type}:{get_active_model().version}'.encode('utf-8')
+            ).hexdigest()
+            entree['empreinte'] = empreinte
+
+            # Seul un document effectivement produit lors d'un lot précédent est
+            # réutilisé (une entrée en erreur n'a pas de fichier valide)
+            if (not forcer and precedent and precedent.get('empreinte') == empreinte
+                    and precedent.get('etat') in ('généré', 'inchangé') and 'fichier' in precedent
+                    and os.path.isfile(os.path.join(dossier, precedent['fichier']))):
+                entree.update({
+                    'etat': 'inchangé',
+                    'fichier': precedent['fichier'],
+                    'taille': precedent.get('taille'),
+                    'date_generation': precedent.get('date_generation'),
+                    'duree': round(time.perf_counter() - debut, 3)
+                })
+                return entree
+
+            generator = DUERPDocumentGenerator(profile_memory=memoire)
+            if format_type == 'pdf':
+                streaming = generator.count_risks(duerp) >= _app.config['PDF_STREAMING_THRESHOLD']
+                contenu = generator.render_pdf(duerp, streaming=streaming)
+            else:
+                contenu = generator.render_docx(duerp)
+
+            entreprise = re.sub(r'[^\w.-]+', '_', duerp.entreprise_nom).strip('_')
+            fichier = f'DUERP_{duerp_id}_{entreprise}.{format_type}'
+            _ecrire(os.path.join(dossier, fichier), contenu)
+
+            entree.update({
+                'etat': 'généré',
+                'fichier': fichier,
+                'taille': len(contenu),
+                'date_generation': datetime.now().isoformat(timespec='seconds'),
+                'duree': round(time.perf_counter() - debut, 3),
+                'profil': generator.last_profile.to_dict()
+            })
+    except Exception as e:
+        entree.update({'erreur': str(e), 'duree': round(time.perf_counter() - debut, 3)})
+    return entree
+
+
+def selectionner(app, statuts=None, ids=None, entreprise=None):
+    """
+    DUERP à générer, les plus volumineux en premier pour équilibrer le pool
+
+    Returns:
+        list: Identifiants des DUERP
+    """
+    from sqlalchemy import func, select
+    from app.models import db, DUERP, UniteTrail, Risque
+
+    with app.app_context():
+        requete = (
+            select(DUERP.id)
+            .outerjoin(UniteTrail, UniteTrail.duerp_id == DUERP.id)
+            .outerjoin(Risque, Risque.unite_travail_id == UniteTrail.id)
+            .group_by(DUERP.id)
+            .order_by(func.count(Risque.id).desc(), DUERP.id)
+        )
+        if statuts:
+            requete = requete.where(DUERP.statut.in_(statuts))
+        if ids:
+            requete = requete.where(DUERP.id.in_(ids))
+        if entreprise:
+            requete = requete.where(DUERP.entreprise_nom.ilike(f'%{entreprise}%'))
+        duerp_ids = list(db.session.execute(requete).scalars())
+        # Les processus du pool ouvrent leurs propres connexions
+        db.engine.dispose()
+    return duerp_ids
+
+
+def charger_manifeste(dossier):
+    """Entrées du manifeste du lot précédent, par identifiant de DUERP"""
+    try:
+        with open(os.path.join(dossier, MANIFESTE), encoding='utf-8') as f:
+            return {entree['duerp_id']: entree for entree in json.load(f).get('documents', [])}
+    except (OSError, ValueError):
+        return {}
+
+
+def creer_zip(chemin, dossier, documents):
+    """Regroupe le manifeste et les documents générés dans une archive ZIP"""
+    chemin = os.path.abspath(chemin)
+    descripteur, temporaire = tempfile.mkstemp(dir=os.path.dirname(chemin), suffix='.tmp')
+    os.close(descripteur)
+    try:
+        with zipfile.ZipFile(temporaire, 'w') as archive:
+            archive.write(os.path.join(dossier, MANIFESTE), MANIFESTE, compress_type=zipfile.ZIP_DEFLATED)
+            for entree in documents:
+                if entree['etat'] != 'erreur':
+                    # PDF et DOCX sont déjà compressés
+                    archive.write(os.path.join(dossier, entree['fichier']), entree['fichier'])
+        os.replace(temporaire, chemin)
+    except BaseException:
+        os.unlink(temporaire)
+        raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Génération par lot des documents DUERP')
+    parser.add_argument('--format', choices=['pdf', 'docx'], default='pdf', help='Format des documents')
+    parser.add_argument('--dossier', help='Dossier de sortie (par défaut : generated_documents/lot)')
+    parser.add_argument('--statut', action='append', help='Statut des DUERP à générer (répétable)')
+    parser.add_argument('--id', type=int, action='append', dest='ids', help='Identifiant de DUERP (répétable)')
+    parser.add_argument('--entreprise', help='Filtre sur le nom de l\'entreprise')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Nombre de processus')
+    parser.add_argument('--force', action='store_true', help='Régénère aussi les DUERP inchangés')
+    parser.add_argument('--zip', help='Chemin de l\'archive ZIP à produire')
+    parser.add_argument('--profil-memoire', action='store_true',
+                        help='Mesure le pic mémoire de chaque rendu (plus lent)')
+    args = parser.parse_args(argv)
+
+    env = os.getenv('FLASK_ENV', 'development')
+    app = load_create_app()(env)
+    dossier = os.path.abspath(args.dossier or os.path.join(app.config['GENERATED_DOCS_FOLDER'], 'lot'))
+    os.makedirs(dossier, exist_ok=True)
+    memoire = args.profil_memoire or app.config['DOCUMENT_PROFILE_MEMORY']
+
+    duerp_ids = selectionner(app, args.statut, args.ids, args.entreprise)
+    precedents = charger_manifeste(dossier)
+    print(f"📄 {len(duerp_ids)} DUERP à traiter ({args.format}, {args.workers} processus) dans {dossier}")
+
+    debut = time.perf_counter()
+    documents = []
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_initialiser, initargs=(env,)) as pool:
+        taches = {
+            pool.submit(
+                generer_document, duerp_id, args.format, dossier, precedents.get(duerp_id), args.force, memoire
+            ): duerp_id
+            for duerp_id in duerp_ids
+        }
+        for tache in as_completed(taches):
+            try:
+                entree = tache.result()
+            except Exception as e:
+                # Processus du pool interrompu
+                entree = {'duerp_id': taches[tache], 'etat': 'erreur', 'erreur': str(e)}
+            documents.append(entree)
+            print(f"  DUERP {entree['duerp_id']} : {entree['etat']}"
+                  + (f" ({entree['erreur']})" if entree.get('erreur') else ''))
+
+    documents.sort(key=lambda entree: entree['duerp_id'])
+    totaux = {etat: sum(1 for e in documents if e['etat'] == etat) for etat in ('généré', 'inchangé', 'erreur')}
+    manifeste = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'format': args.format,
+        'workers': args.workers,
+        'duree': round(time.perf_counter() - debut, 3),
+        'totaux': totaux,
+        'taille_totale': sum(e.get('taille') or 0 for e in documents),
+        'documents': documents
+    }
+    _ecrire(os.path.join(dossier, MANIFESTE), json.dumps(manifeste, ensure_ascii=False, indent=2).encode('utf-8'))
+
+    if args.zip:
+        creer_zip(args.zip, dossier, documents)
+
+    print(f"✅ {totaux['généré']} générés, {totaux['inchangé']} inchangés, {totaux['erreur']} en erreur "
+          f"en {manifeste['duree']} s")
+    return 1 if totaux['erreur'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
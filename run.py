@@ -2,20 +2,42 @@
 """
 Script de lancement de l'application QHSE
 """
+import importlib.util
 import os
 import sys
 
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend')
+
 # Ajouter le répertoire backend au path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def load_create_app():
+    """
+    Charge la factory create_app définie dans backend/app.py
+
+    Le paquet backend/app/ masque le module backend/app.py à l'import : le
+    module est donc chargé depuis son chemin.
+    """
+    spec = importlib.util.spec_from_file_location('qhse_app', os.path.join(BACKEND_DIR, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.create_app
 
-from backend.app import create_app
 
 if __name__ == '__main__':
     # Obtenir le nom de l'environnement
     env = os.getenv('FLASK_ENV', 'development')
 
+    if env == 'production':
+        # Serveur multi-processus : l'application est créée dans chaque worker
+        from server import serve
+        print("🚀 Démarrage du serveur de production QHSE")
+        serve(load_create_app(), env)
+        sys.exit(0)
+
     # Créer l'application
-    app = create_app(env)
+    app = load_create_app()(env)
 
     # Lancer le serveur
     print(f"🚀 Démarrage de l'application QHSE en mode {env}")